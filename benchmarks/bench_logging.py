@@ -0,0 +1,106 @@
+"""
+Per-request CPU cost of logging in development vs production mode.
+
+Transforms a page of clinical study results with ClinicalStudyCustomTransformer,
+plus the request-level logs of the search route, once with the development
+setup (DEBUG to a stream) and once with the production setup (INFO through the
+queue). Output goes to /dev/null so only the logging work is measured.
+
+    python benchmarks/bench_logging.py [requests] [results_per_page]
+"""
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logging_config import LOG_FORMAT, DroppingQueueHandler
+from services.search.base import SearchQuery, SearchResult
+from services.search.transformers import ClinicalStudyCustomTransformer
+
+logger = logging.getLogger("routes.search")
+
+def make_results(count: int):
+    """A page of clinical study results shaped like the provider's output"""
+    query = SearchQuery(terms=["cancer"], filters={}, page=1, per_page=count)
+    results = []
+    for i in range(count):
+        results.append(SearchResult(
+            id=str(i),
+            type="clinical_study",
+            title=f"Study {i} of a cancer treatment",
+            description="A randomized, double-blind study " * 5,
+            relevance_score=1.0 / (i + 1),
+            data={
+                "status": "Recruiting", "phase": "Phase 2", "drug": f"Drug {i}",
+                "institution": "General Hospital", "participant_count": 100 + i,
+                "start_date": "2024-01-01", "end_date": "2026-01-01",
+                "indication_category": "Oncology", "procedure_category": "Infusion",
+                "severity": "Moderate", "risk_level": "Low", "duration": "24 months",
+            },
+            data_products=[
+                {"id": i * 10 + j, "title": f"Dataset {j}", "type": "Tabular",
+                 "format": "CSV", "size": "1.2 GB", "access_level": "restricted"}
+                for j in range(2)
+            ],
+            _query=query,
+            _total=count,
+        ))
+    return results
+
+def handle_request(transformer, results):
+    """The logging a search request does around the transform"""
+    logger.debug("Search request received: %s", {"query": "cancer", "collection_type": "clinical_study"})
+    logger.debug("User info: %s", {"id": 1, "role": "researcher"})
+    response = transformer.transform(results)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Result keys: %s", list(response))
+        logger.debug("First result keys: %s", list(response["results"][0]))
+    logger.info("Search completed with %d results", len(response["results"]))
+    return response
+
+def measure(requests: int, results) -> float:
+    """CPU seconds per request"""
+    transformer = ClinicalStudyCustomTransformer()
+    handle_request(transformer, results)
+    start = time.process_time()
+    for _ in range(requests):
+        handle_request(transformer, results)
+    return (time.process_time() - start) / requests
+
+def run(requests: int, page_size: int):
+    results = make_results(page_size)
+    root = logging.getLogger()
+    devnull = open(os.devnull, "w")
+    stream_handler = logging.StreamHandler(devnull)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    # Development: DEBUG, formatted and written on the request thread
+    root.setLevel(logging.DEBUG)
+    root.addHandler(stream_handler)
+    development = measure(requests, results)
+    root.removeHandler(stream_handler)
+
+    # Production: INFO, the listener thread formats and writes. Its CPU is still
+    # counted by process_time, so the difference is work removed, not moved.
+    root.setLevel(logging.INFO)
+    queue_handler = DroppingQueueHandler(queue.Queue(10000))
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    root.addHandler(queue_handler)
+    listener.start()
+    production = measure(requests, results)
+    listener.stop()
+    root.removeHandler(queue_handler)
+    devnull.close()
+
+    print(f"{requests} requests of {page_size} results")
+    print(f"development: {development * 1e6:9.1f} us CPU per request")
+    print(f"production:  {production * 1e6:9.1f} us CPU per request")
+    print(f"saved:       {(development - production) * 1e6:9.1f} us ({1 - production / development:.0%})")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100)
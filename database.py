@@ -25,6 +25,31 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Create base class for declarative models
 Base = declarative_base()
 
+# Async engine for the search path, created on first use (requires asyncpg)
+ASYNC_DATABASE_DRIVER = "postgresql+asyncpg"
+_async_sessionmaker = None
+
+def async_database_url(url: str) -> str:
+    """Rewrite a PostgreSQL URL to use the asyncpg driver"""
+    scheme, _, rest = url.partition("://")
+    if scheme.split("+")[0] not in ("postgresql", "postgres"):
+        raise ValueError(f"No async driver configured for {scheme} databases")
+    return f"{ASYNC_DATABASE_DRIVER}://{rest}"
+
+def get_async_sessionmaker():
+    """Return the async session factory, creating the async engine on first use"""
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        async_engine = create_async_engine(
+            async_database_url(SQLALCHEMY_DATABASE_URL),
+            pool_pre_ping=True,
+            pool_recycle=300
+        )
+        _async_sessionmaker = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        logger.info("Async database engine created")
+    return _async_sessionmaker
+
 def get_db():
     """Dependency to get database session"""
     db = SessionLocal()
@@ -33,6 +58,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Dependency to get an async database session"""
+    async with get_async_sessionmaker()() as db:
+        yield db
+
 def init_db():
     """Initialize database tables"""
     try:
@@ -0,0 +1,40 @@
+"""
+Fast JSON responses for the search API.
+
+FastAPI runs returned dicts through jsonable_encoder and then the stdlib json
+module. FastJSONResponse serializes with orjson instead, which handles
+datetimes, dates, UUIDs, enums and dataclasses natively; anything else goes
+through jsonable_encoder, so the output has the same fields and values as the
+default JSONResponse. Endpoints return FastJSONResponse instances directly,
+since a returned dict is still passed through jsonable_encoder.
+
+Without orjson the stdlib json module is used with JSONResponse's settings.
+"""
+import json
+from typing import Any
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps_json(content: Any) -> bytes:
+    """Compact UTF-8 JSON, as rendered by JSONResponse"""
+    if orjson is not None:
+        return orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+        default=jsonable_encoder
+    ).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
@@ -0,0 +1,97 @@
+"""
+Application logging setup.
+
+LOG_MODE=development (the default) logs DEBUG records straight to stderr, as
+before. LOG_MODE=production is meant for serving traffic:
+
+- the level defaults to INFO, so level-guarded hot-path debug logs cost one
+  isEnabledFor check and their arguments are never formatted;
+- records below WARNING are sampled at LOG_SAMPLE_RATE;
+- request threads only put records on a queue (QueueHandler); a
+  QueueListener thread formats and writes them, so slow stderr or log
+  shipping never blocks a request.
+"""
+import atexit
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Optional
+
+LOG_MODE = os.environ.get("LOG_MODE", "development")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG" if LOG_MODE != "production" else "INFO").upper()
+
+# Fraction of records below WARNING kept in production; warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+
+# Records waiting for the listener; when full, new records are dropped instead of blocking
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_configured = False
+
+class SamplingFilter(logging.Filter):
+    """Keeps every record at or above WARNING and a random `rate` share of the rest"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves record formatting to the listener and drops records when the queue is full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, as they may change once the caller moves on, but leave
+        # timestamps and exception text to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def configure_logging(mode: str = None, level: str = None):
+    """Configure the root logger once for the given mode; later calls are no-ops"""
+    global _listener, _configured
+    if _configured:
+        return
+    _configured = True
+
+    mode = mode or LOG_MODE
+    root = logging.getLogger()
+    root.setLevel(level or LOG_LEVEL)
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    if mode != "production":
+        root.addHandler(stream_handler)
+        return
+
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    if LOG_SAMPLE_RATE < 1.0:
+        queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -20,9 +20,10 @@ from search_examples import (
 )
 from api_responses import SEARCH_RESPONSES  # Import the response patterns
 from routes.auth import generate_csrf_token, csrf_protect, CurrentUser, get_current_user_for_template
+from logging_config import configure_logging
 
-# Configure logging first thing
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging first thing; LOG_MODE=production switches to the queued, sampled setup
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Custom OpenAPI to add security schemes
@@ -562,6 +563,26 @@ async def startup_event():
     import services.search.init_registry
     logger.info("Search registries initialized.")
 
+    # Build the autocomplete tries in the background
+    from services.search import config as search_config
+    if search_config.SUGGEST_INDEX_ENABLED:
+        from services.search.suggest import start_suggestion_refresher
+        start_suggestion_refresher()
+        logger.info("Suggestion index refresher started.")
+
+    # Create upcoming search history partitions and expire old ones in the background
+    from services.search.history_partitions import start_history_maintenance
+    start_history_maintenance()
+    logger.info("Search history maintenance started.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Write the search history entries still queued
+    """
+    from services.search.history import history_writer
+    await history_writer.stop()
+
 @app.get("/api/debug/routes", include_in_schema=False)
 async def debug_routes():
     """
@@ -0,0 +1,53 @@
+"""
+Migration script to index data_products by (study_id, id) for the per-study top-N data products of search results
+"""
+import sys
+import os
+from sqlalchemy import create_engine, text
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Database URL from environment or default
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://localhost/biomed_search")
+
+INDEX_NAME = "idx_data_products_study_id_id"
+
+def run_migration():
+    """Build the (study_id, id) index on data_products concurrently"""
+    try:
+        # Create connection
+        logger.info(f"Connecting to database: {DATABASE_URL.split('://')[0]}://*****")
+        engine = create_engine(DATABASE_URL)
+
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # A failed concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+            invalid = conn.execute(text("""
+                SELECT 1 FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :name AND NOT i.indisvalid
+            """), {"name": INDEX_NAME}).scalar()
+            if invalid:
+                logger.info(f"Dropping invalid index {INDEX_NAME} left by a previous run")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME};"))
+
+            logger.info(f"Building {INDEX_NAME} on data_products(study_id, id) concurrently")
+            conn.execute(text(f"""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME}
+                ON data_products (study_id, id);
+            """))
+
+        logger.info("Schema migration completed successfully")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    run_migration()
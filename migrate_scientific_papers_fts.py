@@ -0,0 +1,64 @@
+"""
+Migration script to add the weighted full-text search vector and its GIN index to scientific_papers
+"""
+import sys
+import os
+from sqlalchemy import create_engine, text
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models.database_models import SCIENTIFIC_PAPER_SEARCH_VECTOR_SQL
+
+# Database URL from environment or default
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://localhost/biomed_search")
+
+INDEX_NAME = "idx_scientific_papers_search_vector"
+
+def run_migration():
+    """Add the generated search_vector column and build its GIN index concurrently"""
+    try:
+        # Create connection
+        logger.info(f"Connecting to database: {DATABASE_URL.split('://')[0]}://*****")
+        engine = create_engine(DATABASE_URL)
+
+        # Adding a stored generated column rewrites the table, so it runs in its own transaction
+        with engine.begin() as conn:
+            logger.info("Adding generated search_vector column to scientific_papers table")
+            conn.execute(text(f"""
+                ALTER TABLE scientific_papers
+                ADD COLUMN IF NOT EXISTS search_vector tsvector
+                GENERATED ALWAYS AS ({SCIENTIFIC_PAPER_SEARCH_VECTOR_SQL}) STORED;
+            """))
+
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # A failed concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+            invalid = conn.execute(text("""
+                SELECT 1 FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :name AND NOT i.indisvalid
+            """), {"name": INDEX_NAME}).scalar()
+            if invalid:
+                logger.info(f"Dropping invalid index {INDEX_NAME} left by a previous run")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME};"))
+
+            logger.info(f"Building {INDEX_NAME} concurrently")
+            conn.execute(text(f"""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME}
+                ON scientific_papers USING GIN (search_vector);
+            """))
+
+        logger.info("Schema migration completed successfully")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    run_migration()
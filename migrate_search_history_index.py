@@ -0,0 +1,59 @@
+"""
+Migration script to index search_history by (user_id, last_used DESC, id DESC) for the paginated history API
+"""
+import sys
+import os
+from sqlalchemy import create_engine, text
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Database URL from environment or default
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://localhost/biomed_search")
+
+INDEX_NAME = "idx_search_history_user_last_used"
+
+# The (user_id, created_at DESC, id DESC) index history pages were first ordered by
+REPLACED_INDEX_NAME = "idx_search_history_user_created"
+
+def run_migration():
+    """Build the (user_id, last_used DESC, id DESC) index on search_history concurrently"""
+    try:
+        # Create connection
+        logger.info(f"Connecting to database: {DATABASE_URL.split('://')[0]}://*****")
+        engine = create_engine(DATABASE_URL)
+
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # A failed concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+            invalid = conn.execute(text("""
+                SELECT 1 FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :name AND NOT i.indisvalid
+            """), {"name": INDEX_NAME}).scalar()
+            if invalid:
+                logger.info(f"Dropping invalid index {INDEX_NAME} left by a previous run")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME};"))
+
+            logger.info(f"Building {INDEX_NAME} on search_history(user_id, last_used DESC, id DESC) concurrently")
+            conn.execute(text(f"""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME}
+                ON search_history (user_id, last_used DESC, id DESC);
+            """))
+
+            logger.info(f"Dropping {REPLACED_INDEX_NAME}")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {REPLACED_INDEX_NAME};"))
+
+        logger.info("Schema migration completed successfully")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,122 @@
+"""
+Migration script to convert search_history into a table range-partitioned by month.
+
+Renames the existing table, creates the partitioned search_history with one
+partition per month from the oldest row to HISTORY_PARTITIONS_AHEAD months
+ahead, copies every row into the partition of the month it was last used in
+(history pages prune partitions by last_used), moves the id sequence over and
+drops the old table. Also creates search_history_rollup and the
+search_history_saved partition saved searches are kept in once their month expires.
+Run it after migrate_search_history_upsert.py, with the application stopped:
+the copy holds an exclusive lock on search_history until it commits.
+"""
+import sys
+import os
+from datetime import datetime
+from sqlalchemy import create_engine, text
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models.database_models import SearchHistoryRollup, history_month
+from services.search import config
+from services.search.history_partitions import add_months, create_partitions, create_saved_partition
+
+# Database URL from environment or default
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://localhost/biomed_search")
+
+COLUMNS = ("id, user_id, query, category, filters, results_count, created_at, "
+           "is_saved, last_used, use_count, query_hash, filters_hash")
+
+# The same columns read from the old table, whose filters may be JSONB (schema.sql)
+SOURCE_COLUMNS = ("id, user_id, query, category, filters::json, results_count, created_at, "
+                  "is_saved, last_used, use_count, query_hash, filters_hash")
+
+def run_migration():
+    """Partition search_history by month and create the rollup table"""
+    try:
+        # Create connection
+        logger.info(f"Connecting to database: {DATABASE_URL.split('://')[0]}://*****")
+        engine = create_engine(DATABASE_URL)
+
+        logger.info("Creating search_history_rollup")
+        SearchHistoryRollup.__table__.create(engine, checkfirst=True)
+
+        with engine.begin() as conn:
+            partitioned = conn.execute(text("""
+                SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'search_history'::regclass
+            """)).scalar()
+            current = history_month(datetime.utcnow())
+            if partitioned:
+                logger.info("search_history is already partitioned, creating upcoming partitions only")
+                create_saved_partition(conn)
+                create_partitions(conn, current, add_months(current, config.HISTORY_PARTITIONS_AHEAD))
+                return
+
+            conn.execute(text("LOCK TABLE search_history IN ACCESS EXCLUSIVE MODE"))
+            conn.execute(text("ALTER TABLE search_history RENAME TO search_history_unpartitioned"))
+            # Free the index names for the partitioned table
+            conn.execute(text("ALTER TABLE search_history_unpartitioned DROP CONSTRAINT IF EXISTS search_history_pkey"))
+            for index_name in ("idx_search_history_user_id", "idx_search_history_user_created",
+                               "idx_search_history_user_last_used", "uq_search_history_user_query",
+                               "ix_search_history_id"):
+                conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+
+            logger.info("Creating partitioned search_history")
+            conn.execute(text("""
+                CREATE TABLE search_history (
+                    id INTEGER NOT NULL DEFAULT nextval('search_history_id_seq'),
+                    month DATE NOT NULL,
+                    user_id INTEGER REFERENCES users(id),
+                    query VARCHAR,
+                    category VARCHAR,
+                    filters JSON,
+                    results_count INTEGER,
+                    created_at TIMESTAMP,
+                    is_saved BOOLEAN DEFAULT FALSE,
+                    last_used TIMESTAMP,
+                    use_count INTEGER DEFAULT 0,
+                    query_hash VARCHAR(64),
+                    filters_hash VARCHAR(64),
+                    PRIMARY KEY (id, month)
+                ) PARTITION BY RANGE (month)
+            """))
+            conn.execute(text("ALTER SEQUENCE search_history_id_seq OWNED BY search_history.id"))
+            conn.execute(text("CREATE INDEX ix_search_history_id ON search_history (id)"))
+            conn.execute(text("""
+                CREATE INDEX idx_search_history_user_last_used
+                ON search_history (user_id, last_used DESC, id DESC)
+            """))
+            conn.execute(text("""
+                CREATE UNIQUE INDEX uq_search_history_user_query
+                ON search_history (user_id, query_hash, category, filters_hash, month)
+            """))
+
+            oldest = conn.execute(text("SELECT min(coalesce(last_used, created_at)) FROM search_history_unpartitioned")).scalar()
+            first = history_month(oldest) if oldest else current
+            create_saved_partition(conn)
+            created = create_partitions(conn, min(first, current), add_months(current, config.HISTORY_PARTITIONS_AHEAD))
+            logger.info(f"Created {created} monthly partitions")
+
+            copied = conn.execute(text(f"""
+                INSERT INTO search_history (month, {COLUMNS})
+                SELECT date_trunc('month', coalesce(last_used, created_at, now()))::date, {SOURCE_COLUMNS}
+                FROM search_history_unpartitioned
+            """)).rowcount
+            logger.info(f"Copied {copied} search history rows")
+
+            conn.execute(text("DROP TABLE search_history_unpartitioned"))
+
+        logger.info("Schema migration completed successfully")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    run_migration()
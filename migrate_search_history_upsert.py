@@ -0,0 +1,144 @@
+"""
+Migration script to aggregate repeated searches in search_history.
+
+Adds the query_hash and filters_hash columns, backfills them with the hashes the
+application computes, merges existing duplicates of (user_id, query_hash,
+category, filters_hash) into their oldest row and builds the unique index the
+history upserts conflict on. Safe to re-run; it only touches rows still missing
+hashes and groups that still have duplicates.
+"""
+import sys
+import os
+from sqlalchemy import create_engine, text
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.search.history import query_hash, filters_hash
+
+# Database URL from environment or default
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://localhost/biomed_search")
+
+INDEX_NAME = "uq_search_history_user_query"
+
+# Rows hashed per transaction during the backfill
+BACKFILL_BATCH_SIZE = 5000
+
+# Merge and index build attempts; writes from servers still running the old code can
+# add duplicates between the merge and the index build
+MAX_ATTEMPTS = 3
+
+def backfill_hashes(engine):
+    """Hash every row that has no hashes yet, in batches"""
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text("""
+                SELECT id, query, filters FROM search_history
+                WHERE query_hash IS NULL OR filters_hash IS NULL
+                ORDER BY id LIMIT :limit
+            """), {"limit": BACKFILL_BATCH_SIZE}).fetchall()
+            if not rows:
+                break
+            conn.execute(text("""
+                UPDATE search_history
+                SET query_hash = :query_hash, filters_hash = :filters_hash, category = coalesce(category, '')
+                WHERE id = :id
+            """), [
+                {"id": row.id, "query_hash": query_hash(row.query), "filters_hash": filters_hash(row.filters)}
+                for row in rows
+            ])
+        total += len(rows)
+        logger.info(f"Hashed {total} search history rows")
+
+def merge_duplicates(engine):
+    """Fold every duplicate group into its oldest row and delete the rest"""
+    with engine.begin() as conn:
+        merged = conn.execute(text("""
+            WITH groups AS (
+                SELECT min(id) AS keep_id,
+                       sum(greatest(coalesce(use_count, 0), 1)) AS use_count,
+                       min(created_at) AS created_at,
+                       max(last_used) AS last_used,
+                       bool_or(coalesce(is_saved, false)) AS is_saved,
+                       (array_agg(results_count ORDER BY last_used DESC NULLS LAST, id DESC))[1] AS results_count
+                FROM search_history
+                GROUP BY user_id, query_hash, category, filters_hash
+                HAVING count(*) > 1
+            )
+            UPDATE search_history h
+            SET use_count = g.use_count, created_at = g.created_at, last_used = g.last_used,
+                is_saved = g.is_saved, results_count = g.results_count
+            FROM groups g
+            WHERE h.id = g.keep_id
+        """)).rowcount
+        deleted = conn.execute(text("""
+            DELETE FROM search_history h
+            USING search_history k
+            WHERE k.user_id = h.user_id
+              AND k.query_hash = h.query_hash
+              AND k.category = h.category
+              AND k.filters_hash = h.filters_hash
+              AND k.id < h.id
+        """)).rowcount
+    logger.info(f"Merged {deleted} duplicate rows into {merged} search history entries")
+
+def build_index(engine):
+    """Build the unique aggregation index concurrently"""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # A failed concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+        invalid = conn.execute(text("""
+            SELECT 1 FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :name AND NOT i.indisvalid
+        """), {"name": INDEX_NAME}).scalar()
+        if invalid:
+            logger.info(f"Dropping invalid index {INDEX_NAME} left by a previous run")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME};"))
+
+        logger.info(f"Building {INDEX_NAME} on search_history(user_id, query_hash, category, filters_hash) concurrently")
+        conn.execute(text(f"""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME}
+            ON search_history (user_id, query_hash, category, filters_hash);
+        """))
+
+def run_migration():
+    """Add and backfill the hash columns, merge duplicates and build the unique index"""
+    try:
+        # Create connection
+        logger.info(f"Connecting to database: {DATABASE_URL.split('://')[0]}://*****")
+        engine = create_engine(DATABASE_URL)
+
+        with engine.begin() as conn:
+            logger.info("Adding query_hash and filters_hash columns to search_history")
+            conn.execute(text("""
+                ALTER TABLE search_history
+                ADD COLUMN IF NOT EXISTS query_hash VARCHAR(64),
+                ADD COLUMN IF NOT EXISTS filters_hash VARCHAR(64);
+            """))
+
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            backfill_hashes(engine)
+            merge_duplicates(engine)
+            try:
+                build_index(engine)
+                break
+            except Exception as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                logger.warning(f"Index build failed, merging again (attempt {attempt}): {str(e)}")
+
+        logger.info("Schema migration completed successfully")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,63 @@
+"""
+Migration script to enable pg_trgm and build the trigram indexes used by the 'trigram' search mode
+"""
+import sys
+import os
+from sqlalchemy import create_engine, text
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Database URL from environment or default
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://localhost/biomed_search")
+
+# (index name, table, column) for every trigram-matched column
+TRIGRAM_INDEXES = [
+    ("idx_clinical_study_title_trgm", "clinical_study", "title"),
+    ("idx_clinical_study_drug_trgm", "clinical_study", "drug"),
+    ("idx_scientific_papers_title_trgm", "scientific_papers", "title"),
+    ("idx_data_domain_domain_name_trgm", "data_domain_metadata", "domain_name"),
+]
+
+def run_migration():
+    """Create the pg_trgm extension and build GIN gin_trgm_ops indexes concurrently"""
+    try:
+        # Create connection
+        logger.info(f"Connecting to database: {DATABASE_URL.split('://')[0]}://*****")
+        engine = create_engine(DATABASE_URL)
+
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            logger.info("Enabling pg_trgm extension")
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
+
+            for index_name, table, column in TRIGRAM_INDEXES:
+                # A failed concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+                invalid = conn.execute(text("""
+                    SELECT 1 FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE c.relname = :name AND NOT i.indisvalid
+                """), {"name": index_name}).scalar()
+                if invalid:
+                    logger.info(f"Dropping invalid index {index_name} left by a previous run")
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};"))
+
+                logger.info(f"Building {index_name} on {table}({column}) concurrently")
+                conn.execute(text(f"""
+                    CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name}
+                    ON {table} USING GIN ({column} gin_trgm_ops);
+                """))
+
+        logger.info("Schema migration completed successfully")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    run_migration()
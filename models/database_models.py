@@ -1,8 +1,20 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Float, ForeignKey, Boolean
-from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy import Column, Integer, String, Date, DateTime, JSON, Float, ForeignKey, Boolean, Computed, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
+from datetime import date, datetime
 from database import Base
 
+# Text search configuration used for the scientific paper full-text document
+SCIENTIFIC_PAPER_TEXT_SEARCH_CONFIG = "english"
+
+# Weighted full-text document for scientific papers: title > keywords > abstract > journal
+SCIENTIFIC_PAPER_SEARCH_VECTOR_SQL = (
+    f"setweight(to_tsvector('{SCIENTIFIC_PAPER_TEXT_SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+    f"setweight(to_tsvector('{SCIENTIFIC_PAPER_TEXT_SEARCH_CONFIG}', coalesce(keywords::text, '')), 'B') || "
+    f"setweight(to_tsvector('{SCIENTIFIC_PAPER_TEXT_SEARCH_CONFIG}', coalesce(abstract, '')), 'C') || "
+    f"setweight(to_tsvector('{SCIENTIFIC_PAPER_TEXT_SEARCH_CONFIG}', coalesce(journal, '')), 'D')"
+)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -14,10 +26,27 @@ class User(Base):
     search_history = relationship("SearchHistory", back_populates="user")
     collections = relationship("Collection", back_populates="user")
 
+def history_month(moment: datetime = None):
+    """First day of the month a search_history row belongs to, its partition key"""
+    return (moment or datetime.utcnow()).date().replace(day=1)
+
+# month of the saved searches carried out of expired history partitions; they live in
+# the search_history_saved partition, which retention never drops
+SAVED_SEARCH_MONTH = date(1970, 1, 1)
+
 class SearchHistory(Base):
+    """
+    Searches per user, range-partitioned by month (one search_history_YYYY_MM
+    partition per month). Repeats of a search within a month are aggregated
+    into one row; partitions past the retention period are folded into
+    SearchHistoryRollup and dropped, except for saved searches, which move to
+    the search_history_saved partition with their ids.
+    """
     __tablename__ = "search_history"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # The primary key of a partitioned table must include the partition key
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    month = Column(Date, primary_key=True, default=history_month)
     user_id = Column(Integer, ForeignKey("users.id"))
     query = Column(String)
     category = Column(String)
@@ -27,8 +56,52 @@ class SearchHistory(Base):
     is_saved = Column(Boolean, default=False)
     last_used = Column(DateTime, default=datetime.utcnow)
     use_count = Column(Integer, default=0)
+    # sha256 of the normalized query and of the canonical filters JSON; repeats of a search are
+    # aggregated into one row per month on (user_id, query_hash, category, filters_hash, month)
+    query_hash = Column(String(64))
+    filters_hash = Column(String(64))
     user = relationship("User", back_populates="search_history")
 
+    __table_args__ = (
+        Index('uq_search_history_user_query', 'user_id', 'query_hash', 'category', 'filters_hash', 'month', unique=True),
+        {'postgresql_partition_by': 'RANGE (month)'},
+    )
+
+# Keyset pagination of a user's history, most recently used first
+Index('idx_search_history_user_last_used', SearchHistory.user_id, SearchHistory.last_used.desc(), SearchHistory.id.desc())
+
+class SearchHistoryRollup(Base):
+    """All-time aggregates per user and search of the history partitions dropped by retention"""
+    __tablename__ = "search_history_rollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    query = Column(String)
+    category = Column(String)
+    filters = Column(JSON)
+    query_hash = Column(String(64))
+    filters_hash = Column(String(64))
+    use_count = Column(Integer, default=0)
+    results_count = Column(Integer)
+    first_used = Column(DateTime)
+    last_used = Column(DateTime)
+
+    __table_args__ = (
+        Index('uq_search_history_rollup_user_query', 'user_id', 'query_hash', 'category', 'filters_hash', unique=True),
+    )
+
+class SavedSearchSnapshot(Base):
+    """Materialized first page of results of a saved search"""
+    __tablename__ = "saved_search_snapshots"
+
+    # search_history.id; not a foreign key, as the history's primary key also holds its month
+    history_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    result_ids = Column(JSON)
+    total = Column(Integer)
+    first_page = Column(JSON)  # The transformed search response of the first page
+    refreshed_at = Column(DateTime, default=datetime.utcnow)
+
 class ClinicalStudy(Base):
     __tablename__ = "clinical_study"
 
@@ -91,6 +164,11 @@ class DataProduct(Base):
     # Relationship with collections through collection_items
     collections = relationship("CollectionItem", back_populates="data_product")
 
+    # Serves the per-study top-N data products of search results in id order
+    __table_args__ = (
+        Index('idx_data_products_study_id_id', 'study_id', 'id'),
+    )
+
 class Collection(Base):
     __tablename__ = "collections"
 
@@ -131,6 +209,12 @@ class ScientificPaper(Base):
     citations_count = Column(Integer, default=0)
     reference_list = Column(JSON)  # List of referenced papers (renamed from 'references')
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Generated by PostgreSQL; deferred so regular searches don't load it
+    search_vector = deferred(Column(TSVECTOR, Computed(SCIENTIFIC_PAPER_SEARCH_VECTOR_SQL, persisted=True)))
+
+    __table_args__ = (
+        Index('idx_scientific_papers_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
 class DataDomainMetadata(Base):
     __tablename__ = "data_domain_metadata"
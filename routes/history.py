@@ -1,7 +1,7 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import sys
 import os
 from datetime import datetime
@@ -11,7 +11,9 @@ from pydantic import BaseModel, Field
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database import get_db
-from routes import auth
+from json_response import FastJSONResponse
+from routes.search import get_authenticated_user
+from services.search.history import history_page
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -21,6 +23,7 @@ class HistoryEntryBase(BaseModel):
     query: str
     category: str = None
     filters: Dict[str, Any] = None
+    is_saved: bool = False
     
 class HistoryEntry(HistoryEntryBase):
     id: int
@@ -42,10 +45,16 @@ router = APIRouter()
 
 # Define endpoints
 @router.get("/search-history", 
-    response_model=List[Dict[str, Any]],
+    response_model=Dict[str, Any],
+    response_class=FastJSONResponse,
     summary="Get search history",
     description="""
-    Retrieve the search history for the authenticated user.
+    Retrieve the search history for the authenticated user, most recently used first,
+    one page at a time. Repeats of a search are counted in `use_count` of one entry.
+    
+    Pass the `next_cursor` of a response as `cursor` to get the following page; it is
+    `null` on the last page. Filter with `category` and a `since` (inclusive) / `until`
+    (exclusive) range on the time an entry was last used.
     
     ## Authentication
     This endpoint requires authentication. You can provide authentication using:
@@ -56,13 +65,19 @@ router = APIRouter()
     2. **Cookie Authentication** - If you're logged in through the browser interface.
     """
 )
-async def get_search_history(db: Session = Depends(get_db), user_info: Dict = Depends(auth.get_current_user)):
+async def get_search_history(
+    limit: int = Query(20, ge=1, le=100, description="Entries per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    category: Optional[str] = Query(None, description="Only entries of this collection"),
+    since: Optional[datetime] = Query(None, description="Only entries last used at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only entries last used before this time"),
+    db: Session = Depends(get_db),
+    user_info: Dict = Depends(get_authenticated_user)
+):
     """
-    Get the search history for the current user
+    Get a page of the search history for the current user
     """
     try:
-        from models.database_models import SearchHistory
-        
         # Get user ID from authentication
         user_id = user_info.get("id")
         
@@ -73,28 +88,14 @@ async def get_search_history(db: Session = Depends(get_db), user_info: Dict = De
                 detail="Authentication required"
             )
         
-        # Query search history for the current user
-        history_entries = db.query(SearchHistory)\
-            .filter(SearchHistory.user_id == user_id)\
-            .order_by(SearchHistory.created_at.desc())\
-            .all()
-        
-        # Convert to response format
-        result = []
-        for entry in history_entries:
-            result.append({
-                "id": entry.id,
-                "query": entry.query,
-                "category": entry.category,
-                "filters": entry.filters if entry.filters else {},
-                "results_count": entry.results_count,
-                "created_at": entry.created_at,
-                "is_saved": entry.is_saved,
-                "last_used": entry.last_used,
-                "use_count": entry.use_count
-            })
-        
-        return result
+        return FastJSONResponse(history_page(db, user_id, limit, cursor, category, since, until))
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to retrieve search history: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -112,12 +113,12 @@ async def get_search_history(db: Session = Depends(get_db), user_info: Dict = De
     This endpoint requires authentication via Bearer token or session cookie.
     """
 )
-async def save_search(search_data: HistoryEntryBase, db: Session = Depends(get_db), user_info: Dict = Depends(auth.get_current_user)):
+async def save_search(search_data: HistoryEntryBase, db: Session = Depends(get_db), user_info: Dict = Depends(get_authenticated_user)):
     """
     Save a search to history
     """
     try:
-        from models.database_models import SearchHistory
+        from services.search.history import history_entry, upsert_history
         
         # Get user ID from authentication
         user_id = user_info.get("id")
@@ -129,20 +130,11 @@ async def save_search(search_data: HistoryEntryBase, db: Session = Depends(get_d
                 detail="Authentication required"
             )
         
-        # Create a new search history entry
-        search_history = SearchHistory(
-            user_id=user_id,
-            query=search_data.query,
-            category=search_data.category,
-            filters=search_data.filters,
-            results_count=0,  # This will be updated when search is performed
-            created_at=datetime.utcnow(),
-            last_used=datetime.utcnow(),
-            use_count=1
-        )
-        
-        # Add and commit to the database
-        db.add(search_history)
+        # Add the search to history, or count a repeat of an entry already there;
+        # results_count is left to the searches that run it
+        entry = history_entry(user_id, search_data.query, search_data.category, search_data.filters, None,
+                              is_saved=search_data.is_saved)
+        upsert_history(db, [entry])
         db.commit()
         
         return {"success": True, "message": "Search saved to history successfully"}
@@ -1,5 +1,6 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
 from datetime import datetime
@@ -11,9 +12,13 @@ from pydantic import BaseModel, Field
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database import get_db
-from models.schemas import User
-from models.database_models import SearchHistory
-from services.auth import get_current_user
+from json_response import FastJSONResponse
+from models.database_models import SavedSearchSnapshot, SearchHistory
+from routes.search import get_authenticated_user
+from services.search.saved_searches import (
+    FEDERATED_CATEGORY, get_saved_search, is_stale, refresh_snapshot, refresh_snapshot_in_background,
+    run_federated, snapshot_summary
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -42,12 +47,25 @@ class SearchActionResponse(BaseModel):
 # Create router
 router = APIRouter()
 
+def _user_id(user_info: Dict) -> int:
+    """The authenticated user's id; session logins without one cannot have saved searches"""
+    user_id = user_info.get("id")
+    if not user_id:
+        logger.warning("User not authenticated properly or missing ID")
+        raise HTTPException(
+            status_code=401,
+            detail="Authentication required"
+        )
+    return user_id
+
 # Define endpoints
 @router.get("/saved-searches", 
     response_model=List[Dict[str, Any]],
+    response_class=FastJSONResponse,
     summary="Get saved searches",
     description="""
-    Retrieve all saved searches for the authenticated user.
+    Retrieve all saved searches for the authenticated user, most recently used first,
+    with the total and refresh time of each one's result snapshot.
     
     ## Authentication
     This endpoint requires authentication. You can provide authentication using:
@@ -58,24 +76,37 @@ router = APIRouter()
     2. **Cookie Authentication** - If you're logged in through the browser interface.
     """
 )
-async def get_saved_searches(db: Session = Depends(get_db)):
+async def get_saved_searches(db: Session = Depends(get_db), user_info: Dict = Depends(get_authenticated_user)):
     """Get all saved searches for the current user"""
     try:
-        # In a real implementation, we would filter by user_id
-        # For now, return a stub response for documentation purposes
-        return [
+        user_id = _user_id(user_info)
+
+        entries = db.query(SearchHistory)\
+            .filter(SearchHistory.user_id == user_id, SearchHistory.is_saved.is_(True))\
+            .order_by(SearchHistory.last_used.desc())\
+            .all()
+        snapshots = {
+            snapshot.history_id: snapshot
+            for snapshot in db.query(SavedSearchSnapshot).filter(SavedSearchSnapshot.user_id == user_id)
+        }
+
+        return FastJSONResponse([
             {
-                "id": 1,
-                "query": "cancer treatment",
-                "category": "clinical_study",
-                "filters": {"phase": "Phase 2"},
-                "results_count": 42,
-                "created_at": datetime.utcnow(),
+                "id": entry.id,
+                "query": entry.query,
+                "category": entry.category,
+                "filters": entry.filters if entry.filters else {},
+                "results_count": entry.results_count,
+                "created_at": entry.created_at,
                 "is_saved": True,
-                "last_used": datetime.utcnow(),
-                "use_count": 5
+                "last_used": entry.last_used,
+                "use_count": entry.use_count,
+                "snapshot": snapshot_summary(snapshots.get(entry.id))
             }
-        ]
+            for entry in entries
+        ])
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to retrieve saved searches: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -85,24 +116,51 @@ async def get_saved_searches(db: Session = Depends(get_db)):
 
 @router.post("/saved-searches/{search_id}/execute", 
     response_model=Dict[str, Any],
+    response_class=FastJSONResponse,
     summary="Execute a saved search",
     description="""
-    Execute a previously saved search by its ID and return the search parameters.
+    Execute a previously saved search by its ID. Returns the search parameters and the
+    first page of results from the saved search's snapshot.
+    
+    The first execution runs the search to build the snapshot. After that the snapshot
+    is served as is; once it is older than `SAVED_SEARCH_SNAPSHOT_MAX_AGE_SECONDS` it is
+    still served (`snapshot.stale: true`) and refreshed in the background. Federated
+    (`all`) saved searches have no snapshot and are run live every time.
     
     ## Authentication
     This endpoint requires authentication via Bearer token or session cookie.
     """
 )
-async def execute_saved_search(search_id: int, db: Session = Depends(get_db)):
+async def execute_saved_search(search_id: int, background_tasks: BackgroundTasks,
+                               db: Session = Depends(get_db), user_info: Dict = Depends(get_authenticated_user)):
     """Execute a saved search"""
     try:
-        # Stub implementation for documentation
-        return {
-            "query": "cancer treatment",
-            "category": "clinical_study",
-            "filters": {"phase": "Phase 2"},
+        user_id = _user_id(user_info)
+        entry = get_saved_search(db, user_id, search_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Saved search not found")
+
+        if entry.category == FEDERATED_CATEGORY:
+            snapshot = None
+            results = await run_federated(db, entry, user_info)
+        else:
+            snapshot = db.query(SavedSearchSnapshot).filter(SavedSearchSnapshot.history_id == entry.id).first()
+            if snapshot is None:
+                snapshot = await run_in_threadpool(refresh_snapshot, db, entry, user_info)
+            elif is_stale(snapshot):
+                background_tasks.add_task(refresh_snapshot_in_background, user_id, entry.id, user_info)
+            results = snapshot.first_page if snapshot is not None else None
+
+        return FastJSONResponse({
+            "query": entry.query,
+            "category": entry.category,
+            "filters": entry.filters if entry.filters else {},
+            "results": results,
+            "snapshot": snapshot_summary(snapshot),
             "success": True
-        }
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to execute saved search: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -114,16 +172,28 @@ async def execute_saved_search(search_id: int, db: Session = Depends(get_db)):
     response_model=SearchActionResponse,
     summary="Save a search from history",
     description="""
-    Save a search from the user's search history.
+    Save a search from the user's search history. Its result snapshot is built in the background.
     
     ## Authentication
     This endpoint requires authentication via Bearer token or session cookie.
     """
 )
-async def save_search(search_id: int, db: Session = Depends(get_db)):
+async def save_search(search_id: int, background_tasks: BackgroundTasks,
+                      db: Session = Depends(get_db), user_info: Dict = Depends(get_authenticated_user)):
     """Save a search from history"""
     try:
+        user_id = _user_id(user_info)
+        saved = db.query(SearchHistory)\
+            .filter(SearchHistory.id == search_id, SearchHistory.user_id == user_id)\
+            .update({SearchHistory.is_saved: True}, synchronize_session=False)
+        if not saved:
+            raise HTTPException(status_code=404, detail="Search history entry not found")
+        db.commit()
+
+        background_tasks.add_task(refresh_snapshot_in_background, user_id, search_id, user_info)
         return {"success": True, "message": "Search saved successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to save search: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -135,19 +205,32 @@ async def save_search(search_id: int, db: Session = Depends(get_db)):
     response_model=SearchActionResponse,
     summary="Delete a saved search",
     description="""
-    Delete a saved search by its ID.
+    Delete a saved search by its ID. The search stays in the history; its snapshot is removed.
     
     ## Authentication
     This endpoint requires authentication via Bearer token or session cookie.
     """
 )
-async def delete_saved_search(search_id: int, db: Session = Depends(get_db)):
+async def delete_saved_search(search_id: int, db: Session = Depends(get_db), user_info: Dict = Depends(get_authenticated_user)):
     """Delete a saved search"""
     try:
+        user_id = _user_id(user_info)
+        unsaved = db.query(SearchHistory)\
+            .filter(SearchHistory.id == search_id, SearchHistory.user_id == user_id, SearchHistory.is_saved.is_(True))\
+            .update({SearchHistory.is_saved: False}, synchronize_session=False)
+        if not unsaved:
+            raise HTTPException(status_code=404, detail="Saved search not found")
+        db.query(SavedSearchSnapshot)\
+            .filter(SavedSearchSnapshot.history_id == search_id, SavedSearchSnapshot.user_id == user_id)\
+            .delete(synchronize_session=False)
+        db.commit()
+
         return {"success": True, "message": "Saved search deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to delete saved search: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to delete saved search: {str(e)}"
-        )
\ No newline at end of file
+        )
@@ -1,7 +1,8 @@
 """
 Search provider implementation for scientific papers.
 """
-from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Body
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Body, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional, List, Dict, Any
 import logging
@@ -15,6 +16,13 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from database import get_db
 from models.schemas import SearchResponse
 from services.search.service import SearchService
+from services.search.filter_metadata import etag_matches
+from services.search.cache import cache_stats
+from services.search.export import export_lines
+from services.search.history import history_entry, history_writer
+from json_response import FastJSONResponse
+from services.search import config as search_config
+from services.search.suggest import SUGGESTION_COLLECTIONS, get_suggestion_index
 from pydantic import BaseModel, Field, validator
 from api_responses import SEARCH_RESPONSES
 from models.search_query import SearchQuery
@@ -22,8 +30,6 @@ from routes.auth import get_current_user_for_template, csrf_protect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from services.auth import get_current_user
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -70,7 +76,7 @@ async def get_authenticated_user(
         
         # Decode the token
         user_info = decode_access_token(token)
-        logger.debug(f"User authenticated via token: {user_info}")
+        logger.debug("User authenticated via token: %s", user_info)
         return user_info
     except Exception as e:
         logger.error(f"Error decoding token: {str(e)}")
@@ -89,9 +95,14 @@ class SearchRequest(BaseModel):
     )
     collection_type: str = Field(
         default="scientific_paper",
-        description="Type of collection to search",
+        description="Type of collection to search, or 'all' for a federated search across every collection",
         example="scientific_paper"
     )
+    merge: str = Field(
+        default="sections",
+        description="Federated searches only: 'sections' (one response per collection) or 'blended' (one merged ranking)",
+        example="sections"
+    )
     schema_type: str = Field(
         default="default",
         description="Response schema type",
@@ -110,6 +121,23 @@ class SearchRequest(BaseModel):
         description="Items per page",
         example=10
     )
+    cursor: Optional[str] = Field(
+        default=None,
+        description="Opaque cursor from the previous response's next_cursor; when set, page is ignored",
+        example=None
+    )
+    include_facets: bool = Field(
+        default=False,
+        description="Include per-value match counts for the collection's filters under 'facets'",
+        example=False
+    )
+    data_products_per_study: Optional[int] = Field(
+        default=None,
+        ge=0,
+        le=50,
+        description="Clinical studies only: data products returned per study, in id order (default 2)",
+        example=2
+    )
     filters: Dict[str, Any] = Field(
         default_factory=dict,
         description="""
@@ -125,6 +153,49 @@ class SearchRequest(BaseModel):
         }
     )
 
+    @validator('collection_type')
+    def validate_collection_type(cls, v):
+        allowed_types = ['clinical_study', 'scientific_paper', 'data_domain', 'all']
+        if v not in allowed_types:
+            raise ValueError(f"Collection type must be one of: {', '.join(allowed_types)}")
+        return v
+
+    @validator('merge')
+    def validate_merge(cls, v):
+        allowed_modes = ['sections', 'blended']
+        if v not in allowed_modes:
+            raise ValueError(f"Merge mode must be one of: {', '.join(allowed_modes)}")
+        return v
+
+    @validator('schema_type')
+    def validate_schema_type(cls, v):
+        allowed_types = ['default', 'compact', 'detailed', 'scientific_paper', 'data_domain', 'clinical_study_custom']
+        if v not in allowed_types:
+            raise ValueError(f"Schema type must be one of: {', '.join(allowed_types)}")
+        return v
+
+class ExportRequest(BaseModel):
+    query: str = Field(
+        ...,
+        min_length=2,
+        description="Search query string",
+        example="genomics cancer"
+    )
+    collection_type: str = Field(
+        default="scientific_paper",
+        description="Type of collection to export",
+        example="scientific_paper"
+    )
+    schema_type: str = Field(
+        default="default",
+        description="Schema of each exported result",
+        example="default"
+    )
+    filters: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Optional filters, as for /api/search"
+    )
+
     @validator('collection_type')
     def validate_collection_type(cls, v):
         allowed_types = ['clinical_study', 'scientific_paper', 'data_domain']
@@ -140,6 +211,7 @@ class SearchRequest(BaseModel):
         return v
 
 @router.post("/search", 
+    response_class=FastJSONResponse,
     # Don't use a fixed response_model to allow custom formats
     # response_model=SearchResponse,
     summary="Search across collections",
@@ -150,6 +222,8 @@ class SearchRequest(BaseModel):
     - Scientific Papers (titles, abstracts, keywords)
     - Clinical Studies
     - Data Domains
+    - All of the above at once (`collection_type: "all"`), returned per collection or blended
+      into one ranking (`merge`); a collection that misses its deadline is reported as timed out
 
     For scientific papers, you can filter by:
     - Journal name
@@ -157,6 +231,8 @@ class SearchRequest(BaseModel):
     - Citation count range
 
     The response includes pagination information and can be formatted according to different schema types.
+    Every response carries a `next_cursor`; pass it back as `cursor` to fetch the following page with
+    keyset pagination, which stays fast on deep pages and stable while new rows are added.
     
     ## Authentication
     This endpoint requires authentication. You can provide authentication in one of these ways:
@@ -202,10 +278,10 @@ async def search(
     Authentication is required.
     """
     try:
-        logger.debug(f"Search request received: {search_request}")
-        logger.debug(f"User info: {user_info}")
-        logger.debug(f"Schema type requested: {search_request.schema_type!r}")
-        logger.debug(f"Collection type: {search_request.collection_type!r}")
+        logger.debug("Search request received: %s", search_request)
+        logger.debug("User info: %s", user_info)
+        logger.debug("Schema type requested: %r", search_request.schema_type)
+        logger.debug("Collection type: %r", search_request.collection_type)
 
         # Create search service
         search_service = SearchService(db)
@@ -226,57 +302,51 @@ async def search(
             # Remove empty terms
             terms = [term.strip() for term in terms if term.strip()]
         
-        logger.debug(f"Search terms after processing: {terms}")
-        logger.debug(f"Final schema_type being used: {search_request.schema_type!r}")
+        logger.debug("Search terms after processing: %s", terms)
+        logger.debug("Final schema_type being used: %r", search_request.schema_type)
         
-        results = search_service.search(
-            collection_type=search_request.collection_type,
-            terms=terms,
-            filters=filters,
-            page=search_request.page,
-            per_page=search_request.per_page,
-            schema_type=search_request.schema_type,
-            user_context=user_info  # Pass user context to search service if needed
-        )
+        if search_request.collection_type == 'all':
+            # Federated search: every collection concurrently, each within its own deadline
+            results = await search_service.federated_search(
+                terms=terms,
+                filters=filters,
+                per_page=search_request.per_page,
+                schema_type=search_request.schema_type,
+                user_context=user_info,
+                merge=search_request.merge
+            )
+        else:
+            results = await search_service.asearch(
+                collection_type=search_request.collection_type,
+                terms=terms,
+                filters=filters,
+                page=search_request.page,
+                per_page=search_request.per_page,
+                schema_type=search_request.schema_type,
+                user_context=user_info,  # Pass user context to search service if needed
+                cursor=search_request.cursor,
+                include_facets=search_request.include_facets,
+                data_products_per_study=search_request.data_products_per_study
+            )
         
-        # Log the search to the user's search history if user is authenticated
+        # Log the search to the user's search history if user is authenticated; the
+        # row is written in the background, so the response does not wait for it.
+        # Terms are joined the way they were split, so a saved search runs the same terms
         if user_info and "id" in user_info:
-            try:
-                from models.database_models import SearchHistory
-                
-                # Count the total results to save in history
-                results_count = 0
-                if isinstance(results, dict) and 'pagination' in results:
-                    results_count = results['pagination'].get('total', 0)
-                
-                # Create a new search history entry
-                search_history = SearchHistory(
-                    user_id=user_info["id"],
-                    query=" ".join(terms) if terms else "",
-                    category=search_request.collection_type,
-                    filters=search_request.filters,
-                    results_count=results_count,
-                    created_at=datetime.utcnow(),
-                    last_used=datetime.utcnow(),
-                    use_count=1
-                )
-                
-                # Add and commit to the database
-                db.add(search_history)
-                db.commit()
-                logger.debug(f"Search history logged for user {user_info['id']}")
-                
-            except Exception as e:
-                # If logging history fails, just log the error but don't interrupt the search
-                logger.error(f"Failed to log search history: {str(e)}", exc_info=True)
-                db.rollback()
+            results_count = 0
+            if isinstance(results, dict) and 'pagination' in results:
+                results_count = results['pagination'].get('total', 0)
+            await history_writer.submit(history_entry(
+                user_info["id"], " OR ".join(terms), search_request.collection_type,
+                search_request.filters, results_count
+            ))
         
-        if isinstance(results, dict):
-            logger.debug(f"Result keys: {list(results.keys())}")
+        if isinstance(results, dict) and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Result keys: %s", list(results))
             if 'results' in results and results['results']:
-                logger.debug(f"First result keys: {list(results['results'][0].keys())}")
+                logger.debug("First result keys: %s", list(results['results'][0]))
         
-        return results
+        return FastJSONResponse(results)
 
     except ValueError as e:
         logger.error(f"Validation error in search: {str(e)}", exc_info=True)
@@ -294,13 +364,53 @@ async def search(
             detail=f"Search operation failed: {str(e)}"
         )
 
-@router.get("/filters", response_model=Dict[str, Any])
+@router.post("/search/export",
+    summary="Export every search match as NDJSON",
+    description="""
+    Stream every result of a search as newline-delimited JSON, one result per line, in the
+    schema of `/api/search` results. Rows are read through a server-side cursor, so exports of
+    any size use constant memory. If the export fails midway, the last line is
+    `{"error": "Export failed", "exported": <lines written>}`.
+
+    The export is not BM25-ranked. Where the database scores matches (trigram and
+    full-text modes) it follows that score; otherwise it is in id order and unranked,
+    with each result's stored `relevance_score` (clinical studies) or none, even when
+    `/api/search` orders the same matches by BM25.
+
+    Authentication and CSRF protection work as for `/api/search`.
+    """
+)
+async def export_search(
+    export_request: ExportRequest,
+    user_info: Dict = Depends(get_authenticated_user),
+    csrf_check: bool = Depends(csrf_protect)
+):
+    """Stream all matches of a query as NDJSON"""
+    filters = export_request.filters.copy()
+    if user_info and user_info.get("role", "user") != "admin":
+        # Non-admins can't access restricted content
+        filters.pop("restricted_content", None)
+
+    terms = [term.strip() for term in export_request.query.split(' OR ') if term.strip()]
+    logger.debug("Export of %s requested for terms: %s", export_request.collection_type, terms)
+
+    return StreamingResponse(
+        export_lines(export_request.collection_type, terms, filters, export_request.schema_type, user_info),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{export_request.collection_type}-export.ndjson"'}
+    )
+
+@router.get("/filters", response_model=Dict[str, Any], response_class=FastJSONResponse)
 async def get_filters(
+    request: Request,
     collection_type: str = Query("scientific_paper", description="Type of collection"),
     db: Session = Depends(get_db)
 ):
     """
-    Get available filters for a collection type
+    Get available filters for a collection type.
+
+    Filters are cached per collection and carry an ETag; a request whose
+    If-None-Match matches it gets an empty 304 response.
     """
     try:
         search_service = SearchService(db)
@@ -311,8 +421,14 @@ async def get_filters(
                 detail=f"Unsupported collection type: {collection_type}"
             )
         
-        filters = provider.get_available_filters()
-        return filters
+        filters, etag = search_service.get_filter_metadata(collection_type)
+        # Clients may keep the filters but must revalidate them with the ETag
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return FastJSONResponse(filters, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting filters: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -321,6 +437,7 @@ async def get_filters(
         )
 
 @router.get("/suggest",
+    response_class=FastJSONResponse,
     summary="Get search suggestions",
     description="""
     Get search suggestions based on partial input
@@ -350,7 +467,20 @@ async def get_suggestions(
     Get search suggestions based on partial input
     """
     try:
-        logger.debug(f"Suggestion request received for query: {q}, collection: {collection_type}")
+        logger.debug("Suggestion request received for query: %s, collection: %s", q, collection_type)
+
+        # Serve completions from the in-memory prefix trie when enabled
+        if search_config.SUGGEST_INDEX_ENABLED:
+            if collection_type not in SUGGESTION_COLLECTIONS:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unsupported collection type: {collection_type}"
+                )
+            index = get_suggestion_index(collection_type)
+            if index is None:
+                # Still building in the background; never fall back to the database here
+                return FastJSONResponse({"suggestions": []})
+            return FastJSONResponse({"suggestions": index.complete(q, limit=5)})
 
         # Create search service
         search_service = SearchService(db)
@@ -364,7 +494,7 @@ async def get_suggestions(
             schema_type='compact'
         )
         
-        logger.debug(f"Suggestion results type: {type(results)}")
+        logger.debug("Suggestion results type: %s", type(results))
         
         # Handle different result formats
         suggestions = []
@@ -395,8 +525,10 @@ async def get_suggestions(
                 except Exception as err:
                     logger.error(f"Error processing suggestion result: {str(err)}")
 
-        return {"suggestions": suggestions}
+        return FastJSONResponse({"suggestions": suggestions})
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to get suggestions: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -404,6 +536,16 @@ async def get_suggestions(
             detail=f"Failed to get suggestions: {str(e)}"
         )
 
+@router.get("/cache-stats", response_model=Dict[str, Any])
+async def get_cache_stats(user_info: Dict = Depends(get_authenticated_user)):
+    """Size and hit/miss counters of the in-process search caches, for monitoring"""
+    return cache_stats()
+
+@router.get("/history-writer-stats", response_model=Dict[str, Any])
+async def get_history_writer_stats(user_info: Dict = Depends(get_authenticated_user)):
+    """Queue depth and write counters of the write-behind search history writer, for monitoring"""
+    return history_writer.stats()
+
 @router.get("/debug/transformers")
 async def debug_transformers():
     """Debug endpoint to see registered transformers"""
@@ -74,9 +74,10 @@ CREATE TABLE collection_items (
     added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Search History table
+-- Search History table, range-partitioned by month (partitions are created by the app)
 CREATE TABLE search_history (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
+    month DATE NOT NULL,
     user_id INTEGER REFERENCES users(id),
     query VARCHAR NOT NULL,
     category VARCHAR,
@@ -85,7 +86,40 @@ CREATE TABLE search_history (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_saved BOOLEAN DEFAULT FALSE,
     last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    use_count INTEGER DEFAULT 0
+    use_count INTEGER DEFAULT 0,
+    query_hash VARCHAR(64),
+    filters_hash VARCHAR(64),
+    PRIMARY KEY (id, month)
+) PARTITION BY RANGE (month);
+
+-- Saved searches carried out of expired monthly partitions (month 1970-01-01);
+-- the monthly partitions are created by the application
+CREATE TABLE search_history_saved PARTITION OF search_history
+FOR VALUES FROM (MINVALUE) TO ('1970-02-01');
+
+-- Expired search history, aggregated per user and search
+CREATE TABLE search_history_rollup (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    query VARCHAR,
+    category VARCHAR,
+    filters JSONB,
+    query_hash VARCHAR(64),
+    filters_hash VARCHAR(64),
+    use_count INTEGER DEFAULT 0,
+    results_count INTEGER,
+    first_used TIMESTAMP,
+    last_used TIMESTAMP
+);
+
+-- First page of results of each saved search (search_history rows with is_saved)
+CREATE TABLE saved_search_snapshots (
+    history_id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    result_ids JSONB,
+    total INTEGER,
+    first_page JSONB,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Add indexes for better query performance
@@ -93,7 +127,10 @@ CREATE INDEX idx_clinical_study_title ON clinical_study(title);
 CREATE INDEX idx_clinical_study_status ON clinical_study(status);
 CREATE INDEX idx_data_products_study_id ON data_products(study_id);
 CREATE INDEX idx_collection_items_collection_id ON collection_items(collection_id);
-CREATE INDEX idx_search_history_user_id ON search_history(user_id);
+CREATE INDEX idx_search_history_user_last_used ON search_history(user_id, last_used DESC, id DESC);
+CREATE UNIQUE INDEX uq_search_history_user_query ON search_history(user_id, query_hash, category, filters_hash, month);
+CREATE INDEX ix_saved_search_snapshots_user_id ON saved_search_snapshots(user_id);
+CREATE UNIQUE INDEX uq_search_history_rollup_user_query ON search_history_rollup(user_id, query_hash, category, filters_hash);
 
 -- Scientific Papers table
 CREATE TABLE scientific_papers (
@@ -107,7 +144,14 @@ CREATE TABLE scientific_papers (
     keywords JSONB,  -- List of keywords
     citations_count INTEGER DEFAULT 0,
     reference_list JSONB,  -- List of referenced papers (renamed from 'references')
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Weighted full-text document: title > keywords > abstract > journal
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(keywords::text, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(abstract, '')), 'C') ||
+        setweight(to_tsvector('english', coalesce(journal, '')), 'D')
+    ) STORED
 );
 
 -- Add indexes for better query performance on commonly filtered fields
@@ -116,6 +160,7 @@ CREATE INDEX idx_scientific_papers_doi ON scientific_papers(doi);
 CREATE INDEX idx_scientific_papers_journal ON scientific_papers(journal);
 CREATE INDEX idx_scientific_papers_publication_date ON scientific_papers(publication_date);
 CREATE INDEX idx_scientific_papers_citations_count ON scientific_papers(citations_count);
+CREATE INDEX idx_scientific_papers_search_vector ON scientific_papers USING GIN (search_vector);
 
 -- Data Domain Metadata table
 CREATE TABLE data_domain_metadata (
@@ -133,4 +178,11 @@ CREATE TABLE data_domain_metadata (
 
 -- Add indexes for better query performance
 CREATE INDEX idx_data_domain_domain_name ON data_domain_metadata(domain_name);
-CREATE INDEX idx_data_domain_owner ON data_domain_metadata(owner);
\ No newline at end of file
+CREATE INDEX idx_data_domain_owner ON data_domain_metadata(owner);
+
+-- Trigram indexes for substring and fuzzy matching (requires pg_trgm)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_clinical_study_title_trgm ON clinical_study USING GIN (title gin_trgm_ops);
+CREATE INDEX idx_clinical_study_drug_trgm ON clinical_study USING GIN (drug gin_trgm_ops);
+CREATE INDEX idx_scientific_papers_title_trgm ON scientific_papers USING GIN (title gin_trgm_ops);
+CREATE INDEX idx_data_domain_domain_name_trgm ON data_domain_metadata USING GIN (domain_name gin_trgm_ops);
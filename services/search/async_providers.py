@@ -0,0 +1,97 @@
+"""
+Async adapters that let the sync search providers run without blocking the event loop.
+
+With the asyncpg engine, a provider runs through AsyncSession.run_sync: its
+ORM code is unchanged, but every statement awaits asyncpg, so concurrent
+searches overlap on database I/O. Without it (asyncpg missing or a non
+PostgreSQL database), the provider runs in a worker thread on its own
+sync session.
+"""
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Type
+from sqlalchemy.orm import Session
+from database import SessionLocal, get_async_sessionmaker
+from services.search import config
+from services.search.base import AsyncSearchProvider, SearchProvider, SearchQuery, SearchResult
+
+logger = logging.getLogger(__name__)
+
+def in_event_loop() -> bool:
+    """Whether the caller runs on an event loop thread, e.g. inside AsyncSession.run_sync"""
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+class AsyncSessionProviderAdapter(AsyncSearchProvider):
+    """Runs a sync provider on an asyncpg-backed AsyncSession via run_sync"""
+
+    def __init__(self, provider_class: Type[SearchProvider], session_factory):
+        self.provider_class = provider_class
+        self.session_factory = session_factory
+
+    async def _call(self, method: str, *args: Any) -> Any:
+        async with self.session_factory() as session:
+            return await session.run_sync(
+                lambda sync_session: getattr(self.provider_class(sync_session), method)(*args)
+            )
+
+    async def search(self, query: SearchQuery) -> List[SearchResult]:
+        return await self._call('search', query)
+
+    async def get_available_filters(self) -> Dict[str, List[str]]:
+        return await self._call('get_available_filters')
+
+    async def get_facets(self, query: SearchQuery) -> Dict[str, List[Dict[str, Any]]]:
+        return await self._call('get_facets', query)
+
+class ThreadPoolProviderAdapter(AsyncSearchProvider):
+    """Runs a sync provider in a worker thread on its own session"""
+
+    def __init__(self, provider_class: Type[SearchProvider],
+                 session_factory: Callable[[], Session] = SessionLocal):
+        self.provider_class = provider_class
+        self.session_factory = session_factory
+
+    def _call_sync(self, method: str, *args: Any) -> Any:
+        db = self.session_factory()
+        try:
+            return getattr(self.provider_class(db), method)(*args)
+        finally:
+            db.close()
+
+    async def search(self, query: SearchQuery) -> List[SearchResult]:
+        return await asyncio.to_thread(self._call_sync, 'search', query)
+
+    async def get_available_filters(self) -> Dict[str, List[str]]:
+        return await asyncio.to_thread(self._call_sync, 'get_available_filters')
+
+    async def get_facets(self, query: SearchQuery) -> Dict[str, List[Dict[str, Any]]]:
+        return await asyncio.to_thread(self._call_sync, 'get_facets', query)
+
+_async_session_factory = None
+_async_engine_failed = False
+
+def _get_async_session_factory():
+    """The asyncpg session factory, or None when the async engine is disabled or unavailable"""
+    global _async_session_factory, _async_engine_failed
+    if not config.SEARCH_ASYNC_ENGINE or _async_engine_failed:
+        return None
+    if _async_session_factory is None:
+        try:
+            _async_session_factory = get_async_sessionmaker()
+        except Exception as e:
+            # Typically asyncpg is not installed or the database is not PostgreSQL
+            logger.warning(f"Async engine unavailable, running search providers in threads: {str(e)}")
+            _async_engine_failed = True
+            return None
+    return _async_session_factory
+
+def get_async_provider(provider_class: Type[SearchProvider]) -> AsyncSearchProvider:
+    """Wrap a sync provider class so it can be awaited"""
+    session_factory = _get_async_session_factory()
+    if session_factory is not None:
+        return AsyncSessionProviderAdapter(provider_class, session_factory)
+    return ThreadPoolProviderAdapter(provider_class)
@@ -2,7 +2,7 @@
 Base classes for the extensible search service architecture.
 """
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional, Type
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
 from dataclasses import dataclass, field
 from datetime import datetime
 
@@ -15,6 +15,10 @@ class SearchQuery:
     page: int = 1
     per_page: int = 10
     schema_type: str = "default"
+    cursor: Optional[str] = None           # Opaque keyset cursor; takes precedence over page
+    user_context: Optional[Dict[str, Any]] = None  # Authenticated user, for authorization filters
+    fields: Optional[Tuple[str, ...]] = None  # SearchResult fields to load; None loads all of them
+    data_products_per_study: Optional[int] = None  # Data products per clinical study; None uses DATA_PRODUCTS_PER_STUDY
 
 @dataclass
 class SearchResult:
@@ -39,6 +43,8 @@ class SearchResult:
     # Internal properties for pagination and query reference (not part of returned data)
     _query: Any = None
     _total: int = 0
+    _total_accuracy: str = "exact"         # 'exact' or 'estimated'
+    _next_cursor: Optional[str] = None
 
 class SearchProvider(ABC):
     """Abstract base class for collection-specific search providers"""
@@ -53,9 +59,41 @@ class SearchProvider(ABC):
         """Return available filters for this collection"""
         pass
 
+    def get_facets(self, query: SearchQuery) -> Dict[str, List[Dict[str, Any]]]:
+        """Return the number of matches per filter value for a query; collections without facets return {}"""
+        return {}
+
+    @abstractmethod
+    def export(self, query: SearchQuery, chunk_size: int) -> Iterator[List[SearchResult]]:
+        """
+        Yield every match of a query, chunk_size results at a time: by the database-side
+        score where there is one, otherwise in id order and unranked (no BM25 scoring).
+        """
+        pass
+
+class AsyncSearchProvider(ABC):
+    """Abstract base class for search providers that do not block the event loop"""
+
+    @abstractmethod
+    async def search(self, query: SearchQuery) -> List[SearchResult]:
+        """Execute search against the collection"""
+        pass
+
+    @abstractmethod
+    async def get_available_filters(self) -> Dict[str, List[str]]:
+        """Return available filters for this collection"""
+        pass
+
+    async def get_facets(self, query: SearchQuery) -> Dict[str, List[Dict[str, Any]]]:
+        """Return the number of matches per filter value for a query; collections without facets return {}"""
+        return {}
+
 class SchemaTransformer(ABC):
     """Abstract base class for result schema transformers"""
 
+    # SearchResult fields read by transform(); providers load only these columns. None reads every field.
+    required_fields: Optional[Tuple[str, ...]] = None
+
     @abstractmethod
     def transform(self, results: List[SearchResult]) -> Dict[str, Any]:
         """Transform search results into the desired output format"""
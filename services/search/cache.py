@@ -0,0 +1,141 @@
+"""
+In-process caches for search metadata and table-version based invalidation.
+
+Every committed ORM write bumps the version of the tables it touched, so cache
+keys that include the table version stop matching as soon as the data changes.
+Writes made outside this process are picked up when the entries' TTL expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Named caches and request coalescers, for monitoring
+_caches: Dict[str, Any] = {}
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a fixed TTL, with hit/miss counters"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, name: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if name:
+            _caches[name] = self
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entries beyond max_entries"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+    def pop(self, key: Hashable):
+        """Drop one entry"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Counters of every named cache and request coalescer"""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+# Tables whose rows appear in each collection's search results
+COLLECTION_TABLES = {
+    'clinical_study': ('clinical_study', 'data_products'),
+    'scientific_paper': ('scientific_papers',),
+    'data_domain': ('data_domain_metadata',),
+}
+
+def collection_version(collection_type: str) -> tuple:
+    """Versions of every table a collection's results are read from"""
+    return tuple(table_version(table) for table in COLLECTION_TABLES.get(collection_type, (collection_type,)))
+
+_table_versions: Dict[str, int] = {}
+_versions_lock = threading.Lock()
+_bump_callbacks: List[Callable[[str], None]] = []
+
+def table_version(table_name: str) -> int:
+    """Current version of a table; changes whenever a committed write touches it"""
+    return _table_versions.get(table_name, 0)
+
+def bump_table_version(table_name: str):
+    """Invalidate every cache entry keyed on the table's current version"""
+    with _versions_lock:
+        _table_versions[table_name] = _table_versions.get(table_name, 0) + 1
+    for callback in _bump_callbacks:
+        callback(table_name)
+
+def on_table_version_bump(callback: Callable[[str], None]):
+    """Call `callback` with the table name whenever a table version is bumped"""
+    _bump_callbacks.append(callback)
+
+@event.listens_for(Session, "after_flush")
+def _collect_written_tables(session, flush_context):
+    """Remember which tables the flush wrote to until the transaction commits"""
+    written = session.info.setdefault("written_tables", set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(instance, "__tablename__", None)
+        if table:
+            written.add(table)
+
+@event.listens_for(Session, "after_commit")
+def _bump_written_tables(session):
+    for table in session.info.pop("written_tables", ()):
+        bump_table_version(table)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written_tables(session):
+    session.info.pop("written_tables", None)
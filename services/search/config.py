@@ -0,0 +1,110 @@
+"""
+Deployment settings for the search service, read from the environment.
+"""
+import os
+
+# Matching strategy for clinical studies: 'ilike' (SQL), 'trigram' (pg_trgm) or 'index' (in-process inverted index)
+CLINICAL_STUDY_SEARCH_MODE = os.environ.get("CLINICAL_STUDY_SEARCH_MODE", "ilike")
+
+# Seconds before the in-process clinical study index is rebuilt from the database
+CLINICAL_STUDY_INDEX_MAX_AGE = int(os.environ.get("CLINICAL_STUDY_INDEX_MAX_AGE", "300"))
+
+# Matching strategy for scientific papers: 'ilike', 'fulltext' (tsvector + GIN, ranked with ts_rank_cd) or 'trigram'
+SCIENTIFIC_PAPER_SEARCH_MODE = os.environ.get("SCIENTIFIC_PAPER_SEARCH_MODE", "ilike")
+
+# Matching strategy for data domains: 'ilike' or 'trigram'
+DATA_DOMAIN_SEARCH_MODE = os.environ.get("DATA_DOMAIN_SEARCH_MODE", "ilike")
+
+# Minimum pg_trgm similarity for a fuzzy match in 'trigram' mode (pg_trgm.similarity_threshold)
+TRIGRAM_SIMILARITY_THRESHOLD = float(os.environ.get("TRIGRAM_SIMILARITY_THRESHOLD", "0.3"))
+
+# Relevance ranking for results without a database-side score: 'bm25' or 'none'
+SEARCH_RANKING = os.environ.get("SEARCH_RANKING", "bm25")
+
+# Seconds between incremental refreshes of the BM25 corpus statistics (new rows only)
+RANKING_STATS_REFRESH_SECONDS = int(os.environ.get("RANKING_STATS_REFRESH_SECONDS", "60"))
+
+# Seconds between full rebuilds of the BM25 corpus statistics (accounts for updates and deletes)
+RANKING_STATS_REBUILD_SECONDS = int(os.environ.get("RANKING_STATS_REBUILD_SECONDS", "3600"))
+
+# Matches (the first ones by id) BM25 rescores per query in the SQL search modes; later
+# matches follow unscored in id order
+RANKING_CANDIDATE_LIMIT = int(os.environ.get("RANKING_CANDIDATE_LIMIT", "500"))
+
+# Serve /api/suggest from the in-memory prefix tries instead of running a search
+SUGGEST_INDEX_ENABLED = os.environ.get("SUGGEST_INDEX_ENABLED", "true").lower() == "true"
+
+# Seconds between background rebuilds of the suggestion tries
+SUGGEST_INDEX_REFRESH_SECONDS = int(os.environ.get("SUGGEST_INDEX_REFRESH_SECONDS", "300"))
+
+# Completions cached per trie node (upper bound for the number of suggestions returned)
+SUGGEST_TOP_K = int(os.environ.get("SUGGEST_TOP_K", "10"))
+
+# Words of each title or name that completions can start at (the first ones), bounding the trie size
+SUGGEST_MAX_KEY_WORDS = int(os.environ.get("SUGGEST_MAX_KEY_WORDS", "6"))
+
+# How clinical study totals are computed: 'exact' counts on every search, 'cached' reuses
+# exact counts until the table changes, 'estimated' also uses planner estimates for broad queries,
+# 'window' returns count(*) OVER () with the page rows in a single round trip
+CLINICAL_STUDY_COUNT_MODE = os.environ.get("CLINICAL_STUDY_COUNT_MODE", "exact")
+
+# Lifetime and size bound of the count cache; the TTL catches writes made by other processes
+COUNT_CACHE_TTL_SECONDS = int(os.environ.get("COUNT_CACHE_TTL_SECONDS", "60"))
+COUNT_CACHE_MAX_ENTRIES = int(os.environ.get("COUNT_CACHE_MAX_ENTRIES", "10000"))
+
+# Planner estimates at or above this many rows are reported instead of an exact count
+COUNT_ESTIMATE_THRESHOLD = int(os.environ.get("COUNT_ESTIMATE_THRESHOLD", "10000"))
+
+# Lifetime and size bound of the facet count cache
+FACET_CACHE_TTL_SECONDS = int(os.environ.get("FACET_CACHE_TTL_SECONDS", "60"))
+FACET_CACHE_MAX_ENTRIES = int(os.environ.get("FACET_CACHE_MAX_ENTRIES", "1000"))
+
+# Seconds /api/filters metadata is cached; writes through the app invalidate it immediately
+FILTER_CACHE_TTL_SECONDS = int(os.environ.get("FILTER_CACHE_TTL_SECONDS", "300"))
+
+# Per-collection deadline of a federated search (collection_type 'all')
+FEDERATED_SEARCH_DEADLINE_SECONDS = float(os.environ.get("FEDERATED_SEARCH_DEADLINE_SECONDS", "2.0"))
+
+# Run /api/search providers on the asyncpg engine; without asyncpg they run in worker threads
+SEARCH_ASYNC_ENGINE = os.environ.get("SEARCH_ASYNC_ENGINE", "true").lower() == "true"
+
+# Lifetime and size bound of the search result cache; a TTL of 0 disables it
+SEARCH_RESULT_CACHE_TTL_SECONDS = int(os.environ.get("SEARCH_RESULT_CACHE_TTL_SECONDS", "30"))
+SEARCH_RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_RESULT_CACHE_MAX_ENTRIES", "1000"))
+
+# Redis URL of the cache shared by all workers (search results, filter metadata); empty caches
+# per worker only, memory:// uses an in-process stand-in
+SHARED_CACHE_URL = os.environ.get("SHARED_CACHE_URL", "")
+SHARED_CACHE_PREFIX = os.environ.get("SHARED_CACHE_PREFIX", "search:")
+
+# Socket timeout of shared cache calls, and how long to cache locally after the store failed
+SHARED_CACHE_SOCKET_TIMEOUT_SECONDS = float(os.environ.get("SHARED_CACHE_SOCKET_TIMEOUT_SECONDS", "0.25"))
+SHARED_CACHE_RETRY_SECONDS = int(os.environ.get("SHARED_CACHE_RETRY_SECONDS", "30"))
+
+# zlib level of shared cache entries (1 fastest, 9 smallest)
+SHARED_CACHE_COMPRESSION_LEVEL = int(os.environ.get("SHARED_CACHE_COMPRESSION_LEVEL", "6"))
+
+# Rows per server-side cursor fetch (and per transformer batch) of the NDJSON search export
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "500"))
+
+# Data products returned per clinical study when a request does not set data_products_per_study
+DATA_PRODUCTS_PER_STUDY = int(os.environ.get("DATA_PRODUCTS_PER_STUDY", "2"))
+
+# Write-behind search history: entries per multi-row INSERT, seconds a partial batch may wait,
+# queue bound, and how long a search waits for room in a full queue before dropping its entry
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL_SECONDS = float(os.environ.get("HISTORY_FLUSH_INTERVAL_SECONDS", "1.0"))
+HISTORY_QUEUE_SIZE = int(os.environ.get("HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_ENQUEUE_TIMEOUT_SECONDS = float(os.environ.get("HISTORY_ENQUEUE_TIMEOUT_SECONDS", "0.05"))
+
+# Monthly search_history partitions: months created ahead of time, days of raw history kept
+# before a partition is folded into search_history_rollup and dropped (0 keeps everything),
+# and seconds between maintenance runs
+HISTORY_PARTITIONS_AHEAD = int(os.environ.get("HISTORY_PARTITIONS_AHEAD", "2"))
+HISTORY_RETENTION_DAYS = int(os.environ.get("HISTORY_RETENTION_DAYS", "365"))
+HISTORY_MAINTENANCE_INTERVAL_SECONDS = int(os.environ.get("HISTORY_MAINTENANCE_INTERVAL_SECONDS", "3600"))
+
+# Saved search snapshots: results kept per snapshot, and the age after which executing the
+# saved search starts a background refresh (the stale snapshot is still served)
+SAVED_SEARCH_SNAPSHOT_SIZE = int(os.environ.get("SAVED_SEARCH_SNAPSHOT_SIZE", "10"))
+SAVED_SEARCH_SNAPSHOT_MAX_AGE_SECONDS = int(os.environ.get("SAVED_SEARCH_SNAPSHOT_MAX_AGE_SECONDS", "3600"))
@@ -0,0 +1,96 @@
+"""
+Total match counts for search results: exact, cached, planner-estimated or
+returned with the page by a window function.
+"""
+import json
+import logging
+from typing import Any, Dict, Optional, Sequence, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Query, Session
+from services.search import config
+from services.search.cache import TTLCache, table_version
+from services.search.cursor import CursorKey
+
+logger = logging.getLogger(__name__)
+
+EXACT = 'exact'
+ESTIMATED = 'estimated'
+
+_count_cache = TTLCache(config.COUNT_CACHE_MAX_ENTRIES, config.COUNT_CACHE_TTL_SECONDS, name='counts')
+
+def count_key(table_name: str, terms: Sequence[str], filters: Dict[str, Any], *context: Any) -> str:
+    """
+    Canonical cache key for the number of matches of a query.
+
+    Terms are matched case-insensitively in every mode and OR-ed together, so
+    their case, surrounding whitespace and order do not change the count.
+    """
+    normalized_terms = sorted({term.strip().lower() for term in terms if term.strip()})
+    return json.dumps(
+        [table_name, table_version(table_name), normalized_terms, filters, *context],
+        sort_keys=True, default=str, separators=(',', ':')
+    )
+
+def _planner_estimate(db: Session, query: Query) -> int:
+    """Row estimate of the planner for a query, without executing it"""
+    compiled = query.statement.compile(dialect=db.bind.dialect)
+    # Positional drivers (asyncpg's $1, $2, ...) take the values in placeholder order
+    if compiled.positiontup:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    # A savepoint keeps a failed EXPLAIN from aborting the search's transaction
+    with db.begin_nested():
+        plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def count_matches(db: Session, query: Query, id_column, terms: Sequence[str], filters: Dict[str, Any],
+                  mode: str, *context: Any) -> Tuple[int, str]:
+    """
+    Count the rows matched by a filtered query, returning (total, accuracy).
+
+    `query` must not carry eager loads or ordering; the count selects only the id.
+    In 'cached' mode exact counts are reused until the table changes or the TTL
+    expires. In 'estimated' mode the planner estimate is used when it is at least
+    COUNT_ESTIMATE_THRESHOLD rows, where an exact count would be expensive and a
+    rough figure is enough; smaller results are still counted exactly.
+    """
+    count_query = query.with_entities(func.count(id_column))
+    if mode not in ('cached', 'estimated'):
+        return count_query.scalar(), EXACT
+
+    key = count_key(id_column.table.name, terms, filters, mode, *context)
+    cached = _count_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = None
+    if mode == 'estimated' and db.bind.dialect.name == 'postgresql':
+        try:
+            estimate = _planner_estimate(db, query.with_entities(id_column))
+            if estimate >= config.COUNT_ESTIMATE_THRESHOLD:
+                result = (estimate, ESTIMATED)
+        except Exception as e:
+            logger.warning(f"Planner estimate failed, counting exactly: {str(e)}")
+
+    if result is None:
+        result = (count_query.scalar(), EXACT)
+    _count_cache.set(key, result)
+    return result
+
+def window_count():
+    """count(*) OVER (): the number of matching rows, returned alongside every row of the page"""
+    return func.count().over().label('total_count')
+
+def window_total(rows: Sequence[Any], key: Optional[CursorKey] = None) -> int:
+    """
+    Total matches of a page fetched with window_count().
+
+    Behind a cursor the window only sees the rows after it, so the total
+    recorded in the cursor when the first page was fetched is used instead.
+    """
+    if key is not None and key.total is not None:
+        return key.total
+    return rows[0].total_count if rows else 0
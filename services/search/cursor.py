@@ -0,0 +1,70 @@
+"""
+Opaque cursor tokens for keyset pagination.
+
+A cursor holds the sort key of the last result on a page: the relevance score
+(when results are ordered by one) and the id. Providers seek past it with a
+WHERE clause instead of an OFFSET, so deep pages cost the same as the first
+and rows inserted while a user pages through do not shift the pages.
+"""
+import base64
+import binascii
+import json
+from typing import Any, NamedTuple, Optional
+from sqlalchemy import REAL, and_, cast, or_
+
+class CursorKey(NamedTuple):
+    """Sort key of the last result on a page"""
+    ranked: bool            # Whether the results are ordered by score before id
+    score: Optional[float]
+    id: int
+    total: Optional[int] = None  # Total matches when the first page was fetched
+
+def encode_cursor(ranked: bool, score: Optional[float], id: Any, total: Optional[int] = None) -> str:
+    """Encode a sort key (and the query's total, when known) as an opaque, URL-safe token"""
+    payload = {'r': int(ranked), 's': score, 'i': int(id), 't': total}
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str, ranked: bool) -> CursorKey:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Raises ValueError when the token is malformed or was issued for a query
+    with a different sort order (e.g. a ranked query's cursor on an unranked one).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        total = payload.get('t')
+        key = CursorKey(bool(payload['r']), payload['s'], int(payload['i']), int(total) if total is not None else None)
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+        raise ValueError("Invalid pagination cursor")
+    if key.ranked != ranked or (key.score is not None and not isinstance(key.score, (int, float))):
+        raise ValueError("Pagination cursor does not match this query")
+    return key
+
+def seek_condition(key: CursorKey, id_column, score=None):
+    """
+    Condition selecting the rows after a cursor.
+
+    Ranked results are ordered by `score DESC NULLS LAST, id`, unranked results by id.
+    """
+    if score is None:
+        return id_column > key.id
+    if key.score is None:
+        # The cursor is already inside the trailing NULL scores
+        return and_(score.is_(None), id_column > key.id)
+    # similarity() and ts_rank_cd() return real; compare in real so the
+    # decimal round trip of the score cannot make the last row match again
+    last_score = cast(key.score, REAL)
+    return or_(
+        score < last_score,
+        and_(score == last_score, id_column > key.id),
+        score.is_(None)
+    )
+
+def page_offset(query) -> int:
+    """OFFSET for a query: 0 when seeking with a cursor, otherwise derived from the page number"""
+    if query.cursor:
+        return 0
+    return (query.page - 1) * query.per_page
@@ -0,0 +1,50 @@
+"""
+Streaming export of every match of a search as NDJSON.
+
+Rows are read through a server-side cursor (yield_per, which implies
+stream_results) in chunks of EXPORT_CHUNK_SIZE, converted by the provider,
+run through the collection's transformer and written out one JSON document
+per line with dumps_json, so memory stays constant however many rows match.
+"""
+import logging
+from typing import Any, Dict, Iterator, List
+from sqlalchemy.orm import Query, Session
+from database import SessionLocal
+from json_response import dumps_json
+from services.search import config
+
+logger = logging.getLogger(__name__)
+
+def stream_partitions(db: Session, query: Query, chunk_size: int) -> Iterator[List[Any]]:
+    """Rows of a query in lists of chunk_size, fetched through a server-side cursor"""
+    result = db.execute(query.statement, execution_options={'yield_per': chunk_size})
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+def export_lines(collection_type: str, terms: List[str], filters: Dict, schema_type: str,
+                 user_context: Dict = None, chunk_size: int = None) -> Iterator[bytes]:
+    """
+    NDJSON lines of every transformed match, one chunk at a time.
+
+    Runs on its own session because the response outlives the request's
+    session. A failure after the first line can no longer change the status
+    code, so it ends the stream with an {"error": ...} line.
+    """
+    from services.search.service import SearchService
+
+    chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+    db = SessionLocal()
+    exported = 0
+    try:
+        service = SearchService(db)
+        for chunk in service.export(collection_type, terms, filters, schema_type, user_context, chunk_size):
+            exported += len(chunk)
+            yield b"".join(dumps_json(item) + b"\n" for item in chunk)
+        logger.debug(f"Exported {exported} {collection_type} results")
+    except Exception as e:
+        logger.error(f"Export of {collection_type} failed after {exported} results: {str(e)}", exc_info=True)
+        yield dumps_json({'error': 'Export failed', 'exported': exported}) + b"\n"
+    finally:
+        db.close()
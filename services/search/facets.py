@@ -0,0 +1,57 @@
+"""
+Facet counts (matches per filter value) for the current search.
+
+All facets of a collection are computed by one aggregate statement using
+GROUPING SETS, so the matching rows are scanned once however many facets
+are requested. Results are cached per normalized query and table version.
+"""
+from typing import Any, Callable, Dict, List, Sequence
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Query
+from services.search import config
+from services.search.cache import TTLCache
+from services.search.counts import count_key
+
+_facet_cache = TTLCache(config.FACET_CACHE_MAX_ENTRIES, config.FACET_CACHE_TTL_SECONDS, name='facets')
+
+def format_facet(counts: Dict[Any, int]) -> List[Dict[str, Any]]:
+    """Facet values with their counts, most frequent first; NULL values are left out"""
+    return [
+        {'value': value, 'count': count}
+        for value, count in sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+        if value is not None
+    ]
+
+def grouped_facet_counts(query: Query, facets: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Count the rows of a filtered query per value of every facet expression in one statement.
+
+    `query` selects the matching entities; `facets` maps facet names to column
+    expressions. grouping() tells which grouping set produced each row, so a NULL
+    value is not mistaken for the other facets' placeholder.
+    """
+    names = list(facets)
+    expressions = [facets[name] for name in names]
+    statement = query.with_entities(
+        *[expression.label(name) for name, expression in zip(names, expressions)],
+        *[func.grouping(expression).label(f"grouping_{name}") for name, expression in zip(names, expressions)],
+        func.count().label('facet_count')
+    ).order_by(None).group_by(func.grouping_sets(*[tuple_(expression) for expression in expressions]))
+
+    counts: Dict[str, Dict[Any, int]] = {name: {} for name in names}
+    for row in statement.all():
+        for name in names:
+            if getattr(row, f"grouping_{name}") == 0:
+                counts[name][getattr(row, name)] = row.facet_count
+                break
+    return {name: format_facet(values) for name, values in counts.items()}
+
+def cached_facets(table_name: str, terms: Sequence[str], filters: Dict[str, Any],
+                  compute: Callable[[], Dict[str, List[Dict[str, Any]]]], *context: Any):
+    """Return the facets of a query from the cache, computing and storing them on a miss"""
+    key = count_key(table_name, terms, filters, 'facets', *context)
+    facets = _facet_cache.get(key)
+    if facets is None:
+        facets = compute()
+        _facet_cache.set(key, facets)
+    return facets
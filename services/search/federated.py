@@ -0,0 +1,140 @@
+"""
+Federated search: one query fanned out to every registered collection concurrently.
+
+Each collection runs in a worker thread on its own database session, since
+sessions are not thread-safe. A collection that misses the deadline is reported
+as timed out instead of holding back the response, and statement_timeout stops
+its queries on the database side shortly after.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Sequence
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from services.search import config
+from services.search.base import SearchResult
+
+logger = logging.getLogger(__name__)
+
+# Constant of reciprocal rank fusion; damps the advantage of the very first ranks
+RRF_K = 60
+
+MERGE_MODES = ('sections', 'blended')
+
+def _set_statement_timeout(db: Session, seconds: float):
+    """Cap every statement of the current transaction on PostgreSQL"""
+    if db.bind.dialect.name == 'postgresql':
+        db.execute(
+            text("SELECT set_config('statement_timeout', :timeout, true)"),
+            {"timeout": str(max(int(seconds * 1000), 1))}
+        )
+
+def _search_collection(collection_type: str, terms: List[str], filters: Dict, per_page: int,
+                       schema_type: str, user_context: Dict, blended: bool):
+    """Run one collection's search on a dedicated session; executed in a worker thread"""
+    from services.search.service import SearchService
+
+    db = SessionLocal()
+    try:
+        _set_statement_timeout(db, config.FEDERATED_SEARCH_DEADLINE_SECONDS)
+        service = SearchService(db)
+        if blended:
+            return service.search_results(collection_type, terms, filters, per_page=per_page, user_context=user_context)
+        return service.search(
+            collection_type=collection_type,
+            terms=terms,
+            filters=filters,
+            per_page=per_page,
+            schema_type=schema_type,
+            user_context=user_context
+        )
+    finally:
+        db.close()
+
+def reciprocal_rank_fusion(sections: Dict[str, List[SearchResult]], limit: int) -> List[Dict[str, Any]]:
+    """
+    Blend per-collection rankings into one list.
+
+    Scores from different collections (BM25, ts_rank_cd, similarity) are not
+    comparable, so each result is scored by its rank within its collection:
+    1 / (RRF_K + rank). Equal ranks keep the registry order of the collections.
+    """
+    fused = []
+    for collection_type, results in sections.items():
+        for rank, result in enumerate(results, start=1):
+            fused.append((1.0 / (RRF_K + rank), result))
+    fused.sort(key=lambda item: -item[0])
+
+    return [
+        {
+            'id': result.id,
+            'type': result.type,
+            'title': result.title,
+            'description': result.description,
+            'relevance_score': result.relevance_score,
+            'fused_score': fused_score,
+            'data': result.data,
+            'data_products': result.data_products
+        }
+        for fused_score, result in fused[:limit]
+    ]
+
+async def federated_search(collection_types: Sequence[str], terms: List[str], filters: Dict, per_page: int,
+                           schema_type: str, user_context: Dict, merge: str) -> Dict[str, Any]:
+    """
+    Search all collections concurrently, each within FEDERATED_SEARCH_DEADLINE_SECONDS.
+
+    'sections' returns every collection's own response under 'collections';
+    'blended' returns a single list merged by reciprocal rank fusion. Either
+    way 'status' reports 'ok', 'timeout' or 'error' per collection.
+    """
+    if merge not in MERGE_MODES:
+        raise ValueError(f"Merge mode must be one of: {', '.join(MERGE_MODES)}")
+    blended = merge == 'blended'
+    deadline = config.FEDERATED_SEARCH_DEADLINE_SECONDS
+
+    async def run(collection_type: str):
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                asyncio.to_thread(
+                    _search_collection, collection_type, terms, filters, per_page,
+                    schema_type, user_context, blended
+                ),
+                timeout=deadline
+            )
+            return collection_type, 'ok', result
+        except asyncio.TimeoutError:
+            logger.warning(f"Federated search of {collection_type} missed the {deadline}s deadline")
+            return collection_type, 'timeout', None
+        except Exception as e:
+            logger.error(f"Federated search of {collection_type} failed: {str(e)}", exc_info=True)
+            return collection_type, 'error', None
+        finally:
+            logger.debug(f"Federated search of {collection_type} took {time.monotonic() - started:.3f}s")
+
+    outcomes = await asyncio.gather(*[run(collection_type) for collection_type in collection_types])
+    status = {collection_type: outcome for collection_type, outcome, _ in outcomes}
+
+    if blended:
+        sections = {collection_type: result for collection_type, _, result in outcomes if result is not None}
+        totals = {
+            collection_type: results[0]._total if results else 0
+            for collection_type, results in sections.items()
+        }
+        return {
+            'results': reciprocal_rank_fusion(sections, per_page),
+            'collections': {
+                collection_type: {'status': status[collection_type], 'total': totals.get(collection_type)}
+                for collection_type in collection_types
+            }
+        }
+
+    return {
+        'collections': {
+            collection_type: {'status': outcome, **(result or {})}
+            for collection_type, outcome, result in outcomes
+        }
+    }
@@ -0,0 +1,52 @@
+"""
+Cache of the filter metadata served by /api/filters.
+
+Filter values come from SELECT DISTINCT scans, so they are cached per
+collection together with an ETag. An entry is reused until its TTL expires
+or a committed write bumps the version of the collection's table, and is
+shared by all workers when SHARED_CACHE_URL is set.
+"""
+import hashlib
+import json
+from typing import Any, Callable, Dict, Optional, Tuple
+from services.search import config
+from services.search.shared_cache import SharedCache
+
+# Table whose writes change a collection's filter values
+FILTER_TABLES = {
+    'clinical_study': 'clinical_study',
+    'scientific_paper': 'scientific_papers',
+    'data_domain': 'data_domain_metadata',
+}
+
+_filter_cache = SharedCache('filters', len(FILTER_TABLES), config.FILTER_CACHE_TTL_SECONDS)
+
+def filters_etag(filters: Dict[str, Any]) -> str:
+    """Strong ETag derived from the serialized filter metadata"""
+    body = json.dumps(filters, sort_keys=True, default=str, separators=(',', ':'))
+    return '"' + hashlib.sha1(body.encode()).hexdigest()[:20] + '"'
+
+def get_filter_metadata(collection_type: str, load: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], str]:
+    """Return a collection's filters and their ETag, calling `load` only on a cache miss"""
+    cached = _filter_cache.get(collection_type, (FILTER_TABLES.get(collection_type, collection_type),))
+    if cached.value is not None:
+        return cached.value[0], cached.value[1]
+
+    filters = load()
+    etag = filters_etag(filters)
+    _filter_cache.set(collection_type, [filters, etag], cached)
+    return filters, etag
+
+def invalidate_filter_metadata(collection_type: Optional[str] = None):
+    """Drop the cached filters of one collection, or of all collections"""
+    if collection_type is None:
+        _filter_cache.clear()
+    else:
+        _filter_cache.pop(collection_type)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names the current ETag"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or any(candidate.removeprefix('W/') == etag for candidate in candidates)
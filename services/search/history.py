@@ -0,0 +1,274 @@
+"""
+Write-behind logging of searches to search_history.
+
+The search route hands each entry to a bounded asyncio queue and responds
+without waiting on the database. A background task collects entries until
+HISTORY_BATCH_SIZE are waiting or HISTORY_FLUSH_INTERVAL_SECONDS have passed
+since the first one, and writes the batch as one multi-row INSERT in a worker
+thread. When the queue is full, submit() waits up to
+HISTORY_ENQUEUE_TIMEOUT_SECONDS for room before dropping the entry, so a slow
+database slows searches down a little instead of growing memory without bound.
+On shutdown the queue is drained and the last batch written.
+
+Repeats of a search are aggregated rather than appended: a user's entries are
+keyed by (user_id, query_hash, category, filters_hash, month), where the
+hashes are taken over the normalized query and the canonical JSON of the
+filters and month is the partition the row lives in, and upsert_history()
+turns a repeat within a month into use_count + 1 and a new last_used on the
+existing row.
+
+history_page() reads a user's history most recently used first with keyset
+pagination on (last_used, id), served by the (user_id, last_used DESC, id DESC)
+index, so every page costs the same however long the history is and a search
+repeated today comes first even though its row was created earlier. Its bounds
+are also applied to the month partition key so that PostgreSQL prunes the
+partitions a page cannot come from.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import func, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models.database_models import SAVED_SEARCH_MONTH, SearchHistory, history_month
+from services.search import config
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Columns of the unique index repeats of a search are aggregated on
+HISTORY_KEY = ('user_id', 'query_hash', 'category', 'filters_hash', 'month')
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, for matching repeats"""
+    return " ".join((query or "").lower().split())
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(normalize_query(query).encode()).hexdigest()
+
+def filters_hash(filters: Optional[Dict[str, Any]]) -> str:
+    return hashlib.sha256(json.dumps(filters or {}, sort_keys=True, default=str).encode()).hexdigest()
+
+def aggregate_entries(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Merge entries with the same key, which one INSERT ... ON CONFLICT cannot
+    update twice. Entries are taken to be in submission order.
+    """
+    merged: Dict[tuple, Dict[str, Any]] = {}
+    for entry in entries:
+        key = tuple(entry[column] for column in HISTORY_KEY)
+        existing = merged.get(key)
+        if existing is None:
+            merged[key] = dict(entry)
+            continue
+        existing['use_count'] += entry['use_count']
+        existing['last_used'] = entry['last_used']
+        existing['is_saved'] = existing['is_saved'] or entry['is_saved']
+        if entry['results_count'] is not None:
+            existing['results_count'] = entry['results_count']
+    return list(merged.values())
+
+def upsert_history(db: Session, entries: List[Dict[str, Any]]):
+    """
+    Insert entries in one multi-row INSERT, adding repeats of an existing
+    entry to its use_count and last_used instead. The caller commits.
+    """
+    statement = insert(SearchHistory).values(aggregate_entries(entries))
+    excluded = statement.excluded
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[getattr(SearchHistory, column) for column in HISTORY_KEY],
+        set_={
+            'use_count': SearchHistory.use_count + excluded.use_count,
+            'last_used': excluded.last_used,
+            'results_count': func.coalesce(excluded.results_count, SearchHistory.results_count),
+            'is_saved': SearchHistory.is_saved | excluded.is_saved,
+        }
+    ))
+
+class HistoryWriter:
+    """Batches search history entries and writes them in the background"""
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        """Start the flush task on the running event loop, if it is not running already"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(config.HISTORY_QUEUE_SIZE)
+            self._task = asyncio.ensure_future(self._run())
+
+    async def submit(self, entry: Dict[str, Any]):
+        """Queue a search_history row, waiting briefly for room when the queue is full"""
+        self.start()
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(entry), config.HISTORY_ENQUEUE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                logger.warning("Search history queue full, dropped entry for user %s", entry.get('user_id'))
+
+    async def _run(self):
+        queue = self._queue
+        stopping = False
+        while not stopping:
+            entry = await queue.get()
+            if entry is _STOP:
+                return
+            batch = [entry]
+            deadline = time.monotonic() + config.HISTORY_FLUSH_INTERVAL_SECONDS
+            while len(batch) < config.HISTORY_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            await asyncio.to_thread(self._write, batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        """Upsert a batch with a single multi-row INSERT"""
+        db = SessionLocal()
+        try:
+            upsert_history(db, batch)
+            db.commit()
+            self.written += len(batch)
+            self.batches += 1
+            logger.debug("Wrote %d search history entries", len(batch))
+        except Exception as e:
+            db.rollback()
+            self.failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} search history entries: {str(e)}", exc_info=True)
+        finally:
+            db.close()
+
+    async def stop(self):
+        """Write every queued entry, then stop the flush task"""
+        task, self._task = self._task, None
+        if task is None or task.done():
+            return
+        # Queued behind the pending entries, so the task writes them all before it sees it
+        await self._queue.put(_STOP)
+        await task
+        logger.info("Search history writer stopped")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+history_writer = HistoryWriter()
+
+def history_entry(user_id: int, query: str, category: Optional[str], filters: Optional[Dict[str, Any]],
+                  results_count: Optional[int], is_saved: bool = False) -> Dict[str, Any]:
+    """
+    A search_history row for a search. A results_count of None keeps the
+    count already recorded for a repeat. A missing category is stored as ''
+    so that such entries still aggregate under the unique index.
+    """
+    now = datetime.utcnow()
+    return {
+        'user_id': user_id,
+        'query': query or "",
+        'query_hash': query_hash(query),
+        'category': category or "",
+        'filters': filters,
+        'filters_hash': filters_hash(filters),
+        'month': history_month(now),
+        'results_count': results_count,
+        'created_at': now,
+        'last_used': now,
+        'is_saved': is_saved,
+        'use_count': 1,
+    }
+
+def encode_history_cursor(last_used: datetime, id: int) -> str:
+    """Opaque, URL-safe token for the sort key of the last entry on a history page"""
+    raw = json.dumps({'u': last_used.isoformat(), 'i': id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_history_cursor(cursor: str):
+    """(last_used, id) of an encode_history_cursor token; raises ValueError when malformed"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(payload['u']), int(payload['i'])
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+        raise ValueError("Invalid history cursor")
+
+def history_page(db: Session, user_id: int, limit: int, cursor: Optional[str] = None,
+                 category: Optional[str] = None, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    One page of a user's history, most recently used first, and the cursor of
+    the next page (None on the last one). `since` (inclusive) and `until`
+    (exclusive) bound the time an entry was last used.
+    """
+    # Repeats only update the row of the month they happen in, so a row's last_used
+    # always falls in its month and every bound on last_used is repeated on month,
+    # which is what partition pruning looks at. Saved searches of expired months are
+    # the exception: they keep their last_used under SAVED_SEARCH_MONTH, which is
+    # below every other month and so only needs a case of its own for `since`
+    query = db.query(SearchHistory).filter(SearchHistory.user_id == user_id)
+    if category is not None:
+        query = query.filter(SearchHistory.category == category)
+    if since is not None:
+        query = query.filter(
+            SearchHistory.last_used >= since,
+            or_(SearchHistory.month >= history_month(since), SearchHistory.month == SAVED_SEARCH_MONTH)
+        )
+    if until is not None:
+        query = query.filter(SearchHistory.last_used < until, SearchHistory.month <= history_month(until))
+    if cursor:
+        last_used, last_id = decode_history_cursor(cursor)
+        query = query.filter(
+            tuple_(SearchHistory.last_used, SearchHistory.id) < tuple_(last_used, last_id),
+            SearchHistory.month <= history_month(last_used)
+        )
+
+    # One extra row tells whether there is a next page without a count
+    entries = query.order_by(SearchHistory.last_used.desc(), SearchHistory.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_history_cursor(entries[-1].last_used, entries[-1].id)
+
+    return {
+        'items': [
+            {
+                'id': entry.id,
+                'query': entry.query,
+                'category': entry.category,
+                'filters': entry.filters if entry.filters else {},
+                'results_count': entry.results_count,
+                'created_at': entry.created_at,
+                'is_saved': entry.is_saved,
+                'last_used': entry.last_used,
+                'use_count': entry.use_count
+            }
+            for entry in entries
+        ],
+        'next_cursor': next_cursor
+    }
@@ -0,0 +1,250 @@
+"""
+Maintenance of the monthly search_history partitions.
+
+search_history is range-partitioned on its month column, one
+search_history_YYYY_MM partition per month. A background thread runs
+maintain_history_partitions() every HISTORY_MAINTENANCE_INTERVAL_SECONDS:
+
+- partitions are created for the current month and HISTORY_PARTITIONS_AHEAD
+  months after it, so inserts never miss a partition;
+- partitions that end more than HISTORY_RETENTION_DAYS ago are detached with
+  DETACH PARTITION CONCURRENTLY, folded into search_history_rollup (use
+  counts added per user and search) and dropped, one partition per
+  transaction. Saved searches are not rolled up; they move with their ids to
+  the search_history_saved partition, which is never dropped; a search
+  unsaved after that is folded into the rollup on the next run.
+
+Dropping a whole partition leaves no dead tuples to vacuum and no index
+entries to clean up, so maintenance cost tracks one month of history rather
+than the whole table. Detaching concurrently and dropping the detached table
+never take more than a brief lock on search_history itself. With several
+workers, a session-level advisory lock lets only one of them maintain the
+partitions at a time.
+"""
+import logging
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from database import engine
+from models.database_models import SAVED_SEARCH_MONTH, history_month
+from services.search import config
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_lock key of the maintenance run
+MAINTENANCE_LOCK_KEY = 0x5E4C4157
+
+PARTITION_NAME = re.compile(r"^search_history_(\d{4})_(\d{2})$")
+
+# Partition of the saved searches carried out of expired partitions
+SAVED_PARTITION = "search_history_saved"
+
+_maintainer: Optional[threading.Thread] = None
+_maintainer_lock = threading.Lock()
+
+def add_months(month: date, count: int) -> date:
+    """First day of the month `count` months after `month`"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"search_history_{month.year:04d}_{month.month:02d}"
+
+def history_partitions(conn: Connection) -> List[Tuple[date, str]]:
+    """(month, name) of every monthly partition of search_history, oldest first"""
+    names = conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'search_history'::regclass
+    """)).scalars()
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+def monthly_tables(conn: Connection) -> List[Tuple[date, str, Optional[bool]]]:
+    """
+    (month, name, detach_pending) of every monthly history table, oldest first.
+    detach_pending is None for a table that is already detached, which an
+    interrupted run can leave behind.
+    """
+    rows = conn.execute(text("""
+        SELECT c.relname, i.inhdetachpending FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'search_history'::regclass
+        WHERE c.relkind = 'r' AND c.relname LIKE 'search\\_history\\_%'
+    """)).fetchall()
+    tables = []
+    for name, detach_pending in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            tables.append((date(int(match.group(1)), int(match.group(2)), 1), name, detach_pending))
+    return sorted(tables)
+
+def create_saved_partition(conn: Connection):
+    """Create the partition saved searches are carried into, below every monthly partition"""
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {SAVED_PARTITION} PARTITION OF search_history
+        FOR VALUES FROM (MINVALUE) TO ('{add_months(SAVED_SEARCH_MONTH, 1).isoformat()}')
+    """))
+
+def create_partitions(conn: Connection, first: date, last: date) -> int:
+    """Create the missing partitions for the months from `first` to `last`; returns how many were created"""
+    existing = {month for month, _ in history_partitions(conn)}
+    created = 0
+    month = first
+    while month <= last:
+        if month not in existing:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF search_history
+                FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')
+            """))
+            created += 1
+        month = add_months(month, 1)
+    return created
+
+def detach_partition(name: str, detach_pending: bool):
+    """Detach a partition without blocking reads and writes of search_history"""
+    # DETACH PARTITION CONCURRENTLY cannot run inside a transaction block; FINALIZE
+    # completes a concurrent detach that was interrupted
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        mode = "FINALIZE" if detach_pending else "CONCURRENTLY"
+        conn.execute(text(f"ALTER TABLE search_history DETACH PARTITION {name} {mode}"))
+
+ROLLUP_UPSERT = """
+    ON CONFLICT (user_id, query_hash, category, filters_hash) DO UPDATE SET
+        use_count = search_history_rollup.use_count + excluded.use_count,
+        first_used = least(search_history_rollup.first_used, excluded.first_used),
+        last_used = greatest(search_history_rollup.last_used, excluded.last_used),
+        results_count = CASE WHEN excluded.last_used >= search_history_rollup.last_used
+                             THEN excluded.results_count ELSE search_history_rollup.results_count END,
+        query = CASE WHEN excluded.last_used >= search_history_rollup.last_used
+                     THEN excluded.query ELSE search_history_rollup.query END
+"""
+
+def expire_table(name: str):
+    """Fold a detached partition into the rollup, move its saved searches and drop it"""
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO search_history_rollup
+                (user_id, query, category, filters, query_hash, filters_hash,
+                 use_count, results_count, first_used, last_used)
+            SELECT user_id, query, category, filters, query_hash, filters_hash,
+                   use_count, results_count, created_at, last_used
+            FROM {name}
+            WHERE NOT coalesce(is_saved, false)
+            {ROLLUP_UPSERT}
+        """))
+
+        # A saved search that was already carried over in an earlier month absorbs this
+        # one below; its snapshot follows it, unless the survivor has one of its own
+        merged = f"""
+            SELECT p.id AS old_id, s.id AS new_id
+            FROM {name} p
+            JOIN {SAVED_PARTITION} s
+              ON s.user_id = p.user_id AND s.query_hash = p.query_hash
+             AND s.category = p.category AND s.filters_hash = p.filters_hash
+            WHERE p.is_saved
+        """
+        conn.execute(text(f"""
+            DELETE FROM saved_search_snapshots snapshot
+            USING ({merged}) merged
+            WHERE snapshot.history_id = merged.old_id
+              AND EXISTS (SELECT 1 FROM saved_search_snapshots kept WHERE kept.history_id = merged.new_id)
+        """))
+        conn.execute(text(f"""
+            UPDATE saved_search_snapshots snapshot SET history_id = merged.new_id
+            FROM ({merged}) merged
+            WHERE snapshot.history_id = merged.old_id
+        """))
+
+        # Everything else keeps its id, so saved search URLs and snapshots stay valid
+        conn.execute(text(f"""
+            INSERT INTO search_history
+                (id, month, user_id, query, category, filters, results_count, created_at,
+                 is_saved, last_used, use_count, query_hash, filters_hash)
+            SELECT id, :saved_month, user_id, query, category, filters, results_count, created_at,
+                   is_saved, last_used, use_count, query_hash, filters_hash
+            FROM {name}
+            WHERE is_saved
+            ON CONFLICT (user_id, query_hash, category, filters_hash, month) DO UPDATE SET
+                is_saved = true,
+                use_count = search_history.use_count + excluded.use_count,
+                last_used = greatest(search_history.last_used, excluded.last_used)
+        """), {"saved_month": SAVED_SEARCH_MONTH})
+
+        # A standalone table now; dropping it does not lock search_history
+        conn.execute(text(f"DROP TABLE {name}"))
+    logger.info(f"Rolled up and dropped search history partition {name}")
+
+def expire_unsaved():
+    """Fold searches that were unsaved after their month expired into the rollup"""
+    with engine.begin() as conn:
+        expired = conn.execute(text(f"""
+            WITH unsaved AS (
+                DELETE FROM {SAVED_PARTITION} WHERE NOT coalesce(is_saved, false)
+                RETURNING user_id, query, category, filters, query_hash, filters_hash,
+                          use_count, results_count, created_at, last_used
+            )
+            INSERT INTO search_history_rollup
+                (user_id, query, category, filters, query_hash, filters_hash,
+                 use_count, results_count, first_used, last_used)
+            SELECT user_id, query, category, filters, query_hash, filters_hash,
+                   use_count, results_count, created_at, last_used
+            FROM unsaved
+            {ROLLUP_UPSERT}
+        """)).rowcount
+    if expired:
+        logger.info(f"Rolled up {expired} unsaved searches of expired months")
+
+def maintain_history_partitions(now: datetime = None):
+    """Create upcoming partitions and expire those past the retention period"""
+    now = now or datetime.utcnow()
+    current = history_month(now)
+    with engine.connect() as lock_conn:
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}).scalar():
+            logger.debug("Search history maintenance is running in another worker")
+            return
+        try:
+            with engine.begin() as conn:
+                create_saved_partition(conn)
+                created = create_partitions(conn, current, add_months(current, config.HISTORY_PARTITIONS_AHEAD))
+            if created:
+                logger.info(f"Created {created} search history partitions")
+
+            if config.HISTORY_RETENTION_DAYS > 0:
+                cutoff = history_month(now - timedelta(days=config.HISTORY_RETENTION_DAYS))
+                with engine.connect() as conn:
+                    tables = monthly_tables(conn)
+                for month, name, detach_pending in tables:
+                    # Only whole months are dropped: the partition must end before the cutoff month
+                    if add_months(month, 1) > cutoff:
+                        continue
+                    if detach_pending is not None:
+                        detach_partition(name, detach_pending)
+                    expire_table(name)
+                expire_unsaved()
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+            lock_conn.commit()
+
+def _maintenance_loop():
+    while True:
+        try:
+            maintain_history_partitions()
+        except Exception as e:
+            logger.error(f"Search history maintenance failed: {str(e)}", exc_info=True)
+        time.sleep(config.HISTORY_MAINTENANCE_INTERVAL_SECONDS)
+
+def start_history_maintenance():
+    """Start the background thread that maintains the history partitions"""
+    global _maintainer
+    with _maintainer_lock:
+        if _maintainer is None or not _maintainer.is_alive():
+            _maintainer = threading.Thread(target=_maintenance_loop, name="search-history-maintenance", daemon=True)
+            _maintainer.start()
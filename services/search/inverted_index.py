@@ -0,0 +1,335 @@
+"""
+In-process inverted index over the clinical_study table.
+
+Search terms are matched with the same semantics as the SQL provider
+(case-insensitive substring over title, description and drug), so the indexed
+and SQL modes return identical results. The shared index is invalidated
+whenever a committed write bumps the clinical_study table version, and is
+rebuilt at least every CLINICAL_STUDY_INDEX_MAX_AGE seconds to pick up writes
+made outside this process. Builds run in the background, one at a time; until
+a current index is ready the provider searches with SQL.
+"""
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy.orm import Session
+from models.database_models import ClinicalStudy
+from services.search import config
+from database import SessionLocal
+from services.search.cache import on_table_version_bump
+from services.search.cursor import CursorKey
+from services.search.ranking import TOKEN_PATTERN, FIELD_WEIGHTS, BM25Scorer, CorpusStats, tokenize
+from services.search.single_flight import BackgroundBuild
+
+logger = logging.getLogger(__name__)
+
+# Columns searched by the free-text terms
+SEARCH_FIELDS = ('title', 'description', 'drug')
+
+# String columns that can be filtered against the index with equality semantics
+STRING_FILTER_FIELDS = (
+    'status', 'phase', 'drug', 'indication_category', 'procedure_category',
+    'severity', 'risk_level', 'institution'
+)
+
+# Characters that act as wildcards in an ILIKE pattern
+LIKE_WILDCARDS = ('%', '_', '\\')
+
+# Longest substring of a token keyed in the gram map; longer pieces are looked up by their grams
+GRAM_LENGTH = 3
+
+def _grams(text: str) -> set:
+    """Every substring of the text up to GRAM_LENGTH characters long"""
+    return {text[start:start + length]
+            for length in range(1, GRAM_LENGTH + 1)
+            for start in range(len(text) - length + 1)}
+
+class ClinicalStudyIndex:
+    """
+    Immutable snapshot of the clinical_study table.
+
+    Documents are stored by position in ascending id order, and every token maps
+    to a sorted array of positions, so a sorted list of positions is also sorted
+    by study id. Per-field postings carry term frequencies for BM25 scoring.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.texts: List[Tuple[Optional[str], ...]] = []
+        self.columns: Dict[str, List[Any]] = {name: [] for name in STRING_FILTER_FIELDS + ('duration',)}
+        self.postings: Dict[str, array] = {}
+        # Substring of up to GRAM_LENGTH characters -> tokens containing it
+        self.gram_tokens: Dict[str, List[str]] = {}
+        # field -> token -> (positions, term frequencies)
+        self.field_postings: Dict[str, Dict[str, Tuple[array, array]]] = {field: {} for field in SEARCH_FIELDS}
+        self.field_lengths: Dict[str, array] = {field: array('i') for field in SEARCH_FIELDS}
+        self.stats = CorpusStats(SEARCH_FIELDS)
+        self.built_at = time.monotonic()
+        # Invalidation generation the index was built in
+        self.generation = _generation
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, db: Session) -> "ClinicalStudyIndex":
+        """Build an index from the current contents of clinical_study"""
+        started = time.monotonic()
+        index = cls()
+        # Taken before reading, so a write committed during the build still invalidates it
+        index.generation = _generation
+        postings: Dict[str, List[int]] = {}
+        field_postings: Dict[str, Dict[str, Tuple[List[int], List[int]]]] = {field: {} for field in SEARCH_FIELDS}
+        column_names = list(index.columns.keys())
+        rows = db.query(
+            ClinicalStudy.id,
+            *[getattr(ClinicalStudy, name) for name in SEARCH_FIELDS],
+            *[getattr(ClinicalStudy, name) for name in column_names]
+        ).order_by(ClinicalStudy.id).yield_per(1000)
+
+        for row in rows:
+            position = len(index.ids)
+            index.ids.append(row[0])
+            texts = tuple(value.lower() if value is not None else None for value in row[1:1 + len(SEARCH_FIELDS)])
+            index.texts.append(texts)
+            for name, value in zip(column_names, row[1 + len(SEARCH_FIELDS):]):
+                index.columns[name].append(value)
+            field_tokens = {field: tokenize(text) for field, text in zip(SEARCH_FIELDS, texts)}
+            index.stats.add_document(field_tokens)
+            for field, tokens in field_tokens.items():
+                index.field_lengths[field].append(len(tokens))
+                for token, tf in Counter(tokens).items():
+                    token_positions, token_tfs = field_postings[field].setdefault(token, ([], []))
+                    token_positions.append(position)
+                    token_tfs.append(tf)
+                    positions = postings.setdefault(token, [])
+                    if not positions or positions[-1] != position:
+                        positions.append(position)
+
+        index.postings = {token: array('i', positions) for token, positions in postings.items()}
+        for token in index.postings:
+            for gram in _grams(token):
+                index.gram_tokens.setdefault(gram, []).append(token)
+        index.field_postings = {
+            field: {token: (array('i', positions), array('i', tfs)) for token, (positions, tfs) in tokens.items()}
+            for field, tokens in field_postings.items()
+        }
+        index.built_at = time.monotonic()
+        logger.info(
+            f"Built clinical study index: {len(index)} studies, {len(index.postings)} tokens "
+            f"in {index.built_at - started:.2f}s"
+        )
+        return index
+
+    def is_stale(self) -> bool:
+        """Whether clinical_study was written since the build or the index is older than the maximum age"""
+        if self.generation != _generation:
+            return True
+        return time.monotonic() - self.built_at > config.CLINICAL_STUDY_INDEX_MAX_AGE
+
+    @staticmethod
+    def supports(terms: Sequence[str], filters: Dict[str, Any]) -> bool:
+        """
+        Whether a query can be answered from the index with the same results as SQL.
+
+        Terms containing ILIKE wildcards and filters on columns that are not indexed
+        (or with non-string values) have to go through the SQL path.
+        """
+        for term in terms:
+            if any(char in term for char in LIKE_WILDCARDS):
+                return False
+
+        for filter_name, filter_value in filters.items():
+            if not hasattr(ClinicalStudy, filter_name):
+                continue
+            if isinstance(filter_value, dict) or not filter_value:
+                continue
+            values = filter_value if isinstance(filter_value, list) else [filter_value]
+            if filter_name not in STRING_FILTER_FIELDS:
+                return False
+            if not all(isinstance(value, str) for value in values):
+                return False
+        return True
+
+    def search(self, terms: Sequence[str], filters: Dict[str, Any], offset: int, limit: int,
+               tokens: Optional[Sequence[str]] = None,
+               after: Optional[CursorKey] = None) -> Tuple[List[int], int, List[Optional[float]]]:
+        """
+        Return the study ids and scores for one page of matches, and the total number of matches.
+
+        With query tokens, matches are ordered by BM25 score and then by study id;
+        without, they are ordered by study id like the SQL provider. `after` starts
+        the page behind a cursor's sort key instead of at `offset`.
+        """
+        positions = self._filter(self._match(terms), filters)
+        if tokens:
+            scores = self._bm25(tokens, positions)
+            positions.sort(key=lambda position: -scores.get(position, 0.0))
+            if after is not None:
+                keys = [(-scores.get(position, 0.0), self.ids[position]) for position in positions]
+                offset = bisect_right(keys, (-(after.score or 0.0), after.id))
+            page = positions[offset:offset + limit]
+            page_scores = [scores.get(position, 0.0) for position in page]
+        else:
+            if after is not None:
+                offset = bisect_right([self.ids[position] for position in positions], after.id)
+            page = positions[offset:offset + limit]
+            page_scores = [None] * len(page)
+        return [self.ids[position] for position in page], len(positions), page_scores
+
+    def facets(self, terms: Sequence[str], filters: Dict[str, Any], fields: Sequence[str]) -> Dict[str, Counter]:
+        """Number of matches per value of each indexed string column"""
+        positions = self._filter(self._match(terms), filters)
+        return {field: Counter(self.columns[field][position] for position in positions) for field in fields}
+
+    def _bm25(self, tokens: Sequence[str], positions: List[int]) -> Dict[int, float]:
+        """Score candidate positions term-at-a-time from the per-field postings"""
+        scorer = BM25Scorer(self.stats, FIELD_WEIGHTS['clinical_study'])
+        candidates = set(positions)
+        scores: Dict[int, float] = {}
+        for token in tokens:
+            weighted_tfs: Dict[int, float] = {}
+            for field in SEARCH_FIELDS:
+                entry = self.field_postings[field].get(token)
+                if entry is None:
+                    continue
+                lengths = self.field_lengths[field]
+                for position, tf in zip(*entry):
+                    if position in candidates:
+                        weighted_tfs[position] = weighted_tfs.get(position, 0.0) + \
+                            scorer.weighted_tf(field, tf, lengths[position])
+            for position, weighted_tf in weighted_tfs.items():
+                scores[position] = scores.get(position, 0.0) + scorer.term_score(token, weighted_tf)
+        return scores
+
+    def _match(self, terms: Sequence[str]) -> List[int]:
+        """Positions of documents matching any of the terms"""
+        if not terms:
+            return list(range(len(self.ids)))
+
+        matched = set()
+        for term in terms:
+            matched.update(self._match_term(term.lower()))
+        return sorted(matched)
+
+    def _match_term(self, term: str) -> Iterable[int]:
+        """Positions of documents containing the term as a substring of any search field"""
+        pieces = set(TOKEN_PATTERN.findall(term))
+        if pieces:
+            candidates = None
+            for piece in pieces:
+                piece_positions = self._positions_containing(piece)
+                candidates = piece_positions if candidates is None else candidates & piece_positions
+                if not candidates:
+                    return []
+        else:
+            candidates = range(len(self.ids))
+
+        # A term made of a single word can only occur inside one token, so the
+        # token lookup is already exact. Anything else spans token boundaries and
+        # has to be checked against the stored text.
+        if len(pieces) == 1 and term in pieces:
+            return candidates
+        return [
+            position for position in candidates
+            if any(text is not None and term in text for text in self.texts[position])
+        ]
+
+    def _positions_containing(self, piece: str) -> set:
+        """Union of the posting lists of every token that contains the piece"""
+        positions = set()
+        for token in self._tokens_containing(piece):
+            positions.update(self.postings[token])
+        return positions
+
+    def _tokens_containing(self, piece: str) -> Iterable[str]:
+        """
+        Tokens of the vocabulary containing the piece, found through the gram map.
+
+        Short pieces are keys of the map themselves. Longer ones are looked up by
+        the tokens sharing their rarest gram, which are then checked for the piece.
+        """
+        if len(piece) <= GRAM_LENGTH:
+            return self.gram_tokens.get(piece, ())
+        grams = [piece[start:start + GRAM_LENGTH] for start in range(len(piece) - GRAM_LENGTH + 1)]
+        candidates = min((self.gram_tokens.get(gram, ()) for gram in grams), key=len)
+        return [token for token in candidates if piece in token]
+
+    def _filter(self, positions: List[int], filters: Dict[str, Any]) -> List[int]:
+        """Apply the provider's filter semantics to a list of positions"""
+        for filter_name, filter_value in filters.items():
+            if not hasattr(ClinicalStudy, filter_name):
+                continue
+
+            if isinstance(filter_value, dict):
+                # Range filters are only defined for duration
+                if filter_name != 'duration':
+                    continue
+                column = self.columns['duration']
+                min_val = filter_value.get('min')
+                max_val = filter_value.get('max')
+                if min_val and str(min_val).isdigit():
+                    positions = [p for p in positions if column[p] is not None and column[p] >= int(min_val)]
+                if max_val and str(max_val).isdigit():
+                    positions = [p for p in positions if column[p] is not None and column[p] <= int(max_val)]
+            elif isinstance(filter_value, list):
+                if filter_value:
+                    column = self.columns[filter_name]
+                    allowed = set(filter_value)
+                    positions = [p for p in positions if column[p] in allowed]
+            elif filter_value:
+                column = self.columns[filter_name]
+                positions = [p for p in positions if column[p] == filter_value]
+
+        return positions
+
+_index: Optional[ClinicalStudyIndex] = None
+# Bumped by every invalidation; an index built in an older generation is stale
+_generation = 0
+_generation_lock = threading.Lock()
+
+def _build_shared_index() -> ClinicalStudyIndex:
+    global _index
+    db = SessionLocal()
+    try:
+        _index = ClinicalStudyIndex.build(db)
+    finally:
+        db.close()
+    return _index
+
+_builder = BackgroundBuild('clinical-study-index-build', _build_shared_index)
+
+def get_clinical_study_index() -> Optional[ClinicalStudyIndex]:
+    """
+    Return the shared clinical study index, or None while there is no current one.
+
+    A missing or stale index is rebuilt in the background by a single build that
+    concurrent callers share. An index that merely outlived its maximum age is
+    still returned meanwhile; one invalidated by a write is not, and the caller
+    falls back to SQL until the rebuild finishes.
+    """
+    index = _index
+    if index is not None and not index.is_stale():
+        return index
+    _builder.start()
+    if index is not None and index.generation == _generation:
+        return index
+    return None
+
+def invalidate_clinical_study_index():
+    """Mark the shared index stale so the next search rebuilds it"""
+    global _generation
+    # A build that is already running took the previous generation, so its index
+    # comes out stale and the next search starts another
+    with _generation_lock:
+        _generation += 1
+
+def _invalidate_on_write(table_name: str):
+    if table_name == ClinicalStudy.__tablename__:
+        invalidate_clinical_study_index()
+
+on_table_version_bump(_invalidate_on_write)
@@ -0,0 +1,30 @@
+"""
+Column projection for search providers.
+
+Transformers declare the SearchResult fields they read in `required_fields`
+and the service copies them to SearchQuery.fields. Providers map each field
+to the columns it is built from and load only those, so a compact search
+does not read abstracts, JSON blobs or data products it would throw away.
+Fields that were not loaded are left at their SearchResult defaults.
+"""
+from typing import Any, Dict, List, Sequence
+from sqlalchemy.orm import load_only
+from services.search.base import SearchQuery
+
+def wants(query: SearchQuery, field: str) -> bool:
+    """Whether the transformer reads a SearchResult field; every field is wanted when none are declared"""
+    return query.fields is None or field in query.fields
+
+def projection_options(query: SearchQuery, columns_by_field: Dict[str, Sequence[Any]],
+                       extra_columns: Sequence[Any] = ()) -> List[Any]:
+    """
+    load_only options for the fields a query wants, or none when it wants everything.
+
+    `columns_by_field` maps SearchResult fields to entity columns; `extra_columns`
+    are loaded regardless, e.g. the title every result carries.
+    """
+    if query.fields is None:
+        return []
+    columns = [column for field in query.fields for column in columns_by_field.get(field, ())]
+    columns.extend(extra_columns)
+    return [load_only(*dict.fromkeys(columns))]
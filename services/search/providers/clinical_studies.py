@@ -1,11 +1,35 @@
 """
 Search provider implementation for clinical studies collection.
 """
-from typing import List, Dict, Any
-from sqlalchemy import or_, and_
-from sqlalchemy.orm import Session, joinedload
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from sqlalchemy import or_, and_, func
+from sqlalchemy.orm import Session
 from models.database_models import ClinicalStudy, DataProduct
+from services.search import config
 from services.search.base import SearchProvider, SearchQuery, SearchResult
+from services.search.counts import EXACT, count_matches, window_count, window_total
+from services.search.cursor import decode_cursor, encode_cursor, page_offset, seek_condition
+from services.search.export import stream_partitions
+from services.search.facets import cached_facets, format_facet, grouped_facet_counts
+from services.search.projection import projection_options, wants
+from services.search.inverted_index import ClinicalStudyIndex, get_clinical_study_index
+from services.search.ranking import RankedPage, query_tokens, rank_candidates, unranked_score
+from services.search.trigram import set_similarity_threshold, trigram_condition, trigram_similarity
+
+# Columns with per-value match counts
+FACET_FIELDS = ('status', 'phase', 'severity', 'risk_level', 'indication_category', 'drug')
+
+# Columns each SearchResult field is built from, for loading only what the transformer reads
+RESULT_COLUMNS = {
+    'description': (ClinicalStudy.description,),
+    'relevance_score': (ClinicalStudy.relevance_score,),
+    'data': (
+        ClinicalStudy.status, ClinicalStudy.phase, ClinicalStudy.drug, ClinicalStudy.indication_category,
+        ClinicalStudy.procedure_category, ClinicalStudy.severity, ClinicalStudy.risk_level,
+        ClinicalStudy.duration, ClinicalStudy.start_date, ClinicalStudy.end_date,
+        ClinicalStudy.institution, ClinicalStudy.participant_count
+    ),
+}
 
 class ClinicalStudySearchProvider(SearchProvider):
     def __init__(self, db: Session):
@@ -13,11 +37,97 @@ class ClinicalStudySearchProvider(SearchProvider):
 
     def search(self, query: SearchQuery) -> List[SearchResult]:
         """Execute search against clinical studies collection"""
-        # Build base query - use joinedload to eagerly load data_products
-        base_query = self.db.query(ClinicalStudy).options(joinedload(ClinicalStudy.data_products))
+        if config.CLINICAL_STUDY_SEARCH_MODE == 'index' and ClinicalStudyIndex.supports(query.terms, query.filters):
+            # Without a current index (first build, or a rebuild after a write) SQL answers
+            index = get_clinical_study_index()
+            if index is not None:
+                return self._search_index(query, index)
+        return self._search_sql(query)
+
+    def _search_sql(self, query: SearchQuery) -> List[SearchResult]:
+        """Match terms with ILIKE or trigram predicates evaluated by the database"""
+        base_query, score = self._match_query(query)
+
+        # Without a database-side score, BM25 ranks the candidate matches before the page is cut
+        ranked = rank_candidates('clinical_study', query, base_query) if score is None else None
+        if ranked is not None:
+            return self._search_ranked(query, ranked)
+
+        # In window mode the total comes back with the page rows, otherwise it is counted first
+        window = config.CLINICAL_STUDY_COUNT_MODE == 'window'
+        if window:
+            total_accuracy = EXACT
+        else:
+            total_count, total_accuracy = count_matches(
+                self.db, base_query, ClinicalStudy.id, query.terms, query.filters,
+                config.CLINICAL_STUDY_COUNT_MODE, config.CLINICAL_STUDY_SEARCH_MODE,
+                config.TRIGRAM_SIMILARITY_THRESHOLD
+            )
+
+        # Load the transformer's columns for the page only, not for the count
+        base_query = base_query.options(*self._load_options(query))
+
+        # Order by similarity when available, otherwise by id so pages are stable and match the indexed mode
+        if score is not None:
+            base_query = base_query.add_columns(score.label('score'))\
+                .order_by(score.desc().nulls_last(), ClinicalStudy.id)
+        else:
+            base_query = base_query.order_by(ClinicalStudy.id)
+        if window:
+            base_query = base_query.add_columns(window_count())
+
+        # Seek past the cursor instead of skipping rows with OFFSET
+        key = decode_cursor(query.cursor, ranked=score is not None) if query.cursor else None
+        if key is not None:
+            base_query = base_query.filter(seek_condition(key, ClinicalStudy.id, score))
+
+        # Apply pagination, fetching one extra row to tell whether there is a next page
+        rows = base_query.offset(page_offset(query)).limit(query.per_page + 1).all()
+        if window:
+            total_count = window_total(rows, key)
+        has_columns = score is not None or window
+        studies = [row[0] for row in rows] if has_columns else rows
+        scores = [row.score for row in rows] if score is not None else [unranked_score()] * len(rows)
+
+        next_cursor = None
+        if len(rows) > query.per_page:
+            studies, scores = studies[:query.per_page], scores[:query.per_page]
+            next_cursor = encode_cursor(score is not None, scores[-1], studies[-1].id, total_count)
+
+        data_products = self._top_data_products(query, [study.id for study in studies])
+        results = []
+        for study, relevance_score in zip(studies, scores):
+            result = self._to_result(study, query, total_count, relevance_score, data_products.get(study.id))
+            result._total_accuracy = total_accuracy
+            result._next_cursor = next_cursor
+            results.append(result)
+        return results
+
+    def _search_ranked(self, query: SearchQuery, ranked: RankedPage) -> List[SearchResult]:
+        """Hydrate a page of BM25-ranked matches by primary key"""
+        return self._hydrate(query, [study_id for _, study_id in ranked.matches],
+                             [study_score for study_score, _ in ranked.matches], ranked.total, True)
+
+    def _match_query(self, query: SearchQuery):
+        """
+        Build the query selecting the studies that match the terms and filters.
+
+        Returns the query and, in trigram mode, the similarity expression to order by.
+        """
+        # Build base query
+        base_query = self.db.query(ClinicalStudy)
+
+        # Similarity of each study to the terms, only set in trigram mode
+        score = None
 
         # Apply search terms
-        if query.terms:
+        if query.terms and config.CLINICAL_STUDY_SEARCH_MODE == 'trigram':
+            # Only the columns with a gin_trgm_ops index take part, so the match stays an index scan
+            trigram_columns = [ClinicalStudy.title, ClinicalStudy.drug]
+            set_similarity_threshold(self.db)
+            base_query = base_query.filter(trigram_condition(trigram_columns, query.terms))
+            score = trigram_similarity(trigram_columns, query.terms)
+        elif query.terms:
             search_conditions = []
             for term in query.terms:
                 term_conditions = [
@@ -33,7 +143,7 @@ class ClinicalStudySearchProvider(SearchProvider):
         for filter_name, filter_value in query.filters.items():
             if not hasattr(ClinicalStudy, filter_name):
                 continue
-                
+
             if isinstance(filter_value, dict):
                 # Handle range filters
                 if filter_name == 'duration':
@@ -47,7 +157,7 @@ class ClinicalStudySearchProvider(SearchProvider):
                 # Handle arrays of values (OR condition)
                 if filter_value:  # Only apply filter if list is not empty
                     filter_conditions = [
-                        getattr(ClinicalStudy, filter_name) == val 
+                        getattr(ClinicalStudy, filter_name) == val
                         for val in filter_value
                     ]
                     base_query = base_query.filter(or_(*filter_conditions))
@@ -56,59 +166,178 @@ class ClinicalStudySearchProvider(SearchProvider):
                 if filter_value:  # Only apply filter if value is not empty
                     base_query = base_query.filter(getattr(ClinicalStudy, filter_name) == filter_value)
 
-        # Get total count before pagination
-        total_count = base_query.count()
+        return base_query, score
 
-        # Apply pagination
-        studies = base_query.offset((query.page - 1) * query.per_page).limit(query.per_page).all()
+    def _search_index(self, query: SearchQuery, index: ClinicalStudyIndex) -> List[SearchResult]:
+        """Match terms and filters against the in-process index, then hydrate the page by primary key"""
+        tokens = query_tokens(query.terms) if config.SEARCH_RANKING == 'bm25' else None
+        ranked = bool(tokens)
+        after = decode_cursor(query.cursor, ranked=ranked) if query.cursor else None
+        page_ids, total_count, page_scores = index.search(
+            query.terms,
+            query.filters,
+            offset=page_offset(query),
+            limit=query.per_page + 1,
+            tokens=tokens,
+            after=after
+        )
+        return self._hydrate(query, page_ids, page_scores, total_count, ranked)
 
-        # Transform to SearchResults
-        results = []
-        for study in studies:
-            # Get associated data products (limited to 2)
-            data_products = []
-            for dp in study.data_products[:2]:  # Limit to 2 data products
-                data_products.append({
-                    'id': dp.id,
-                    'title': dp.title,
-                    'description': dp.description,
-                    'type': dp.type,
-                    'format': dp.format,
-                    'size': dp.size,
-                    'access_level': dp.access_level
-                })
-            
-            result = SearchResult(
-                id=str(study.id),
-                type='clinical_study',
-                title=study.title,
-                description=study.description,
-                relevance_score=study.relevance_score,
-                # Store all clinical study specific fields in the data dictionary
-                data={
-                    'status': study.status,
-                    'phase': study.phase,
-                    'drug': study.drug,
-                    'indication_category': study.indication_category,
-                    'procedure_category': study.procedure_category,
-                    'severity': study.severity,
-                    'risk_level': study.risk_level,
-                    'duration': study.duration,
-                    'start_date': study.start_date,
-                    'end_date': study.end_date,
-                    'institution': study.institution,
-                    'participant_count': study.participant_count
-                },
-                # Include data products directly in the result
-                data_products=data_products
-            )
-            # Attach query and total count to result
-            result._query = query
-            result._total = total_count
-            results.append(result)
+    def _hydrate(self, query: SearchQuery, page_ids: List[int], page_scores: List[Optional[float]],
+                 total_count: int, ranked: bool) -> List[SearchResult]:
+        """
+        Load the studies of a page of ids, one more than per_page when there is a
+        next page, and build their results in the order of the ids.
+        """
+        if not page_ids:
+            return []
 
+        next_cursor = None
+        if len(page_ids) > query.per_page:
+            page_ids, page_scores = page_ids[:query.per_page], page_scores[:query.per_page]
+            next_cursor = encode_cursor(ranked, page_scores[-1], page_ids[-1], total_count)
+
+        studies = self.db.query(ClinicalStudy)\
+            .options(*self._load_options(query))\
+            .filter(ClinicalStudy.id.in_(page_ids))\
+            .all()
+        studies_by_id = {study.id: study for study in studies}
+        data_products = self._top_data_products(query, list(studies_by_id))
+
+        # Keep the ranked order; studies deleted since the index was built are skipped
+        results = [
+            self._to_result(
+                studies_by_id[study_id], query, total_count,
+                (study_score or 0.0) if config.SEARCH_RANKING == 'bm25' else None,
+                data_products.get(study_id)
+            )
+            for study_id, study_score in zip(page_ids, page_scores)
+            if study_id in studies_by_id
+        ]
+        for result in results:
+            result._next_cursor = next_cursor
         return results
 
+    def export(self, query: SearchQuery, chunk_size: int) -> Iterator[List[SearchResult]]:
+        """Every matching study, by database-side score or else by id (unranked), read through a server-side cursor"""
+        base_query, score = self._match_query(query)
+
+        base_query = base_query.options(*self._load_options(query))
+        if score is not None:
+            base_query = base_query.add_columns(score.label('score'))\
+                .order_by(score.desc().nulls_last(), ClinicalStudy.id)
+        else:
+            base_query = base_query.order_by(ClinicalStudy.id)
+
+        for rows in stream_partitions(self.db, base_query, chunk_size):
+            # One data product query per chunk
+            data_products = self._top_data_products(query, [row[0].id for row in rows])
+            yield [
+                self._to_result(
+                    row[0], query, None, row.score if score is not None else None, data_products.get(row[0].id)
+                )
+                for row in rows
+            ]
+
+    def _load_options(self, query: SearchQuery) -> List[Any]:
+        """Loader options for the columns the query's transformer reads"""
+        return projection_options(query, RESULT_COLUMNS, (ClinicalStudy.title,))
+
+    def _top_data_products(self, query: SearchQuery, study_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        The first data products of each study, in id order, at most query.data_products_per_study each.
+
+        row_number() keeps the cut in SQL, so the page query needs no join and
+        products beyond the limit are never transferred.
+        """
+        limit = query.data_products_per_study
+        if limit is None:
+            limit = config.DATA_PRODUCTS_PER_STUDY
+        if not study_ids or limit <= 0 or not wants(query, 'data_products'):
+            return {}
+
+        product_rank = func.row_number().over(
+            partition_by=DataProduct.study_id, order_by=DataProduct.id
+        ).label('product_rank')
+        ranked = self.db.query(
+            DataProduct.study_id, DataProduct.id, DataProduct.title, DataProduct.description,
+            DataProduct.type, DataProduct.format, DataProduct.size, DataProduct.access_level, product_rank
+        ).filter(DataProduct.study_id.in_(study_ids)).subquery()
+        rows = self.db.query(ranked)\
+            .filter(ranked.c.product_rank <= limit)\
+            .order_by(ranked.c.study_id, ranked.c.product_rank)\
+            .all()
+
+        data_products: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            data_products.setdefault(row.study_id, []).append({
+                'id': row.id,
+                'title': row.title,
+                'description': row.description,
+                'type': row.type,
+                'format': row.format,
+                'size': row.size,
+                'access_level': row.access_level
+            })
+        return data_products
+
+    def _to_result(self, study: ClinicalStudy, query: SearchQuery, total_count: Optional[int],
+                   relevance_score: Optional[float] = None,
+                   data_products: Optional[List[Dict[str, Any]]] = None) -> SearchResult:
+        """Convert a clinical study row and its data products (from _top_data_products) into a SearchResult"""
+        # Store all clinical study specific fields in the data dictionary
+        data = {}
+        if wants(query, 'data'):
+            data = {
+                'status': study.status,
+                'phase': study.phase,
+                'drug': study.drug,
+                'indication_category': study.indication_category,
+                'procedure_category': study.procedure_category,
+                'severity': study.severity,
+                'risk_level': study.risk_level,
+                'duration': study.duration,
+                'start_date': study.start_date,
+                'end_date': study.end_date,
+                'institution': study.institution,
+                'participant_count': study.participant_count
+            }
+
+        if relevance_score is None and wants(query, 'relevance_score'):
+            relevance_score = study.relevance_score
+
+        result = SearchResult(
+            id=str(study.id),
+            type='clinical_study',
+            title=study.title,
+            description=study.description if wants(query, 'description') else None,
+            relevance_score=relevance_score,
+            data=data,
+            # Include data products directly in the result
+            data_products=data_products or []
+        )
+        # Attach query and total count to result
+        result._query = query
+        result._total = total_count
+        return result
+
+    def get_facets(self, query: SearchQuery) -> Dict[str, List[Dict[str, Any]]]:
+        """Number of matching studies per value of each facet column"""
+        def compute():
+            index = None
+            if config.CLINICAL_STUDY_SEARCH_MODE == 'index' and ClinicalStudyIndex.supports(query.terms, query.filters):
+                index = get_clinical_study_index()
+            if index is not None:
+                counts = index.facets(query.terms, query.filters, FACET_FIELDS)
+                return {field: format_facet(counts[field]) for field in FACET_FIELDS}
+            base_query, _ = self._match_query(query)
+            return grouped_facet_counts(base_query, {field: getattr(ClinicalStudy, field) for field in FACET_FIELDS})
+
+        return cached_facets(
+            'clinical_study', query.terms, query.filters, compute,
+            config.CLINICAL_STUDY_SEARCH_MODE, config.TRIGRAM_SIMILARITY_THRESHOLD
+        )
+
     def get_available_filters(self) -> Dict[str, List[str]]:
         """Return available filters for clinical studies"""
         return {
@@ -121,11 +350,11 @@ class ClinicalStudySearchProvider(SearchProvider):
             'risk_level': ['Low', 'Medium', 'High'],
             'duration': {'type': 'range', 'min': 0, 'max': None}
         }
-        
+
     def _get_distinct_values(self, field_name: str) -> List[str]:
         """Get distinct values for a given field from the database"""
         if not hasattr(ClinicalStudy, field_name):
             return []
-            
+
         values = self.db.query(getattr(ClinicalStudy, field_name)).distinct().all()
-        return [value[0] for value in values if value[0] is not None]
\ No newline at end of file
+        return [value[0] for value in values if value[0] is not None]
@@ -1,11 +1,28 @@
 """
 Search provider implementation for data domain metadata.
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from sqlalchemy import or_
 from sqlalchemy.orm import Session
 from models.database_models import DataDomainMetadata
+from services.search import config
 from services.search.base import SearchProvider, SearchQuery, SearchResult
+from services.search.counts import window_count, window_total
+from services.search.cursor import decode_cursor, encode_cursor, page_offset, seek_condition
+from services.search.export import stream_partitions
+from services.search.projection import projection_options, wants
+from services.search.ranking import RankedPage, rank_candidates, unranked_score
+from services.search.trigram import set_similarity_threshold, trigram_condition, trigram_similarity
+
+# Columns each SearchResult field is built from, for loading only what the transformer reads
+RESULT_COLUMNS = {
+    'description': (DataDomainMetadata.description,),
+    'data': (
+        DataDomainMetadata.schema_definition, DataDomainMetadata.validation_rules,
+        DataDomainMetadata.data_format, DataDomainMetadata.sample_data, DataDomainMetadata.owner,
+        DataDomainMetadata.created_at, DataDomainMetadata.updated_at
+    ),
+}
 
 class DataDomainSearchProvider(SearchProvider):
     def __init__(self, db: Session):
@@ -13,11 +30,94 @@ class DataDomainSearchProvider(SearchProvider):
 
     def search(self, query: SearchQuery) -> List[SearchResult]:
         """Execute search against data domain metadata collection"""
+        base_query, score = self._match_query(query)
+
+        # Without a database-side score, BM25 ranks the candidate matches before the page is cut
+        ranked = rank_candidates('data_domain', query, base_query) if score is None else None
+        if ranked is not None:
+            return self._search_ranked(query, ranked)
+
+        # Order by similarity when available, otherwise by id so pages are stable
+        if score is not None:
+            base_query = base_query.add_columns(score.label('score'))\
+                .order_by(score.desc().nulls_last(), DataDomainMetadata.id)
+        else:
+            base_query = base_query.order_by(DataDomainMetadata.id)
+
+        # The total number of matches comes back with every row of the page
+        base_query = base_query.add_columns(window_count())
+
+        # Load only the columns the transformer reads
+        base_query = base_query.options(*self._load_options(query))
+
+        # Seek past the cursor instead of skipping rows with OFFSET
+        key = decode_cursor(query.cursor, ranked=score is not None) if query.cursor else None
+        if key is not None:
+            base_query = base_query.filter(seek_condition(key, DataDomainMetadata.id, score))
+
+        # Apply pagination, fetching one extra row to tell whether there is a next page
+        rows = base_query.offset(page_offset(query)).limit(query.per_page + 1).all()
+        total_count = window_total(rows, key)
+        next_cursor = None
+        if len(rows) > query.per_page:
+            rows = rows[:query.per_page]
+            last = rows[-1]
+            next_cursor = encode_cursor(score is not None, last.score if score is not None else None,
+                                        last[0].id, total_count)
+
+        # Transform to SearchResults
+        results = []
+        for row in rows:
+            domain, relevance_score = row[0], (row.score if score is not None else unranked_score())
+            result = self._to_result(domain, query, total_count, relevance_score)
+            result._next_cursor = next_cursor
+            results.append(result)
+
+        return results
+
+    def _search_ranked(self, query: SearchQuery, ranked: RankedPage) -> List[SearchResult]:
+        """Load the domains of a page of BM25-ranked matches by primary key"""
+        page, total_count = ranked.matches, ranked.total
+        next_cursor = None
+        if len(page) > query.per_page:
+            page = page[:query.per_page]
+            next_cursor = encode_cursor(True, page[-1][0], page[-1][1], total_count)
+
+        domains = self.db.query(DataDomainMetadata)\
+            .options(*self._load_options(query))\
+            .filter(DataDomainMetadata.id.in_([domain_id for _, domain_id in page]))\
+            .all()
+        domains_by_id = {domain.id: domain for domain in domains}
+
+        # Keep the ranked order; domains deleted since they were ranked are skipped
+        results = []
+        for relevance_score, domain_id in page:
+            if domain_id in domains_by_id:
+                result = self._to_result(domains_by_id[domain_id], query, total_count,
+                                         relevance_score if relevance_score is not None else unranked_score())
+                result._next_cursor = next_cursor
+                results.append(result)
+        return results
+
+    def _match_query(self, query: SearchQuery):
+        """
+        Build the query selecting the domains that match the terms and filters.
+
+        Returns the query and, in trigram mode, the similarity expression to order by.
+        """
         # Build base query
         base_query = self.db.query(DataDomainMetadata)
 
+        # Similarity of each domain to the terms, only set in trigram mode
+        score = None
+
         # Apply search terms
-        if query.terms:
+        if query.terms and config.DATA_DOMAIN_SEARCH_MODE == 'trigram':
+            trigram_columns = [DataDomainMetadata.domain_name]
+            set_similarity_threshold(self.db)
+            base_query = base_query.filter(trigram_condition(trigram_columns, query.terms))
+            score = trigram_similarity(trigram_columns, query.terms)
+        elif query.terms:
             search_conditions = []
             for term in query.terms:
                 term_conditions = [
@@ -34,29 +134,54 @@ class DataDomainSearchProvider(SearchProvider):
             if hasattr(DataDomainMetadata, filter_name):
                 base_query = base_query.filter(getattr(DataDomainMetadata, filter_name) == filter_value)
 
-        # Apply pagination
-        domains = base_query.offset((query.page - 1) * query.per_page).limit(query.per_page).all()
+        return base_query, score
 
-        # Transform to SearchResults
-        results = []
-        for domain in domains:
-            results.append(SearchResult(
-                id=str(domain.id),
-                type='data_domain',
-                title=domain.domain_name,
-                description=domain.description,
-                data={
-                    'schema_definition': domain.schema_definition,
-                    'validation_rules': domain.validation_rules,
-                    'data_format': domain.data_format,
-                    'sample_data': domain.sample_data,
-                    'owner': domain.owner,
-                    'created_at': domain.created_at.isoformat(),
-                    'updated_at': domain.updated_at.isoformat()
-                }
-            ))
+    def _load_options(self, query: SearchQuery) -> List[Any]:
+        """Loader options for the columns the query's transformer reads"""
+        return projection_options(query, RESULT_COLUMNS, (DataDomainMetadata.domain_name,))
 
-        return results
+    def _to_result(self, domain: DataDomainMetadata, query: SearchQuery, total_count: Optional[int],
+                   relevance_score: Optional[float] = None) -> SearchResult:
+        """Convert a data domain row into a SearchResult"""
+        data = {}
+        if wants(query, 'data'):
+            data = {
+                'schema_definition': domain.schema_definition,
+                'validation_rules': domain.validation_rules,
+                'data_format': domain.data_format,
+                'sample_data': domain.sample_data,
+                'owner': domain.owner,
+                'created_at': domain.created_at.isoformat(),
+                'updated_at': domain.updated_at.isoformat()
+            }
+
+        result = SearchResult(
+            id=str(domain.id),
+            type='data_domain',
+            title=domain.domain_name,
+            description=domain.description if wants(query, 'description') else None,
+            relevance_score=relevance_score,
+            data=data
+        )
+        result._query = query
+        result._total = total_count
+        return result
+
+    def export(self, query: SearchQuery, chunk_size: int) -> Iterator[List[SearchResult]]:
+        """Every matching domain, by database-side score or else by id (unranked), read through a server-side cursor"""
+        base_query, score = self._match_query(query)
+        if score is not None:
+            base_query = base_query.add_columns(score.label('score'))\
+                .order_by(score.desc().nulls_last(), DataDomainMetadata.id)
+        else:
+            base_query = base_query.order_by(DataDomainMetadata.id)
+        base_query = base_query.options(*self._load_options(query))
+
+        for rows in stream_partitions(self.db, base_query, chunk_size):
+            yield [
+                self._to_result(row[0], query, None, row.score if score is not None else None)
+                for row in rows
+            ]
 
     def get_available_filters(self) -> Dict[str, List[str]]:
         """Return available filters for data domains"""
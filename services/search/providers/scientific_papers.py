@@ -1,16 +1,35 @@
 """
 Search provider implementation for scientific papers.
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from sqlalchemy import or_, func, String, and_, case, cast
 from sqlalchemy.orm import Session
 import logging
 from datetime import datetime, timedelta
-from models.database_models import ScientificPaper
+from functools import reduce
+from models.database_models import ScientificPaper, SCIENTIFIC_PAPER_TEXT_SEARCH_CONFIG
+from services.search import config
 from services.search.base import SearchProvider, SearchQuery, SearchResult
+from services.search.counts import window_count, window_total
+from services.search.cursor import decode_cursor, encode_cursor, page_offset, seek_condition
+from services.search.export import stream_partitions
+from services.search.facets import cached_facets, grouped_facet_counts
+from services.search.projection import projection_options, wants
+from services.search.ranking import RankedPage, rank_candidates, unranked_score
+from services.search.trigram import set_similarity_threshold, trigram_condition, trigram_similarity
 
 logger = logging.getLogger(__name__)
 
+# Columns each SearchResult field is built from, for loading only what the transformer reads
+RESULT_COLUMNS = {
+    'description': (ScientificPaper.abstract,),
+    'data': (
+        ScientificPaper.authors, ScientificPaper.publication_date, ScientificPaper.journal,
+        ScientificPaper.doi, ScientificPaper.keywords, ScientificPaper.citations_count,
+        ScientificPaper.reference_list
+    ),
+}
+
 class ScientificPaperSearchProvider(SearchProvider):
     def __init__(self, db: Session):
         self.db = db
@@ -18,152 +37,297 @@ class ScientificPaperSearchProvider(SearchProvider):
     def search(self, query: SearchQuery) -> List[SearchResult]:
         """Execute search against scientific papers collection"""
         try:
-            logger.debug(f"Starting scientific papers search with query: {query.terms}")
-
-            # Build base query
-            base_query = self.db.query(ScientificPaper)
-            logger.debug("Created base query")
-
-            # Apply search terms
-            if query.terms:
-                search_conditions = []
-                for term in query.terms:
-                    term = term.strip().lower()
-                    logger.debug(f"Processing search term: {term}")
-                    term_conditions = [
-                        ScientificPaper.title.ilike(f"%{term}%"),
-                        ScientificPaper.abstract.ilike(f"%{term}%"),
-                        ScientificPaper.journal.ilike(f"%{term}%"),
-                        # Search in keywords JSON array with explicit cast
-                        func.cast(ScientificPaper.keywords, String).ilike(f"%{term}%")
-                    ]
-                    search_conditions.append(or_(*term_conditions))
-
-                # Combine all conditions with OR
-                base_query = base_query.filter(or_(*search_conditions))
-                logger.debug(f"Applied search conditions for terms: {query.terms}")
-
-            # Apply user context based filters (authorization)
-            if query.user_context:
-                logger.debug(f"Applying authorization filters based on user context")
-                
-                # Example: Filter by access level
-                user_role = query.user_context.get('role', 'user')
-                
-                # Check if user has restricted content access or is an admin
-                has_restricted_access = user_role in ['admin', 'researcher', 'premium']
-                
-                # If the user doesn't have access to restricted content, filter it out
-                if not has_restricted_access:
-                    # Example: Filter out papers that require special access
-                    base_query = base_query.filter(
-                        or_(
-                            ScientificPaper.is_restricted.is_(None),
-                            ScientificPaper.is_restricted == False
-                        )
-                    )
-                    logger.debug(f"Applied restriction filter for user role: {user_role}")
-                    
-                # You could also add organization-based filtering
-                org_id = query.user_context.get('org_id')
-                if org_id and user_role != 'admin':
-                    # Example: Only show papers that belong to the user's organization
-                    # This is just an example - adjust according to your actual data model
-                    base_query = base_query.filter(
-                        or_(
-                            ScientificPaper.organization_id.is_(None),
-                            ScientificPaper.organization_id == org_id
-                        )
-                    )
-                    logger.debug(f"Applied organization filter for org_id: {org_id}")
-
-            # Apply filters
-            if query.filters:
-                filter_conditions = []
-
-                # Journal filter
-                if journal := query.filters.get('journal'):
-                    filter_conditions.append(ScientificPaper.journal == journal)
-
-                # Publication date filter
-                if date_range := query.filters.get('date_range'):
-                    now = datetime.utcnow()
-                    if date_range == 'last_week':
-                        start_date = now - timedelta(weeks=1)
-                    elif date_range == 'last_month':
-                        start_date = now - timedelta(days=30)
-                    elif date_range == 'last_year':
-                        start_date = now - timedelta(days=365)
-
-                    if date_range in ['last_week', 'last_month', 'last_year']:
-                        filter_conditions.append(ScientificPaper.publication_date >= start_date)
-
-                # Citations filter
-                if citations := query.filters.get('citations'):
-                    if citations == '0-10':
-                        filter_conditions.append(and_(
-                            ScientificPaper.citations_count >= 0,
-                            ScientificPaper.citations_count <= 10
-                        ))
-                    elif citations == '11-50':
-                        filter_conditions.append(and_(
-                            ScientificPaper.citations_count >= 11,
-                            ScientificPaper.citations_count <= 50
-                        ))
-                    elif citations == '51-100':
-                        filter_conditions.append(and_(
-                            ScientificPaper.citations_count >= 51,
-                            ScientificPaper.citations_count <= 100
-                        ))
-                    elif citations == '100+':
-                        filter_conditions.append(ScientificPaper.citations_count > 100)
-
-                if filter_conditions:
-                    base_query = base_query.filter(and_(*filter_conditions))
-                    logger.debug(f"Applied filters: {query.filters}")
-
-            # Apply pagination
-            base_query = base_query.offset((query.page - 1) * query.per_page).limit(query.per_page)
-            logger.debug(f"Applied pagination: page={query.page}, per_page={query.per_page}")
+            logger.debug("Starting scientific papers search with query: %s", query.terms)
+
+            base_query, rank = self._match_query(query)
+
+            # Without a database-side rank, BM25 ranks the candidate matches before the page is cut
+            ranked = rank_candidates('scientific_paper', query, base_query) if rank is None else None
+            if ranked is not None:
+                return self._search_ranked(query, ranked)
+
+            # Order by relevance when available, otherwise by id so pages are stable
+            if rank is not None:
+                base_query = base_query.add_columns(rank.label('rank'))\
+                    .order_by(rank.desc().nulls_last(), ScientificPaper.id)
+            else:
+                base_query = base_query.order_by(ScientificPaper.id)
+
+            # The total number of matches comes back with every row of the page
+            base_query = base_query.add_columns(window_count())
+
+            # Load only the columns the transformer reads
+            base_query = base_query.options(*self._load_options(query))
+
+            # Seek past the cursor instead of skipping rows with OFFSET
+            key = decode_cursor(query.cursor, ranked=rank is not None) if query.cursor else None
+            if key is not None:
+                base_query = base_query.filter(seek_condition(key, ScientificPaper.id, rank))
+
+            # Apply pagination, fetching one extra row to tell whether there is a next page
+            base_query = base_query.offset(page_offset(query)).limit(query.per_page + 1)
+            logger.debug("Applied pagination: page=%s, per_page=%s, cursor=%r", query.page, query.per_page, query.cursor)
 
             # Execute query
-            papers = base_query.all()
-            logger.debug(f"Found {len(papers)} papers matching the query")
+            rows = base_query.all()
+            logger.debug("Found %d papers matching the query", len(rows))
+
+            total_count = window_total(rows, key)
+            next_cursor = None
+            if len(rows) > query.per_page:
+                rows = rows[:query.per_page]
+                last = rows[-1]
+                next_cursor = encode_cursor(rank is not None, last.rank if rank is not None else None,
+                                            last[0].id, total_count)
 
             # Transform to SearchResults
             results = []
-            for paper in papers:
+            # Checked once: the per-row log below must cost nothing when DEBUG is off
+            debug = logger.isEnabledFor(logging.DEBUG)
+            for row in rows:
+                paper, score = row[0], (row.rank if rank is not None else unranked_score())
                 try:
-                    metadata = {
-                        'authors': paper.authors if paper.authors else [],
-                        'publication_date': paper.publication_date.isoformat() if paper.publication_date else None,
-                        'journal': paper.journal,
-                        'doi': paper.doi,
-                        'keywords': paper.keywords if paper.keywords else [],
-                        'citations_count': paper.citations_count,
-                        'references': paper.reference_list if paper.reference_list else []
-                    }
-
-                    result = SearchResult(
-                        id=str(paper.id),
-                        type='scientific_paper',
-                        title=paper.title,
-                        description=paper.abstract,
-                        data=metadata
-                    )
+                    result = self._to_result(paper, query, total_count, score)
+                    result._next_cursor = next_cursor
                     results.append(result)
-                    logger.debug(f"Transformed paper {paper.id} into search result")
+                    if debug:
+                        logger.debug("Transformed paper %s into search result", paper.id)
                 except Exception as e:
                     logger.error(f"Error transforming paper {paper.id}: {str(e)}")
                     continue
 
-            logger.debug(f"Successfully transformed {len(results)} papers into search results")
+            logger.debug("Successfully transformed %d papers into search results", len(results))
             return results
 
         except Exception as e:
             logger.error(f"Error in scientific papers search: {str(e)}", exc_info=True)
             raise
 
+    def _search_ranked(self, query: SearchQuery, ranked: RankedPage) -> List[SearchResult]:
+        """Load the papers of a page of BM25-ranked matches by primary key"""
+        page, total_count = ranked.matches, ranked.total
+        next_cursor = None
+        if len(page) > query.per_page:
+            page = page[:query.per_page]
+            next_cursor = encode_cursor(True, page[-1][0], page[-1][1], total_count)
+
+        papers = self.db.query(ScientificPaper)\
+            .options(*self._load_options(query))\
+            .filter(ScientificPaper.id.in_([paper_id for _, paper_id in page]))\
+            .all()
+        papers_by_id = {paper.id: paper for paper in papers}
+
+        # Keep the ranked order; papers deleted since they were ranked are skipped
+        results = []
+        for score, paper_id in page:
+            if paper_id in papers_by_id:
+                result = self._to_result(papers_by_id[paper_id], query, total_count,
+                                         score if score is not None else unranked_score())
+                result._next_cursor = next_cursor
+                results.append(result)
+        logger.debug("Ranked papers out of %d matches, returning %d", total_count, len(results))
+        return results
+
+    def _load_options(self, query: SearchQuery) -> List[Any]:
+        """Loader options for the columns the query's transformer reads"""
+        return projection_options(query, RESULT_COLUMNS, (ScientificPaper.title,))
+
+    def _to_result(self, paper: ScientificPaper, query: SearchQuery, total_count: Optional[int],
+                   score: Optional[float] = None) -> SearchResult:
+        """Convert a scientific paper row into a SearchResult"""
+        metadata = {}
+        if wants(query, 'data'):
+            metadata = {
+                'authors': paper.authors if paper.authors else [],
+                'publication_date': paper.publication_date.isoformat() if paper.publication_date else None,
+                'journal': paper.journal,
+                'doi': paper.doi,
+                'keywords': paper.keywords if paper.keywords else [],
+                'citations_count': paper.citations_count,
+                'references': paper.reference_list if paper.reference_list else []
+            }
+
+        result = SearchResult(
+            id=str(paper.id),
+            type='scientific_paper',
+            title=paper.title,
+            description=paper.abstract if wants(query, 'description') else None,
+            relevance_score=score,
+            data=metadata
+        )
+        result._query = query
+        result._total = total_count
+        return result
+
+    def export(self, query: SearchQuery, chunk_size: int) -> Iterator[List[SearchResult]]:
+        """Every matching paper, by database-side rank or else by id (unranked), read through a server-side cursor"""
+        base_query, rank = self._match_query(query)
+        if rank is not None:
+            base_query = base_query.add_columns(rank.label('rank'))\
+                .order_by(rank.desc().nulls_last(), ScientificPaper.id)
+        else:
+            base_query = base_query.order_by(ScientificPaper.id)
+        base_query = base_query.options(*self._load_options(query))
+
+        for rows in stream_partitions(self.db, base_query, chunk_size):
+            yield [
+                self._to_result(row[0], query, None, row.rank if rank is not None else None)
+                for row in rows
+            ]
+
+    def _match_query(self, query: SearchQuery):
+        """
+        Build the query selecting the papers that match the terms, user context and filters.
+
+        Returns the query and, in fulltext and trigram modes, the relevance expression to order by.
+        """
+        # Build base query
+        base_query = self.db.query(ScientificPaper)
+        logger.debug("Created base query")
+
+        # Relevance of each paper, only set in fulltext and trigram modes
+        rank = None
+
+        # Apply search terms
+        if query.terms and config.SCIENTIFIC_PAPER_SEARCH_MODE == 'fulltext':
+            ts_query = self._fulltext_query(query.terms)
+            base_query = base_query.filter(ScientificPaper.search_vector.op('@@')(ts_query))
+            rank = func.ts_rank_cd(ScientificPaper.search_vector, ts_query)
+            logger.debug("Applied full-text search for terms: %s", query.terms)
+        elif query.terms and config.SCIENTIFIC_PAPER_SEARCH_MODE == 'trigram':
+            trigram_columns = [ScientificPaper.title]
+            set_similarity_threshold(self.db)
+            base_query = base_query.filter(trigram_condition(trigram_columns, query.terms))
+            rank = trigram_similarity(trigram_columns, query.terms)
+            logger.debug("Applied trigram search for terms: %s", query.terms)
+        elif query.terms:
+            search_conditions = []
+            for term in query.terms:
+                term = term.strip().lower()
+                logger.debug("Processing search term: %s", term)
+                term_conditions = [
+                    ScientificPaper.title.ilike(f"%{term}%"),
+                    ScientificPaper.abstract.ilike(f"%{term}%"),
+                    ScientificPaper.journal.ilike(f"%{term}%"),
+                    # Search in keywords JSON array with explicit cast
+                    func.cast(ScientificPaper.keywords, String).ilike(f"%{term}%")
+                ]
+                search_conditions.append(or_(*term_conditions))
+
+            # Combine all conditions with OR
+            base_query = base_query.filter(or_(*search_conditions))
+            logger.debug("Applied search conditions for terms: %s", query.terms)
+
+        # Apply user context based filters (authorization)
+        if query.user_context:
+            logger.debug("Applying authorization filters based on user context")
+            
+            # Example: Filter by access level
+            user_role = query.user_context.get('role', 'user')
+            
+            # Check if user has restricted content access or is an admin
+            has_restricted_access = user_role in ['admin', 'researcher', 'premium']
+            
+            # If the user doesn't have access to restricted content, filter it out
+            if not has_restricted_access:
+                # Example: Filter out papers that require special access
+                base_query = base_query.filter(
+                    or_(
+                        ScientificPaper.is_restricted.is_(None),
+                        ScientificPaper.is_restricted == False
+                    )
+                )
+                logger.debug("Applied restriction filter for user role: %s", user_role)
+                
+            # You could also add organization-based filtering
+            org_id = query.user_context.get('org_id')
+            if org_id and user_role != 'admin':
+                # Example: Only show papers that belong to the user's organization
+                # This is just an example - adjust according to your actual data model
+                base_query = base_query.filter(
+                    or_(
+                        ScientificPaper.organization_id.is_(None),
+                        ScientificPaper.organization_id == org_id
+                    )
+                )
+                logger.debug("Applied organization filter for org_id: %s", org_id)
+
+        # Apply filters
+        if query.filters:
+            filter_conditions = []
+
+            # Journal filter
+            if journal := query.filters.get('journal'):
+                filter_conditions.append(ScientificPaper.journal == journal)
+
+            # Publication date filter
+            if date_range := query.filters.get('date_range'):
+                now = datetime.utcnow()
+                if date_range == 'last_week':
+                    start_date = now - timedelta(weeks=1)
+                elif date_range == 'last_month':
+                    start_date = now - timedelta(days=30)
+                elif date_range == 'last_year':
+                    start_date = now - timedelta(days=365)
+
+                if date_range in ['last_week', 'last_month', 'last_year']:
+                    filter_conditions.append(ScientificPaper.publication_date >= start_date)
+
+            # Citations filter
+            if citations := query.filters.get('citations'):
+                if citations == '0-10':
+                    filter_conditions.append(and_(
+                        ScientificPaper.citations_count >= 0,
+                        ScientificPaper.citations_count <= 10
+                    ))
+                elif citations == '11-50':
+                    filter_conditions.append(and_(
+                        ScientificPaper.citations_count >= 11,
+                        ScientificPaper.citations_count <= 50
+                    ))
+                elif citations == '51-100':
+                    filter_conditions.append(and_(
+                        ScientificPaper.citations_count >= 51,
+                        ScientificPaper.citations_count <= 100
+                    ))
+                elif citations == '100+':
+                    filter_conditions.append(ScientificPaper.citations_count > 100)
+
+            if filter_conditions:
+                base_query = base_query.filter(and_(*filter_conditions))
+                logger.debug("Applied filters: %s", query.filters)
+
+        return base_query, rank
+
+    def _fulltext_query(self, terms: List[str]):
+        """Build a tsquery matching any of the terms, each parsed with websearch syntax"""
+        ts_queries = [
+            func.websearch_to_tsquery(SCIENTIFIC_PAPER_TEXT_SEARCH_CONFIG, term.strip())
+            for term in terms
+        ]
+        return reduce(lambda left, right: left.op('||')(right), ts_queries)
+
+    def get_facets(self, query: SearchQuery) -> Dict[str, List[Dict[str, Any]]]:
+        """Number of matching papers per journal and per citations bucket"""
+        def compute():
+            base_query, _ = self._match_query(query)
+            citations = ScientificPaper.citations_count
+            citation_buckets = case(
+                (and_(citations >= 0, citations <= 10), '0-10'),
+                (and_(citations >= 11, citations <= 50), '11-50'),
+                (and_(citations >= 51, citations <= 100), '51-100'),
+                (citations > 100, '100+')
+            )
+            return grouped_facet_counts(base_query, {'journal': ScientificPaper.journal, 'citations': citation_buckets})
+
+        # Authorization filters depend on the user's role and organization
+        user_context = query.user_context or {}
+        return cached_facets(
+            'scientific_papers', query.terms, query.filters, compute,
+            config.SCIENTIFIC_PAPER_SEARCH_MODE, config.TRIGRAM_SIMILARITY_THRESHOLD,
+            user_context.get('role'), user_context.get('org_id')
+        )
+
     def get_available_filters(self) -> Dict[str, List[str]]:
         """Return available filters for scientific papers"""
         try:
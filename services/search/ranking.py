@@ -0,0 +1,370 @@
+"""
+BM25 relevance ranking with per-field weights (BM25F).
+
+Corpus statistics (document count, document frequencies and field lengths)
+are precomputed per collection and kept current incrementally, so scoring a
+result only needs the result's own text: rows inserted since the last refresh
+are read every RANKING_STATS_REFRESH_SECONDS, updates and deletes made through
+ORM sessions are applied when they commit, and a full rebuild every
+RANKING_STATS_REBUILD_SECONDS catches writes made any other way.
+
+In the SQL search modes only the first RANKING_CANDIDATE_LIMIT matches by id
+are rescored before a page is cut; matches beyond them follow unscored in id
+order, so the ranking is exact for result sets up to the limit and approximate
+past it. The clinical study index ranks every match from its postings.
+"""
+import logging
+import math
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
+from functools import partial
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Query, Session
+from database import SessionLocal
+from models.database_models import ClinicalStudy, ScientificPaper, DataDomainMetadata
+from services.search import config
+from services.search.async_providers import in_event_loop
+from services.search.cursor import CursorKey, decode_cursor, page_offset
+from services.search.single_flight import BackgroundBuild
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# BM25 saturation and length normalisation parameters
+K1 = 1.2
+B = 0.75
+
+# Per-field weights for each collection
+FIELD_WEIGHTS = {
+    'clinical_study': {'title': 3.0, 'drug': 2.0, 'description': 1.0},
+    'scientific_paper': {'title': 3.0, 'keywords': 2.0, 'journal': 1.0, 'abstract': 1.0},
+    'data_domain': {'domain_name': 3.0, 'owner': 1.5, 'description': 1.0},
+}
+
+# Model backing each collection's corpus statistics
+CORPUS_MODELS = {
+    'clinical_study': ClinicalStudy,
+    'scientific_paper': ScientificPaper,
+    'data_domain': DataDomainMetadata,
+}
+
+def tokenize(value: Any) -> List[str]:
+    """Split a text (or a list of texts, e.g. keywords) into lowercase word tokens"""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        value = " ".join(str(item) for item in value if item)
+    return TOKEN_PATTERN.findall(str(value).lower())
+
+def query_tokens(terms: Sequence[str]) -> List[str]:
+    """Distinct tokens of all search terms"""
+    tokens = []
+    for term in terms:
+        for token in tokenize(term):
+            if token not in tokens:
+                tokens.append(token)
+    return tokens
+
+class CorpusStats:
+    """Document frequencies and total field lengths for one collection"""
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = tuple(fields)
+        self.document_count = 0
+        self.document_frequency: Dict[str, int] = {}
+        self.total_field_length: Dict[str, int] = {field: 0 for field in self.fields}
+        self.high_water_id = 0
+        self.built_at = time.monotonic()
+        self.refreshed_at = self.built_at
+        # Set when a committed write could not be applied incrementally
+        self.rebuild_requested = False
+        self._lock = threading.Lock()
+
+    def add_document(self, field_tokens: Dict[str, List[str]]):
+        """Account for a new document"""
+        self._update(field_tokens, 1)
+
+    def remove_document(self, field_tokens: Dict[str, List[str]]):
+        """Remove a document previously passed to add_document"""
+        self._update(field_tokens, -1)
+
+    def _update(self, field_tokens: Dict[str, List[str]], delta: int):
+        with self._lock:
+            self._apply(field_tokens, delta)
+
+    def _apply(self, field_tokens: Dict[str, List[str]], delta: int):
+        self.document_count += delta
+        distinct_tokens = set()
+        for field in self.fields:
+            tokens = field_tokens.get(field, [])
+            self.total_field_length[field] += delta * len(tokens)
+            distinct_tokens.update(tokens)
+        for token in distinct_tokens:
+            frequency = self.document_frequency.get(token, 0) + delta
+            if frequency > 0:
+                self.document_frequency[token] = frequency
+            else:
+                self.document_frequency.pop(token, None)
+
+    def idf(self, token: str) -> float:
+        """Inverse document frequency, always positive"""
+        frequency = self.document_frequency.get(token, 0)
+        return math.log(1 + (self.document_count - frequency + 0.5) / (frequency + 0.5))
+
+    def average_field_length(self, field: str) -> float:
+        """Mean length of a field across the corpus"""
+        if not self.document_count:
+            return 0.0
+        return self.total_field_length[field] / self.document_count
+
+class BM25Scorer:
+    """Scores documents against query tokens using corpus statistics and field weights"""
+
+    def __init__(self, stats: CorpusStats, weights: Dict[str, float], k1: float = K1, b: float = B):
+        self.stats = stats
+        self.weights = weights
+        self.k1 = k1
+        self.b = b
+        self._average_lengths = {field: stats.average_field_length(field) or 1.0 for field in weights}
+
+    def weighted_tf(self, field: str, tf: int, field_length: int) -> float:
+        """Field-weighted, length-normalised term frequency"""
+        norm = 1 - self.b + self.b * field_length / self._average_lengths[field]
+        return self.weights[field] * tf / norm
+
+    def term_score(self, token: str, weighted_tf: float) -> float:
+        """BM25 contribution of one query token given its combined weighted tf"""
+        return self.stats.idf(token) * weighted_tf * (self.k1 + 1) / (self.k1 + weighted_tf)
+
+    def score(self, tokens: Sequence[str], fields: Dict[str, Any]) -> float:
+        """Score one document given the raw values of its weighted fields"""
+        field_counts = {field: Counter(tokenize(fields.get(field))) for field in self.weights}
+        field_lengths = {field: sum(counts.values()) for field, counts in field_counts.items()}
+
+        total = 0.0
+        for token in tokens:
+            weighted_tf = sum(
+                self.weighted_tf(field, counts[token], field_lengths[field])
+                for field, counts in field_counts.items()
+                if counts[token]
+            )
+            if weighted_tf:
+                total += self.term_score(token, weighted_tf)
+        return total
+
+_stats: Dict[str, CorpusStats] = {}
+
+def _load_documents(db: Session, collection_type: str, after_id: int = 0):
+    """Yield (id, field tokens) for documents with an id greater than after_id"""
+    model = CORPUS_MODELS[collection_type]
+    fields = list(FIELD_WEIGHTS[collection_type])
+    rows = db.query(model.id, *[getattr(model, field) for field in fields])\
+        .filter(model.id > after_id)\
+        .order_by(model.id)\
+        .yield_per(1000)
+    for row in rows:
+        yield row[0], {field: tokenize(value) for field, value in zip(fields, row[1:])}
+
+def _build_stats(db: Session, collection_type: str) -> CorpusStats:
+    started = time.monotonic()
+    stats = CorpusStats(FIELD_WEIGHTS[collection_type])
+    for document_id, field_tokens in _load_documents(db, collection_type):
+        stats.add_document(field_tokens)
+        stats.high_water_id = document_id
+    logger.info(
+        f"Built {collection_type} corpus statistics: {stats.document_count} documents "
+        f"in {time.monotonic() - started:.2f}s"
+    )
+    return stats
+
+def _refresh_stats(db: Session, collection_type: str, stats: CorpusStats):
+    """Add documents inserted since the last refresh"""
+    added = 0
+    for document_id, field_tokens in _load_documents(db, collection_type, stats.high_water_id):
+        stats.add_document(field_tokens)
+        stats.high_water_id = document_id
+        added += 1
+    stats.refreshed_at = time.monotonic()
+    if added:
+        logger.debug(f"Added {added} documents to {collection_type} corpus statistics")
+
+def _update_stats(collection_type: str) -> CorpusStats:
+    """Build or refresh a collection's statistics on a dedicated session"""
+    db = SessionLocal()
+    try:
+        stats = _stats.get(collection_type)
+        if stats is None or stats.rebuild_requested or \
+                time.monotonic() - stats.built_at > config.RANKING_STATS_REBUILD_SECONDS:
+            _stats[collection_type] = stats = _build_stats(db, collection_type)
+        else:
+            _refresh_stats(db, collection_type, stats)
+        return stats
+    finally:
+        db.close()
+
+_stats_builds = {
+    collection_type: BackgroundBuild(f'{collection_type}-corpus-stats', partial(_update_stats, collection_type))
+    for collection_type in CORPUS_MODELS
+}
+
+_COLLECTION_OF_MODEL = {model: collection_type for collection_type, model in CORPUS_MODELS.items()}
+
+def _ranked_values(state, collection_type: str, old: bool) -> Optional[Dict[str, Any]]:
+    """
+    Ranked field values of a flushed instance before (old) or after the flush;
+    None when one of them was never loaded and so is unknown.
+    """
+    values = {}
+    for field in FIELD_WEIGHTS[collection_type]:
+        history = state.attrs[field].history
+        if old and history.deleted:
+            values[field] = history.deleted[0]
+        elif not old and history.added:
+            values[field] = history.added[0]
+        elif history.unchanged:
+            values[field] = history.unchanged[0]
+        else:
+            return None
+    return values
+
+@event.listens_for(Session, "after_flush")
+def _collect_document_changes(session, flush_context):
+    """Remember the ranked fields of updated and deleted documents until the transaction commits"""
+    changes = None
+    for instance in list(session.dirty) + list(session.deleted):
+        collection_type = _COLLECTION_OF_MODEL.get(type(instance))
+        if collection_type is None:
+            continue
+        state = inspect(instance)
+        deleted = instance in session.deleted
+        if not deleted and not any(state.attrs[field].history.has_changes() for field in FIELD_WEIGHTS[collection_type]):
+            continue
+        old = _ranked_values(state, collection_type, old=True)
+        new = None if deleted else _ranked_values(state, collection_type, old=False)
+        if changes is None:
+            changes = session.info.setdefault("corpus_changes", [])
+        changes.append((collection_type, state.identity[0], deleted,
+                        {field: tokenize(value) for field, value in old.items()} if old is not None else None,
+                        {field: tokenize(value) for field, value in new.items()} if new is not None else None))
+
+@event.listens_for(Session, "after_commit")
+def _apply_document_changes(session):
+    for collection_type, document_id, deleted, old, new in session.info.pop("corpus_changes", ()):
+        stats = _stats.get(collection_type)
+        if stats is None or document_id > stats.high_water_id:
+            # Not counted yet; the next refresh or build reads the row as it is now
+            continue
+        if old is None or (new is None and not deleted):
+            stats.rebuild_requested = True
+            continue
+        stats.remove_document(old)
+        if not deleted:
+            stats.add_document(new)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_document_changes(session):
+    session.info.pop("corpus_changes", None)
+
+def get_corpus_stats(collection_type: str) -> Optional[CorpusStats]:
+    """
+    Return the corpus statistics for a collection, building them on first use.
+
+    New rows are folded in incrementally every RANKING_STATS_REFRESH_SECONDS and ORM
+    updates and deletes as they commit; a full rebuild every RANKING_STATS_REBUILD_SECONDS,
+    or after a write that could not be applied, accounts for everything else.
+    Builds and refreshes run in the background, one at a time per collection. While
+    one runs, callers keep using the current stats; before the first build finishes,
+    callers wait for it, except on an event loop thread, where they get None.
+    """
+    stats = _stats.get(collection_type)
+    if stats is not None and not stats.rebuild_requested and \
+            time.monotonic() - stats.refreshed_at <= config.RANKING_STATS_REFRESH_SECONDS:
+        return stats
+
+    build = _stats_builds[collection_type].start()
+    if stats is not None:
+        return stats
+    # Waiting on an event loop thread would block every other request
+    if in_event_loop():
+        return None
+    return build.result()
+
+def get_bm25_scorer(collection_type: str) -> Optional[BM25Scorer]:
+    """Return a scorer for the collection, or None when BM25 ranking is disabled or has no stats yet"""
+    if config.SEARCH_RANKING != 'bm25' or collection_type not in FIELD_WEIGHTS:
+        return None
+    stats = get_corpus_stats(collection_type)
+    if stats is None:
+        return None
+    return BM25Scorer(stats, FIELD_WEIGHTS[collection_type])
+
+def unranked_score() -> Optional[float]:
+    """relevance_score of results in database order: 0 under BM25, which leaves only token-less queries unranked"""
+    return 0.0 if config.SEARCH_RANKING == 'bm25' else None
+
+class RankedPage(NamedTuple):
+    """A page of BM25-ranked matches, one longer than per_page when there is a next page"""
+    matches: List[Tuple[Optional[float], int]]  # (score, id); no score past the candidates
+    total: int
+
+def rank_candidates(collection_type: str, query: Any, matches: Query) -> Optional[RankedPage]:
+    """
+    Cut a page from the BM25-ranked matches of a SQL search.
+
+    Only the first RANKING_CANDIDATE_LIMIT matches by id are read with their text
+    and scored; they come first, best first. Matches beyond them follow in id
+    order without a score, the way NULL scores sort last in the database, so a
+    query never rescores more than the limit. None when BM25 ranking is off, the
+    terms have no tokens, or the collection's statistics are still being built
+    on an event loop thread; callers then order by id.
+    """
+    tokens = query_tokens(query.terms)
+    if not tokens:
+        return None
+    scorer = get_bm25_scorer(collection_type)
+    if scorer is None:
+        return None
+    model = CORPUS_MODELS[collection_type]
+    fields = list(FIELD_WEIGHTS[collection_type])
+    limit = config.RANKING_CANDIDATE_LIMIT
+    rows = matches.with_entities(model.id, *[getattr(model, field) for field in fields])\
+        .order_by(model.id)\
+        .limit(limit + 1)\
+        .all()
+    complete = len(rows) <= limit
+    rows = rows[:limit]
+    ranked = [(scorer.score(tokens, dict(zip(fields, row[1:]))), row[0]) for row in rows]
+    ranked.sort(key=lambda match: (-match[0], match[1]))
+
+    after = decode_cursor(query.cursor, ranked=True) if query.cursor else None
+    past_candidates = after is not None and after.score is None
+    offset, page_size = page_offset(query), query.per_page + 1
+    page = [] if past_candidates else ranked_page(ranked, offset, page_size, after)
+    if not complete and len(page) < page_size:
+        # Continue with the unscored matches after the last candidate
+        tail = matches.with_entities(model.id)\
+            .filter(model.id > (after.id if past_candidates else rows[-1][0]))\
+            .order_by(model.id)\
+            .offset(max(offset - len(ranked), 0))\
+            .limit(page_size - len(page))
+        page.extend((None, row[0]) for row in tail)
+
+    if complete:
+        total = len(ranked)
+    elif after is not None and after.total is not None:
+        total = after.total
+    else:
+        total = matches.with_entities(func.count(model.id)).order_by(None).scalar()
+    return RankedPage(page, total)
+
+def ranked_page(ranked: List[Tuple[float, int]], offset: int, limit: int,
+                after: Optional[CursorKey] = None) -> List[Tuple[float, int]]:
+    """One page of (score, id) pairs sorted by score and id, behind `after` when given instead of at `offset`"""
+    if after is not None:
+        offset = bisect_right([(-score, id) for score, id in ranked], (-(after.score or 0.0), after.id))
+    return ranked[offset:offset + limit]
@@ -0,0 +1,52 @@
+"""
+Cache of transformed search responses.
+
+Entries are keyed by a hash of the normalized query: collection, terms,
+filters, pagination, schema and the parts of the user context that change
+what a user may see. Each entry records the versions of the collection's
+tables, so a committed write makes its entries stale at once. Entries are
+shared by all workers when SHARED_CACHE_URL is set; see
+services.search.shared_cache.
+"""
+import hashlib
+import json
+from typing import Any, Dict, Optional, Sequence
+from services.search import config
+from services.search.cache import COLLECTION_TABLES
+from services.search.shared_cache import CacheLookup, SharedCache
+
+# Keys of the user context that providers filter results by
+AUTHORIZATION_KEYS = ('role', 'org_id')
+
+_result_cache = SharedCache(
+    'search_results', config.SEARCH_RESULT_CACHE_MAX_ENTRIES, config.SEARCH_RESULT_CACHE_TTL_SECONDS
+)
+
+def result_cache_key(collection_type: str, terms: Sequence[str], filters: Dict[str, Any], page: int,
+                     per_page: int, schema_type: str, user_context: Optional[Dict[str, Any]] = None,
+                     cursor: Optional[str] = None, include_facets: bool = False,
+                     data_products_per_study: Optional[int] = None) -> str:
+    """
+    Canonical hash of a search request.
+
+    Terms are matched case-insensitively and OR-ed together, so their case,
+    surrounding whitespace, order and duplicates do not change the results.
+    Only the authorization-relevant user context is part of the key, so users
+    with the same role and organization share entries.
+    """
+    normalized_terms = sorted({term.strip().lower() for term in terms if term.strip()})
+    authorization = {key: (user_context or {}).get(key) for key in AUTHORIZATION_KEYS}
+    body = json.dumps(
+        [collection_type, normalized_terms, filters or {},
+         page, per_page, schema_type, authorization, cursor, include_facets, data_products_per_study],
+        sort_keys=True, default=str, separators=(',', ':')
+    )
+    return hashlib.sha256(body.encode()).hexdigest()
+
+def get_cached_result(collection_type: str, key: str) -> CacheLookup:
+    """Look up a response; the lookup's value is None on a miss"""
+    return _result_cache.get(key, COLLECTION_TABLES.get(collection_type, (collection_type,)))
+
+def store_result(key: str, result: Any, lookup: CacheLookup):
+    """Cache a response computed after `lookup`; a zero TTL or size disables the cache"""
+    _result_cache.set(key, result, lookup)
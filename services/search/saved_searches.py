@@ -0,0 +1,127 @@
+"""
+Saved searches and their materialized result snapshots.
+
+A saved search is a search_history row with is_saved set. Its snapshot keeps
+the first page of results (SAVED_SEARCH_SNAPSHOT_SIZE of them) together with
+their ids and the total, so executing a saved search answers from one primary
+key lookup instead of running the search. Snapshots are refreshed lazily: one
+older than SAVED_SEARCH_SNAPSHOT_MAX_AGE_SECONDS is still served, and a
+background refresh is started for it. Only one refresh per saved search runs
+at a time, and it bypasses the result cache so the snapshot is never older
+than the refresh. Federated ('all') saved searches are not snapshotted; they
+are run live on every execution.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models.database_models import SavedSearchSnapshot, SearchHistory
+from services.search import config
+
+logger = logging.getLogger(__name__)
+
+# Collections a saved search can be snapshotted for
+SNAPSHOT_COLLECTIONS = ('clinical_study', 'scientific_paper', 'data_domain')
+
+# Category of federated searches, which are run live instead
+FEDERATED_CATEGORY = 'all'
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def query_terms(query: str) -> List[str]:
+    """Search terms of a stored query, split the way /api/search splits them"""
+    return [term.strip() for term in (query or "").split(' OR ') if term.strip()]
+
+def get_saved_search(db: Session, user_id: int, search_id: int) -> Optional[SearchHistory]:
+    """A user's saved search by id, or None"""
+    return db.query(SearchHistory)\
+        .filter(SearchHistory.id == search_id, SearchHistory.user_id == user_id, SearchHistory.is_saved.is_(True))\
+        .first()
+
+def is_stale(snapshot: SavedSearchSnapshot, now: datetime = None) -> bool:
+    age = (now or datetime.utcnow()) - snapshot.refreshed_at
+    return age > timedelta(seconds=config.SAVED_SEARCH_SNAPSHOT_MAX_AGE_SECONDS)
+
+def _response_total(response: Dict[str, Any]) -> Optional[int]:
+    """The total of a transformed search response, wherever its schema puts it"""
+    pagination = response.get('pagination')
+    if isinstance(pagination, dict):
+        return pagination.get('total')
+    return response.get('total')
+
+def refresh_snapshot(db: Session, entry: SearchHistory, user_context: Dict = None) -> Optional[SavedSearchSnapshot]:
+    """Run a saved search and store its first page as the snapshot; None when it cannot be snapshotted"""
+    from services.search.service import SearchService
+
+    if entry.category not in SNAPSHOT_COLLECTIONS:
+        return None
+
+    # Straight to the providers: a result cached (or single-flighted) before the refresh
+    # started would give the new snapshot the age of the old results
+    schema_type = 'clinical_study_custom' if entry.category == 'clinical_study' else 'default'
+    response = SearchService(db)._search_uncached(
+        entry.category, query_terms(entry.query), entry.filters or {}, 1,
+        config.SAVED_SEARCH_SNAPSHOT_SIZE, schema_type, user_context, None, False
+    )
+    response = jsonable_encoder(response)
+    results = response.get('results') or []
+
+    snapshot = db.query(SavedSearchSnapshot).filter(SavedSearchSnapshot.history_id == entry.id).first()
+    if snapshot is None:
+        snapshot = SavedSearchSnapshot(history_id=entry.id, user_id=entry.user_id)
+        db.add(snapshot)
+    snapshot.result_ids = [result.get('id') for result in results]
+    snapshot.total = _response_total(response)
+    snapshot.first_page = response
+    snapshot.refreshed_at = datetime.utcnow()
+    db.commit()
+    logger.debug("Refreshed snapshot of saved search %s with %d results", entry.id, len(results))
+    return snapshot
+
+async def run_federated(db: Session, entry: SearchHistory, user_context: Dict = None) -> Dict[str, Any]:
+    """First page of a federated saved search, run live"""
+    from services.search.service import SearchService
+
+    return await SearchService(db).federated_search(
+        terms=query_terms(entry.query),
+        filters=entry.filters or {},
+        per_page=config.SAVED_SEARCH_SNAPSHOT_SIZE,
+        user_context=user_context
+    )
+
+def refresh_snapshot_in_background(user_id: int, search_id: int, user_context: Dict = None):
+    """
+    Refresh a snapshot on its own session, unless a refresh of it is already
+    running. Meant for BackgroundTasks, which runs it after the response is sent.
+    """
+    with _refreshing_lock:
+        if search_id in _refreshing:
+            return
+        _refreshing.add(search_id)
+    db = SessionLocal()
+    try:
+        entry = get_saved_search(db, user_id, search_id)
+        if entry is not None:
+            refresh_snapshot(db, entry, user_context)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to refresh snapshot of saved search {search_id}: {str(e)}", exc_info=True)
+    finally:
+        db.close()
+        with _refreshing_lock:
+            _refreshing.discard(search_id)
+
+def snapshot_summary(snapshot: Optional[SavedSearchSnapshot]) -> Optional[Dict[str, Any]]:
+    """Snapshot metadata for API responses"""
+    if snapshot is None:
+        return None
+    return {
+        'result_ids': snapshot.result_ids or [],
+        'total': snapshot.total,
+        'refreshed_at': snapshot.refreshed_at,
+        'stale': is_stale(snapshot)
+    }
@@ -1,11 +1,16 @@
 """
 Search service that coordinates providers and transformers.
 """
-from typing import List, Dict, Any
+from typing import Iterator, List, Dict, Any, Tuple
 from sqlalchemy.orm import Session
 from services.search.base import (
-    SearchQuery, SearchProviderRegistry, SchemaRegistry
+    SearchQuery, SearchResult, SearchProviderRegistry, SchemaRegistry
 )
+from services.search.async_providers import get_async_provider
+from services.search.federated import federated_search
+from services.search.filter_metadata import get_filter_metadata
+from services.search.result_cache import get_cached_result, result_cache_key, store_result
+from services.search.single_flight import AsyncSingleFlight, SingleFlight
 from services.search.providers.clinical_studies import ClinicalStudySearchProvider
 from services.search.providers.scientific_papers import ScientificPaperSearchProvider
 from services.search.providers.data_domain import DataDomainSearchProvider
@@ -17,8 +22,14 @@ from services.search.transformers import (
     DataDomainSchemaTransformer,
     ClinicalStudyCustomTransformer
 )
+import asyncio
 import logging
 
+logger = logging.getLogger(__name__)
+
+_search_flights = SingleFlight('search_single_flight')
+_async_search_flights = AsyncSingleFlight('search_single_flight_async')
+
 class SearchService:
     def __init__(self, db: Session):
         self.db = db
@@ -26,8 +37,6 @@ class SearchService:
 
     def _register_defaults(self):
         """Register default providers and transformers"""
-        logger = logging.getLogger(__name__)
-        
         # Register providers
         SearchProviderRegistry._providers = {
             'clinical_study': ClinicalStudySearchProvider,
@@ -45,9 +54,10 @@ class SearchService:
             'clinical_study_custom': ClinicalStudyCustomTransformer
         }
         
-        logger.debug(f"Registered transformers: {list(SchemaRegistry._transformers.keys())}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Registered transformers: %s", list(SchemaRegistry._transformers))
 
-    def search(self, collection_type: str, terms: List[str], filters: Dict, page: int = 1, per_page: int = 10, schema_type: str = "default", user_context: Dict = None) -> List[Any]:
+    def search(self, collection_type: str, terms: List[str], filters: Dict, page: int = 1, per_page: int = 10, schema_type: str = "default", user_context: Dict = None, cursor: str = None, include_facets: bool = False, data_products_per_study: int = None) -> List[Any]:
         """
         Execute search across specified collection with configurable output schema and filters
         
@@ -59,46 +69,59 @@ class SearchService:
             per_page: Items per page
             schema_type: Type of schema to use for results
             user_context: Optional user context from JWT token for authorization
+            cursor: Optional keyset cursor from a previous page; takes precedence over page
+            include_facets: Add per-value match counts for the collection's filters under 'facets'
+            data_products_per_study: Data products returned per clinical study; defaults to DATA_PRODUCTS_PER_STUDY
             
         Returns:
             List of search results
         """
-        # Add debug logging for the schema_type
-        logger = logging.getLogger(__name__)
-        logger.debug(f"Search service called with collection_type: {collection_type!r}, schema_type: {schema_type!r}")
+        logger.debug("Search service called with collection_type: %r, schema_type: %r", collection_type, schema_type)
         
         # Force clinical_study_custom schema for clinical studies
         if collection_type == 'clinical_study' and schema_type != 'clinical_study_custom':
-            logger.debug(f"Forcing schema_type to 'clinical_study_custom' for clinical studies")
+            logger.debug("Forcing schema_type to 'clinical_study_custom' for clinical studies")
             schema_type = 'clinical_study_custom'
             
-        logger.debug(f"Available transformers: {list(SchemaRegistry._transformers.keys())}")
-        
-        # Get the appropriate provider
-        provider_class = SearchProviderRegistry._providers.get(collection_type)
-        if not provider_class:
-            raise ValueError(f"No provider registered for collection type: {collection_type}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Available transformers: %s", list(SchemaRegistry._transformers))
 
-        # Create provider instance
-        provider = provider_class(self.db)
+        cache_key = result_cache_key(collection_type, terms, filters, page, per_page, schema_type, user_context, cursor, include_facets, data_products_per_study)
+        cached = get_cached_result(collection_type, cache_key)
+        if cached.value is not None:
+            logger.debug("Search served from the result cache")
+            return cached.value
 
-        # Create search query
-        query = SearchQuery(
-            terms=terms,
-            collection_type=collection_type,
-            page=page,
-            per_page=per_page,
-            filters=filters,
-            schema_type=schema_type
+        # Identical searches running concurrently in other threads share one execution
+        transformed_results = _search_flights.do(
+            cache_key,
+            lambda: self._search_uncached(collection_type, terms, filters, page, per_page, schema_type, user_context, cursor, include_facets, data_products_per_study)
         )
-        
-        # Add user context to query if provided
-        if user_context:
-            query.user_context = user_context
+        store_result(cache_key, transformed_results, cached)
+        return transformed_results
+
+    def _search_uncached(self, collection_type: str, terms: List[str], filters: Dict, page: int, per_page: int,
+                         schema_type: str, user_context: Dict, cursor: str, include_facets: bool,
+                         data_products_per_study: int = None) -> Any:
+        """Run a search through its provider and transformer, bypassing the result cache"""
+        provider, query = self._prepare(collection_type, terms, filters, page, per_page, schema_type, user_context, cursor, data_products_per_study)
 
         # Execute search
         results = provider.search(query)
-        logger.debug(f"Search returned {len(results)} results")
+        logger.debug("Search returned %d results", len(results))
+
+        transformer = self._get_transformer(collection_type, schema_type, user_context)
+        transformed_results = transformer.transform(results)
+        if include_facets and isinstance(transformed_results, dict):
+            transformed_results['facets'] = provider.get_facets(query)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Transformed results type: %s", type(transformed_results))
+            logger.debug("Transformed results keys: %s",
+                         list(transformed_results) if isinstance(transformed_results, dict) else 'Not a dict')
+        return transformed_results
+
+    def _get_transformer(self, collection_type: str, schema_type: str, user_context: Dict = None):
+        """Select the transformer for a schema type, forcing the custom one for clinical studies"""
 
         # Get the appropriate transformer with a fallback
         from services.search.transformers import (
@@ -121,13 +144,13 @@ class SearchService:
         }
         
         transformer_class = transformer_map.get(schema_type) or DefaultSchemaTransformer
-        logger.debug(f"Using transformer: {transformer_class.__name__} for schema_type: {schema_type!r}")
+        logger.debug("Using transformer: %s for schema_type: %r", transformer_class.__name__, schema_type)
         
         # Special case for clinical studies - force the custom transformer
         if collection_type == 'clinical_study':
             logger.debug("Clinical study detected, checking if using correct transformer")
             if transformer_class != ClinicalStudyCustomTransformer:
-                logger.debug(f"Wrong transformer! Using {transformer_class.__name__} instead of ClinicalStudyCustomTransformer")
+                logger.debug("Wrong transformer! Using %s instead of ClinicalStudyCustomTransformer", transformer_class.__name__)
                 transformer_class = ClinicalStudyCustomTransformer
                 logger.debug("Forced ClinicalStudyCustomTransformer")
         
@@ -135,18 +158,130 @@ class SearchService:
         # Pass user context to transformer if needed
         if user_context and hasattr(transformer, 'set_user_context'):
             transformer.set_user_context(user_context)
-        transformed_results = transformer.transform(results)
-        logger.debug(f"Transformed results type: {type(transformed_results)}")
-        logger.debug(f"Transformed results keys: {transformed_results.keys() if isinstance(transformed_results, dict) else 'Not a dict'}")
+        return transformer
+
+    async def asearch(self, collection_type: str, terms: List[str], filters: Dict, page: int = 1, per_page: int = 10, schema_type: str = "default", user_context: Dict = None, cursor: str = None, include_facets: bool = False, data_products_per_study: int = None) -> Dict[str, Any]:
+        """
+        Async variant of search that does not block the event loop.
+
+        The provider runs on the asyncpg engine when SEARCH_ASYNC_ENGINE is enabled
+        and asyncpg is available, otherwise in a worker thread on its own session.
+        Takes the same arguments as search.
+        """
+        if collection_type == 'clinical_study':
+            schema_type = 'clinical_study_custom'
+
+        cache_key = result_cache_key(collection_type, terms, filters, page, per_page, schema_type, user_context, cursor, include_facets, data_products_per_study)
+        cached = get_cached_result(collection_type, cache_key)
+        if cached.value is not None:
+            return cached.value
+
+        # Identical searches awaiting concurrently share one execution
+        transformed_results = await _async_search_flights.do(
+            cache_key,
+            lambda: self._asearch_uncached(collection_type, terms, filters, page, per_page, schema_type, user_context, cursor, include_facets, data_products_per_study)
+        )
+        store_result(cache_key, transformed_results, cached)
         return transformed_results
 
+    async def _asearch_uncached(self, collection_type: str, terms: List[str], filters: Dict, page: int, per_page: int,
+                                schema_type: str, user_context: Dict, cursor: str, include_facets: bool,
+                                data_products_per_study: int = None) -> Any:
+        """Async counterpart of _search_uncached"""
+        provider_class = SearchProviderRegistry._providers.get(collection_type)
+        if not provider_class:
+            raise ValueError(f"No provider registered for collection type: {collection_type}")
+        provider = get_async_provider(provider_class)
+        _, query = self._prepare(collection_type, terms, filters, page, per_page, schema_type, user_context, cursor, data_products_per_study)
+
+        if include_facets:
+            results, facets = await asyncio.gather(provider.search(query), provider.get_facets(query))
+        else:
+            results, facets = await provider.search(query), None
+
+        transformed_results = self._get_transformer(collection_type, schema_type, user_context).transform(results)
+        if include_facets and isinstance(transformed_results, dict):
+            transformed_results['facets'] = facets
+        return transformed_results
+
+    def _prepare(self, collection_type: str, terms: List[str], filters: Dict, page: int, per_page: int,
+                 schema_type: str, user_context: Dict = None, cursor: str = None, data_products_per_study: int = None):
+        """Create the provider and the SearchQuery for a search"""
+        # Get the appropriate provider
+        provider_class = SearchProviderRegistry._providers.get(collection_type)
+        if not provider_class:
+            raise ValueError(f"No provider registered for collection type: {collection_type}")
+
+        # Create provider instance
+        provider = provider_class(self.db)
+
+        # Create search query
+        query = SearchQuery(
+            terms=terms,
+            collection_type=collection_type,
+            page=page,
+            per_page=per_page,
+            filters=filters,
+            schema_type=schema_type,
+            cursor=cursor,
+            # Providers load only the columns behind the fields the transformer reads
+            fields=self._get_transformer(collection_type, schema_type).required_fields,
+            data_products_per_study=data_products_per_study
+        )
+        
+        # Add user context to query if provided
+        if user_context:
+            query.user_context = user_context
+        return provider, query
+
+    def export(self, collection_type: str, terms: List[str], filters: Dict, schema_type: str = "default",
+               user_context: Dict = None, chunk_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yield every match of a search as transformed results, chunk_size at a time.
+
+        Bypasses the result cache; pagination fields of the transformer output are dropped.
+        """
+        if collection_type == 'clinical_study':
+            schema_type = 'clinical_study_custom'
+
+        provider, query = self._prepare(collection_type, terms, filters, 1, chunk_size, schema_type, user_context)
+        transformer = self._get_transformer(collection_type, schema_type, user_context)
+        for results in provider.export(query, chunk_size):
+            yield transformer.transform(results)['results']
+
+    def search_results(self, collection_type: str, terms: List[str], filters: Dict, page: int = 1,
+                       per_page: int = 10, user_context: Dict = None) -> List[SearchResult]:
+        """Execute a search and return the provider's SearchResults without transforming them"""
+        provider, query = self._prepare(collection_type, terms, filters, page, per_page, "default", user_context)
+        # Callers use the SearchResults directly, data products included
+        query.fields = None
+        return provider.search(query)
+
+    async def federated_search(self, terms: List[str], filters: Dict, per_page: int = 10, schema_type: str = "default",
+                               user_context: Dict = None, merge: str = "sections") -> Dict[str, Any]:
+        """
+        Search every registered collection concurrently.
+
+        Each collection runs on its own session in a worker thread and is given
+        FEDERATED_SEARCH_DEADLINE_SECONDS; see services.search.federated.
+        """
+        return await federated_search(
+            list(SearchProviderRegistry._providers), terms, filters, per_page,
+            schema_type, user_context, merge
+        )
+
     def get_available_filters(self, collection_type: str) -> Dict[str, List[str]]:
         """Get available filters for a collection type"""
+        filters, _ = self.get_filter_metadata(collection_type)
+        return filters
+
+    def get_filter_metadata(self, collection_type: str) -> Tuple[Dict[str, Any], str]:
+        """Get available filters for a collection type and their ETag, served from the filter cache"""
         if collection_type not in SearchProviderRegistry._providers:
             raise ValueError(f"No provider registered for collection type: {collection_type}")
 
         provider = SearchProviderRegistry._providers[collection_type](self.db)
-        return provider.get_available_filters()
+        return get_filter_metadata(collection_type, provider.get_available_filters)
         
     def get_provider(self, collection_type: str):
         """Get a provider instance for a collection type"""
@@ -0,0 +1,273 @@
+"""
+Search caches shared by all worker processes through a Redis-protocol store.
+
+With SHARED_CACHE_URL set, cached search responses and filter metadata live
+once in Redis instead of once per worker. Entries are JSON, zlib-compressed,
+and carry the versions of the tables they were read from; the versions are
+kept in a Redis hash that every worker bumps on commit, so a write in one
+worker invalidates the entries of all of them. When the store is unreachable
+the caches fall back to the worker's local TTLCache and retry the store after
+SHARED_CACHE_RETRY_SECONDS.
+
+`memory://` selects InMemoryRedis, an in-process stand-in for tests and
+single-worker setups; any client with the same commands (e.g. fakeredis) can
+be installed with set_shared_client.
+"""
+import fnmatch
+import json
+import logging
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+from services.search import config
+from services.search.cache import TTLCache, _caches, on_table_version_bump, table_version
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_KEY = "versions"
+
+class InMemoryRedis:
+    """In-process stand-in implementing the Redis commands used by the shared caches"""
+
+    def __init__(self):
+        self._values: Dict[str, tuple] = {}
+        self._hashes: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def ping(self) -> bool:
+        return True
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._values.get(name)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._values[name]
+                return None
+            return value
+
+    def set(self, name: str, value: bytes, ex: Optional[float] = None) -> bool:
+        with self._lock:
+            self._values[name] = (time.monotonic() + ex if ex else None, value)
+        return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(self._values.pop(name, None) is not None for name in names)
+
+    def scan_iter(self, match: str = "*"):
+        with self._lock:
+            names = [name for name in self._values if fnmatch.fnmatchcase(name, match)]
+        return iter(names)
+
+    def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        with self._lock:
+            values = self._hashes.setdefault(name, {})
+            values[key] = values.get(key, 0) + amount
+            return values[key]
+
+    def hmget(self, name: str, keys: Sequence[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            values = self._hashes.get(name, {})
+            return [str(values[key]).encode() if key in values else None for key in keys]
+
+    def pipeline(self, transaction: bool = True) -> "_InMemoryPipeline":
+        return _InMemoryPipeline(self)
+
+class _InMemoryPipeline:
+    """Queues commands and runs them on execute(), like a redis-py pipeline"""
+
+    def __init__(self, client: InMemoryRedis):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, command: str):
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self) -> List[Any]:
+        commands, self._commands = self._commands, []
+        return [getattr(self._client, command)(*args, **kwargs) for command, args, kwargs in commands]
+
+def _json_default(value: Any) -> Any:
+    # Dates serialize as FastAPI would render them, so cached responses are unchanged
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def encode_value(versions: Sequence[int], value: Any) -> bytes:
+    """Compact JSON of an entry and its table versions, zlib-compressed"""
+    body = json.dumps([list(versions), value], default=_json_default, separators=(',', ':'))
+    return zlib.compress(body.encode(), config.SHARED_CACHE_COMPRESSION_LEVEL)
+
+def decode_value(blob: bytes) -> tuple:
+    """Inverse of encode_value: (versions, value)"""
+    versions, value = json.loads(zlib.decompress(blob))
+    return versions, value
+
+_client = None
+_client_configured = False
+_down_until = 0.0
+_client_lock = threading.Lock()
+
+def set_shared_client(client: Optional[Any]):
+    """Install the client of the shared store, or None to cache locally only"""
+    global _client, _client_configured, _down_until
+    with _client_lock:
+        _client, _client_configured, _down_until = client, True, 0.0
+
+def _create_client(url: str):
+    if url.startswith("memory://"):
+        return InMemoryRedis()
+    import redis
+    return redis.Redis.from_url(
+        url,
+        socket_timeout=config.SHARED_CACHE_SOCKET_TIMEOUT_SECONDS,
+        socket_connect_timeout=config.SHARED_CACHE_SOCKET_TIMEOUT_SECONDS
+    )
+
+def get_shared_client() -> Optional[Any]:
+    """The shared store's client, or None when it is not configured or currently marked down"""
+    global _client, _client_configured
+    if not _client_configured:
+        with _client_lock:
+            if not _client_configured:
+                if config.SHARED_CACHE_URL:
+                    try:
+                        _client = _create_client(config.SHARED_CACHE_URL)
+                    except Exception as e:
+                        logger.warning(f"Shared cache unavailable, caching locally: {str(e)}")
+                _client_configured = True
+    if _client is None or time.monotonic() < _down_until:
+        return None
+    return _client
+
+def mark_shared_down(error: Exception):
+    """Cache locally until the store is retried after SHARED_CACHE_RETRY_SECONDS"""
+    global _down_until
+    _down_until = time.monotonic() + config.SHARED_CACHE_RETRY_SECONDS
+    logger.warning(f"Shared cache failed, caching locally for {config.SHARED_CACHE_RETRY_SECONDS}s: {str(error)}")
+
+def _prefixed(name: str) -> str:
+    return f"{config.SHARED_CACHE_PREFIX}{name}"
+
+def _bump_shared_version(table_name: str):
+    client = get_shared_client()
+    if client is None:
+        return
+    try:
+        client.hincrby(_prefixed(VERSIONS_KEY), table_name, 1)
+    except Exception as e:
+        mark_shared_down(e)
+
+on_table_version_bump(_bump_shared_version)
+
+class CacheLookup(NamedTuple):
+    """Result of SharedCache.get; pass it back to set so the entry records the versions read"""
+    value: Optional[Any]
+    versions: tuple
+    shared: bool
+
+class SharedCache:
+    """
+    Cache whose entries are valid while the versions of their tables are unchanged.
+
+    Entries live in the shared store when it is reachable and in a local
+    TTLCache otherwise; local entries use this worker's table versions.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.local = TTLCache(max_entries, ttl_seconds)
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+        _caches[name] = self
+
+    @property
+    def enabled(self) -> bool:
+        return self.local.enabled
+
+    def _shared_key(self, key: str) -> str:
+        return _prefixed(f"{self.name}:{key}")
+
+    def get(self, key: str, tables: Sequence[str]) -> CacheLookup:
+        """Look up an entry; value is None on a miss or when the tables changed since it was stored"""
+        client = get_shared_client() if self.enabled else None
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.hmget(_prefixed(VERSIONS_KEY), list(tables))
+                pipe.get(self._shared_key(key))
+                raw_versions, blob = pipe.execute()
+                versions = tuple(int(version or 0) for version in raw_versions)
+                if blob is not None:
+                    stored_versions, value = decode_value(blob)
+                    if tuple(stored_versions) == versions:
+                        self.shared_hits += 1
+                        return CacheLookup(value, versions, True)
+                self.shared_misses += 1
+                return CacheLookup(None, versions, True)
+            except Exception as e:
+                self.shared_errors += 1
+                mark_shared_down(e)
+
+        versions = tuple(table_version(table) for table in tables)
+        entry = self.local.get(key)
+        if entry is not None and entry[0] == versions:
+            return CacheLookup(entry[1], versions, False)
+        return CacheLookup(None, versions, False)
+
+    def set(self, key: str, value: Any, lookup: CacheLookup):
+        """Store a value computed after `lookup`, recording the table versions it saw"""
+        if not self.enabled:
+            return
+        if lookup.shared:
+            client = get_shared_client()
+            if client is None:
+                return
+            try:
+                client.set(self._shared_key(key), encode_value(lookup.versions, value), ex=self.ttl_seconds)
+            except Exception as e:
+                self.shared_errors += 1
+                mark_shared_down(e)
+            return
+        self.local.set(key, (lookup.versions, value))
+
+    def pop(self, key: str):
+        """Drop an entry locally and from the shared store"""
+        self.local.pop(key)
+        client = get_shared_client()
+        if client is not None:
+            try:
+                client.delete(self._shared_key(key))
+            except Exception as e:
+                mark_shared_down(e)
+
+    def clear(self):
+        """Drop every entry of this cache locally and from the shared store"""
+        self.local.clear()
+        client = get_shared_client()
+        if client is not None:
+            try:
+                names = list(client.scan_iter(match=self._shared_key("*")))
+                if names:
+                    client.delete(*names)
+            except Exception as e:
+                mark_shared_down(e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring; local counters cover lookups made while the store was unavailable"""
+        return {
+            'backend': 'shared' if get_shared_client() is not None else 'local',
+            'shared_hits': self.shared_hits,
+            'shared_misses': self.shared_misses,
+            'shared_errors': self.shared_errors,
+            'local': self.local.stats()
+        }
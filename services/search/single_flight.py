@@ -0,0 +1,124 @@
+"""
+Request coalescing for identical concurrent searches.
+
+The first caller of a key runs the search; callers that arrive with the same
+key while it is in flight wait for it and share its result (or exception)
+instead of repeating the same count and page queries. Nothing is kept once the
+call finishes; reuse across time is the result cache's job.
+
+BackgroundBuild applies the same idea to the in-process structures that are
+expensive to build (the clinical study index, BM25 corpus statistics): one
+build at a time runs on its own thread, and every caller shares its Future.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from services.search.cache import _caches
+
+logger = logging.getLogger(__name__)
+
+class AsyncSingleFlight:
+    """Coalesces concurrent coroutine calls per key on the event loop"""
+
+    def __init__(self, name: str):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        _caches[name] = self
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Await call(), or the identical call already in flight"""
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            # A task, so one caller disconnecting does not cancel the others' search
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'in_flight': len(self._calls), 'leaders': self.leaders, 'coalesced': self.coalesced}
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesces concurrent blocking calls per key across threads"""
+
+    def __init__(self, name: str):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        _caches[name] = self
+
+    def do(self, key: Hashable, call: Callable[[], Any]) -> Any:
+        """Run call(), or wait for the identical call already running in another thread"""
+        with self._lock:
+            pending = self._calls.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        try:
+            pending.result = call()
+            return pending.result
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            pending.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'in_flight': len(self._calls), 'leaders': self.leaders, 'coalesced': self.coalesced}
+
+class BackgroundBuild:
+    """Runs a build on a daemon thread, at most one at a time"""
+
+    def __init__(self, name: str, build: Callable[[], Any]):
+        self.name = name
+        self._build = build
+        self._future: Optional[Future] = None
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.failures = 0
+
+    def start(self) -> Future:
+        """Start a build unless one is running; returns the Future of the running build"""
+        with self._lock:
+            if self._future is None or self._future.done():
+                self._future = Future()
+                self.builds += 1
+                threading.Thread(target=self._run, args=(self._future,), name=self.name, daemon=True).start()
+            return self._future
+
+    def _run(self, future: Future):
+        try:
+            future.set_result(self._build())
+        except BaseException as e:
+            self.failures += 1
+            logger.error(f"Background build {self.name} failed: {str(e)}", exc_info=True)
+            future.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        running = self._future is not None and not self._future.done()
+        return {'running': running, 'builds': self.builds, 'failures': self.failures}
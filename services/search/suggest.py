@@ -0,0 +1,256 @@
+"""
+In-memory autocomplete index for /api/suggest.
+
+Each collection gets a compressed prefix trie (radix tree) over its titles and
+short names. Every node caches its top-k suggestions by popularity, so a
+completion is a walk down the prefix plus a slice, and never touches the database.
+The indexes are rebuilt in a background thread.
+"""
+import heapq
+import logging
+import math
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models.database_models import ClinicalStudy, ScientificPaper, DataDomainMetadata, SearchHistory, SearchHistoryRollup
+from services.search import config
+from services.search.ranking import TOKEN_PATTERN
+
+logger = logging.getLogger(__name__)
+
+class _TrieNode:
+    __slots__ = ('children', 'entries', 'top')
+
+    def __init__(self):
+        # First character of the edge label -> (edge label, child node)
+        self.children: Dict[str, Tuple[str, "_TrieNode"]] = {}
+        # Suggestions whose key ends at this node
+        self.entries: List[int] = []
+        # Best suggestions in this subtree, highest weight first
+        self.top: List[int] = []
+
+class RadixTrie:
+    """Compressed prefix trie mapping keys to suggestion ids with cached top-k per node"""
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def insert(self, key: str, suggestion_id: int):
+        """Add a key that completes to the given suggestion"""
+        node = self.root
+        while key:
+            edge = node.children.get(key[0])
+            if edge is None:
+                child = _TrieNode()
+                child.entries.append(suggestion_id)
+                node.children[key[0]] = (key, child)
+                return
+
+            label, child = edge
+            common = 0
+            limit = min(len(label), len(key))
+            while common < limit and label[common] == key[common]:
+                common += 1
+
+            if common < len(label):
+                # Split the edge at the first mismatch
+                middle = _TrieNode()
+                middle.children[label[common]] = (label[common:], child)
+                node.children[key[0]] = (label[:common], middle)
+                child = middle
+
+            node = child
+            key = key[common:]
+
+        node.entries.append(suggestion_id)
+
+    def finalize(self, weights: List[float], k: int):
+        """Compute each node's cached top-k, bottom-up"""
+        order: List[_TrieNode] = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(child for _, child in node.children.values())
+
+        for node in reversed(order):
+            candidates = set(node.entries)
+            for _, child in node.children.values():
+                candidates.update(child.top)
+            node.top = heapq.nlargest(k, candidates, key=lambda suggestion_id: weights[suggestion_id])
+
+    def top(self, prefix: str) -> List[int]:
+        """Cached best suggestions for keys starting with the prefix"""
+        node = self.root
+        while prefix:
+            edge = node.children.get(prefix[0])
+            if edge is None:
+                return []
+            label, child = edge
+            if prefix.startswith(label):
+                prefix = prefix[len(label):]
+                node = child
+            elif label.startswith(prefix):
+                # The prefix ends inside this edge, so every key below the child matches
+                return child.top
+            else:
+                return []
+        return node.top
+
+class SuggestionIndex:
+    """Autocomplete index for one collection"""
+
+    def __init__(self, collection_type: str, suggestions: List[Tuple[str, str, float]], k: int):
+        self.collection_type = collection_type
+        self.texts: List[str] = []
+        self.fields: List[str] = []
+        self.weights: List[float] = []
+        self.trie = RadixTrie()
+        self.built_at = time.monotonic()
+
+        seen = {}
+        for text, field, weight in suggestions:
+            text = text.strip()
+            if not text:
+                continue
+            key = (text.lower(), field)
+            if key in seen:
+                # The same text from several rows adds up its popularity
+                self.weights[seen[key]] += weight
+                continue
+            suggestion_id = len(self.texts)
+            seen[key] = suggestion_id
+            self.texts.append(text)
+            self.fields.append(field)
+            self.weights.append(weight)
+            for word_key in self._keys(text):
+                self.trie.insert(word_key, suggestion_id)
+
+        self.trie.finalize(self.weights, k)
+
+    @staticmethod
+    def _keys(text: str) -> Iterator[str]:
+        """
+        The lowercased text from each of its first SUGGEST_MAX_KEY_WORDS word starts,
+        so completions match any of those words without a key per word of long titles
+        """
+        lowered = text.lower()
+        for _, match in zip(range(config.SUGGEST_MAX_KEY_WORDS), TOKEN_PATTERN.finditer(lowered)):
+            yield lowered[match.start():]
+
+    def complete(self, prefix: str, limit: int) -> List[Dict[str, str]]:
+        """Top completions for a prefix, most popular first"""
+        prefix = " ".join(prefix.lower().split())
+        if not prefix:
+            return []
+        suggestions = []
+        seen_texts = set()
+        for suggestion_id in self.trie.top(prefix):
+            text = self.texts[suggestion_id]
+            if text.lower() in seen_texts:
+                continue
+            seen_texts.add(text.lower())
+            suggestions.append({
+                "text": text,
+                "type": self.collection_type,
+                "field": self.fields[suggestion_id]
+            })
+            if len(suggestions) >= limit:
+                break
+        return suggestions
+
+def _popularity(value) -> float:
+    return math.log1p(max(value or 0, 0))
+
+def _search_counts(db: Session, collection_type: str) -> Dict[str, int]:
+    """How often each query text was searched in a collection, including rolled-up history"""
+    counts: Dict[str, int] = {}
+    # Repeats are aggregated into one row per user and month, so count their uses rather than rows
+    for model in (SearchHistory, SearchHistoryRollup):
+        rows = db.query(func.lower(model.query), func.sum(func.greatest(model.use_count, 1)))\
+            .filter(model.category == collection_type)\
+            .group_by(func.lower(model.query))\
+            .all()
+        for query, count in rows:
+            if query:
+                counts[query] = counts.get(query, 0) + count
+    return counts
+
+def _load_suggestions(db: Session, collection_type: str) -> List[Tuple[str, str, float]]:
+    """(text, field, weight) for every suggestion source of a collection"""
+    suggestions = []
+    if collection_type == 'clinical_study':
+        for title, drug, participants in db.query(
+                ClinicalStudy.title, ClinicalStudy.drug, ClinicalStudy.participant_count).yield_per(1000):
+            if title:
+                suggestions.append((title, 'title', 1 + _popularity(participants)))
+            if drug:
+                suggestions.append((drug, 'drug', 1.0))
+    elif collection_type == 'scientific_paper':
+        for title, journal, citations in db.query(
+                ScientificPaper.title, ScientificPaper.journal, ScientificPaper.citations_count).yield_per(1000):
+            if title:
+                suggestions.append((title, 'title', 1 + _popularity(citations)))
+            if journal:
+                suggestions.append((journal, 'journal', 1.0))
+    elif collection_type == 'data_domain':
+        for (domain_name,) in db.query(DataDomainMetadata.domain_name).yield_per(1000):
+            if domain_name:
+                suggestions.append((domain_name, 'domain_name', 1.0))
+
+    # Texts that users actually search for rank higher
+    search_counts = _search_counts(db, collection_type)
+    if search_counts:
+        suggestions = [
+            (text, field, weight + _popularity(search_counts.get(text.lower())))
+            for text, field, weight in suggestions
+        ]
+    return suggestions
+
+SUGGESTION_COLLECTIONS = ('clinical_study', 'scientific_paper', 'data_domain')
+
+_indexes: Dict[str, SuggestionIndex] = {}
+_refresher: Optional[threading.Thread] = None
+_refresher_lock = threading.Lock()
+
+def build_suggestion_indexes():
+    """Rebuild the suggestion index of every collection and swap them in"""
+    db = SessionLocal()
+    try:
+        for collection_type in SUGGESTION_COLLECTIONS:
+            started = time.monotonic()
+            try:
+                suggestions = _load_suggestions(db, collection_type)
+                _indexes[collection_type] = SuggestionIndex(collection_type, suggestions, config.SUGGEST_TOP_K)
+                logger.info(
+                    f"Built {collection_type} suggestion index: {len(suggestions)} entries "
+                    f"in {time.monotonic() - started:.2f}s"
+                )
+            except Exception as e:
+                logger.error(f"Failed to build {collection_type} suggestion index: {str(e)}", exc_info=True)
+                db.rollback()
+    finally:
+        db.close()
+
+def _refresh_loop():
+    while True:
+        build_suggestion_indexes()
+        time.sleep(config.SUGGEST_INDEX_REFRESH_SECONDS)
+
+def start_suggestion_refresher():
+    """Start the background thread that builds and periodically refreshes the indexes"""
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_refresh_loop, name="suggestion-index-refresher", daemon=True)
+            _refresher.start()
+
+def get_suggestion_index(collection_type: str) -> Optional[SuggestionIndex]:
+    """Return the collection's suggestion index, or None while it is still being built"""
+    index = _indexes.get(collection_type)
+    if index is None:
+        start_suggestion_refresher()
+    return index
@@ -5,9 +5,13 @@ from typing import List, Dict, Any
 from services.search.base import SchemaTransformer, SearchResult
 import logging
 
+logger = logging.getLogger(__name__)
+
 class DefaultSchemaTransformer(SchemaTransformer):
     """Default transformer that maintains the basic structure"""
 
+    required_fields = ('id', 'type', 'title', 'description', 'relevance_score', 'data')
+
     def transform(self, results: List[SearchResult]) -> Dict[str, Any]:
         transformed_results = [
             {
@@ -15,6 +19,7 @@ class DefaultSchemaTransformer(SchemaTransformer):
                 'type': result.type,
                 'title': result.title,
                 'description': result.description,
+                'relevance_score': result.relevance_score,
                 'data': result.data
             }
             for result in results
@@ -23,19 +28,25 @@ class DefaultSchemaTransformer(SchemaTransformer):
         # Get pagination info from the first result
         query = results[0]._query if results else None
         total = results[0]._total if results else 0
+        total_accuracy = results[0]._total_accuracy if results else 'exact'
         page = query.page if query else 1
         per_page = query.per_page if query else 10
+        next_cursor = results[0]._next_cursor if results else None
         
         return {
             'results': transformed_results,
             'total': total,  # Total number of results from database
+            'total_accuracy': total_accuracy,  # 'exact', or 'estimated' from planner statistics
             'page': page,  # Current page
-            'per_page': per_page  # Results per page
+            'per_page': per_page,  # Results per page
+            'next_cursor': next_cursor  # Cursor for the next page, None on the last page
         }
 
 class CompactSchemaTransformer(SchemaTransformer):
     """Transformer that provides a minimal response format"""
 
+    required_fields = ('id', 'type', 'title')
+
     def transform(self, results: List[SearchResult]) -> Dict[str, Any]:
         return {
             'results': [
@@ -45,12 +56,15 @@ class CompactSchemaTransformer(SchemaTransformer):
                     'type': result.type
                 }
                 for result in results
-            ]
+            ],
+            'next_cursor': results[0]._next_cursor if results else None
         }
 
 class DetailedSchemaTransformer(SchemaTransformer):
     """Transformer that provides an expanded response format with all data"""
 
+    required_fields = ('id', 'type', 'title', 'description', 'relevance_score', 'data')
+
     def transform(self, results: List[SearchResult]) -> Dict[str, Any]:
         transformed = []
         for result in results:
@@ -58,7 +72,8 @@ class DetailedSchemaTransformer(SchemaTransformer):
                 'id': result.id,
                 'type': result.type,
                 'title': result.title,
-                'description': result.description
+                'description': result.description,
+                'relevance_score': result.relevance_score
             }
 
             # Flatten data into root level
@@ -69,24 +84,31 @@ class DetailedSchemaTransformer(SchemaTransformer):
 
         return {
             'results': transformed,
-            'result_count': len(transformed)
+            'result_count': len(transformed),
+            'next_cursor': results[0]._next_cursor if results else None
         }
 
 class ClinicalStudyCustomTransformer(SchemaTransformer):
     """Custom transformer for clinical studies with specific response format"""
+
+    required_fields = ('id', 'title', 'description', 'relevance_score', 'data', 'data_products')
     
     def transform(self, results: List[SearchResult]) -> Dict[str, Any]:
-        logger = logging.getLogger(__name__)
-        logger.debug(f"ClinicalStudyCustomTransformer.transform called with {len(results)} results")
+        # Checked once: the per-result logs below must cost nothing when DEBUG is off
+        debug = logger.isEnabledFor(logging.DEBUG)
+        logger.debug("ClinicalStudyCustomTransformer.transform called with %d results", len(results))
         
         # Get pagination info from the first result
         query = results[0]._query if results else None
         total = results[0]._total if results else 0
+        total_accuracy = results[0]._total_accuracy if results else 'exact'
         page = query.page if query else 1
         per_page = query.per_page if query else 10
+        next_cursor = results[0]._next_cursor if results else None
         
-        logger.debug(f"Input results types: {type(results[0]) if results else 'No results'}")
-        logger.debug(f"First result fields: {vars(results[0]) if results else 'No results'}")
+        if debug and results:
+            logger.debug("Input results types: %s", type(results[0]))
+            logger.debug("First result fields: %s", vars(results[0]))
         
         transformed_results = []
         for i, result in enumerate(results):
@@ -94,8 +116,10 @@ class ClinicalStudyCustomTransformer(SchemaTransformer):
             
             # Get data_products from result
             data_products = result.data_products or []
-            logger.debug(f"Processing result {i} ID {result.id} with {len(data_products)} data products and {len(data)} data fields")
-            logger.debug(f"Data fields: {list(data.keys())}")
+            if debug:
+                logger.debug("Processing result %d ID %s with %d data products and %d data fields",
+                             i, result.id, len(data_products), len(data))
+                logger.debug("Data fields: %s", list(data))
             
             # Create the restructured result
             transformed_result = {
@@ -125,20 +149,26 @@ class ClinicalStudyCustomTransformer(SchemaTransformer):
         final_result = {
             'pagination': {
                 'total': total,
+                'total_accuracy': total_accuracy,
                 'page': page,
-                'per_page': per_page
+                'per_page': per_page,
+                'next_cursor': next_cursor
             },
             'results': transformed_results
         }
         
-        logger.debug(f"Transformed structure: {list(final_result.keys())}")
-        logger.debug(f"First transformed result keys: {list(transformed_results[0].keys()) if transformed_results else 'No results'}")
+        if debug:
+            logger.debug("Transformed structure: %s", list(final_result))
+            logger.debug("First transformed result keys: %s",
+                         list(transformed_results[0]) if transformed_results else 'No results')
         
         return final_result
 
 class ScientificPaperSchemaTransformer(SchemaTransformer):
     """Specific transformer for scientific paper results with citation formatting"""
 
+    required_fields = ('id', 'type', 'title', 'description', 'relevance_score', 'data')
+
     def transform(self, results: List[SearchResult]) -> Dict[str, Any]:
         transformed_results = []
         for result in results:
@@ -149,6 +179,7 @@ class ScientificPaperSchemaTransformer(SchemaTransformer):
                 'type': result.type,
                 'title': result.title,
                 'description': result.description,
+                'relevance_score': result.relevance_score,
                 'data': {
                     'authors': data.get('authors', []),
                     'publication_date': data.get('publication_date'),
@@ -163,12 +194,16 @@ class ScientificPaperSchemaTransformer(SchemaTransformer):
 
         return {
             'results': transformed_results,
-            'result_count': len(transformed_results)
+            'result_count': len(transformed_results),
+            'total': results[0]._total if results else 0,
+            'next_cursor': results[0]._next_cursor if results else None
         }
 
 class DataDomainSchemaTransformer(SchemaTransformer):
     """Specific transformer for data domain data with schema validation info"""
 
+    required_fields = ('id', 'title', 'description', 'relevance_score', 'data')
+
     def transform(self, results: List[SearchResult]) -> Dict[str, Any]:
         transformed_results = []
         for result in results:
@@ -178,6 +213,7 @@ class DataDomainSchemaTransformer(SchemaTransformer):
                 'id': result.id,
                 'domain_name': result.title,
                 'description': result.description,
+                'relevance_score': result.relevance_score,
                 'schema': {
                     'format': data.get('data_format'),
                     'definition': data.get('schema_definition'),
@@ -195,5 +231,7 @@ class DataDomainSchemaTransformer(SchemaTransformer):
             transformed_results.append(transformed_result)
 
         return {
-            'results': transformed_results
+            'results': transformed_results,
+            'total': results[0]._total if results else 0,
+            'next_cursor': results[0]._next_cursor if results else None
         }
\ No newline at end of file
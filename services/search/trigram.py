@@ -0,0 +1,33 @@
+"""
+Trigram (pg_trgm) matching shared by the search providers.
+
+Substring predicates on columns with a gin_trgm_ops index become index scans,
+and the `%` similarity operator adds typo tolerance on the same index.
+"""
+from typing import List
+from sqlalchemy import or_, func, text
+from sqlalchemy.orm import Session
+from services.search import config
+
+def set_similarity_threshold(db: Session):
+    """Set pg_trgm.similarity_threshold for the current transaction"""
+    db.execute(
+        text("SELECT set_config('pg_trgm.similarity_threshold', :threshold, true)"),
+        {"threshold": str(config.TRIGRAM_SIMILARITY_THRESHOLD)}
+    )
+
+def trigram_condition(columns: List, terms: List[str]):
+    """Match any term as a substring of, or as similar to, any of the columns"""
+    conditions = []
+    for term in terms:
+        for column in columns:
+            conditions.append(column.ilike(f"%{term}%"))
+            conditions.append(column.op('%')(term))
+    return or_(*conditions)
+
+def trigram_similarity(columns: List, terms: List[str]):
+    """Best similarity() between any term and any of the columns"""
+    scores = [func.similarity(column, term) for term in terms for column in columns]
+    if len(scores) == 1:
+        return scores[0]
+    return func.greatest(*scores)